@@ -108,6 +108,12 @@ export async function updateProfile(profileData) {
   });
 }
 
+// Typeahead search over names, emails and phone numbers; friends come first
+export async function searchUsers(query, limit = 8) {
+  const params = new URLSearchParams({ q: query, limit });
+  return await apiCall(`/users/search?${params}`);
+}
+
 // Friend request API functions
 export async function sendFriendRequest(friendEmail) {
   return await apiCall('/friends/request', {
@@ -198,8 +204,22 @@ export async function getSafetyStatus(userId) {
   return await apiCall(`/emergency/status/${userId}`);
 }
 
-export async function getAlerts() {
-  return await apiCall('/emergency/alerts');
+export async function getAlerts(sinceId = null) {
+  const query = sinceId ? `?since_id=${sinceId}` : '';
+  return await apiCall(`/emergency/alerts${query}`);
+}
+
+// Real-time updates
+export function openEventStream() {
+  // EventSource cannot set headers, so the session token goes in the URL
+  if (!sessionToken || typeof EventSource === 'undefined') {
+    return null;
+  }
+  return new EventSource(`${API_BASE_URL}/events/stream?token=${encodeURIComponent(sessionToken)}`);
+}
+
+export async function getChanges(since = 0) {
+  return await apiCall(`/events/changes?since=${since}`);
 }
 
 // Health check
@@ -164,6 +164,7 @@ class SafeSphereApp {
     
     // Form submissions
     document.getElementById('friendForm').addEventListener('submit', (e) => this.handleAddFriend(e));
+    document.getElementById('friendName').addEventListener('input', (e) => this.suggestFriends(e.target.value));
     document.getElementById('locationForm').addEventListener('submit', (e) => this.handleAddLocation(e));
     
     // Emergency buttons
@@ -241,7 +242,15 @@ class SafeSphereApp {
 
   async loadAlerts() {
     try {
-      this.alerts = await api.getAlerts();
+      // After the first load only ask for alerts newer than the last one seen
+      const lastAlert = this.alerts[this.alerts.length - 1];
+      if (lastAlert) {
+        const newAlerts = await api.getAlerts(lastAlert.id);
+        if (newAlerts.length === 0) return;
+        this.alerts = this.alerts.concat(newAlerts).slice(-100);
+      } else {
+        this.alerts = await api.getAlerts();
+      }
       this.renderAlerts();
     } catch (error) {
       console.error('Failed to load alerts:', error);
@@ -582,6 +591,40 @@ class SafeSphereApp {
     }
   }
 
+  // Typeahead for the friend form: search once typing pauses, and fill in
+  // the email when a suggestion is picked
+  suggestFriends(query) {
+    const picked = (this.friendSuggestions || []).find(user => user.name === query);
+    if (picked) {
+      document.getElementById('friendEmail').value = picked.email;
+      return;
+    }
+    clearTimeout(this.friendSearchTimer);
+    if (query.trim().length < 2) {
+      return;
+    }
+    this.friendSearchTimer = setTimeout(async () => {
+      const searchId = this.friendSearchId = (this.friendSearchId || 0) + 1;
+      try {
+        const users = await api.searchUsers(query.trim());
+        // A slower, older search must not replace newer suggestions
+        if (searchId !== this.friendSearchId) {
+          return;
+        }
+        this.friendSuggestions = users;
+        const list = document.getElementById('friendSuggestions');
+        list.replaceChildren(...users.map(user => {
+          const option = document.createElement('option');
+          option.value = user.name;
+          option.label = user.is_friend ? `${user.email} (friend)` : user.email;
+          return option;
+        }));
+      } catch (error) {
+        console.error('Failed to search users:', error);
+      }
+    }, 200);
+  }
+
   async handleAddFriend(e) {
     e.preventDefault();
     
@@ -823,18 +866,45 @@ class SafeSphereApp {
   }
 
   startPeriodicUpdates() {
-    // Update data every 30 seconds
-    setInterval(async () => {
-      try {
-        await this.loadFriends();
+    // Prefer the server push channel and only reload what changed
+    const stream = api.openEventStream();
+    if (stream) {
+      stream.addEventListener('status', () => this.loadFriends());
+      stream.addEventListener('alert', () => this.loadAlerts());
+      stream.addEventListener('friend_request', () => this.loadFriendRequests());
+      stream.addEventListener('friend_request_updated', async () => {
         await this.loadFriendRequests();
-        await this.loadLocations();
-        await this.loadAlerts();
-        this.updateSafetyStatus();
-      } catch (error) {
-        console.error('Periodic update failed:', error);
-      }
-    }, 30000);
+        await this.loadFriends();
+      });
+      stream.addEventListener('location', () => this.loadLocations());
+      stream.addEventListener('locations', () => this.loadLocations());
+      stream.addEventListener('resync', () => this.refreshAll());
+      stream.onerror = () => {
+        // The browser retries on its own; poll only if it gave up for good
+        if (stream.readyState === EventSource.CLOSED) {
+          this.startPolling();
+        }
+      };
+      return;
+    }
+    this.startPolling();
+  }
+
+  startPolling() {
+    // Update data every 30 seconds
+    setInterval(() => this.refreshAll(), 30000);
+  }
+
+  async refreshAll() {
+    try {
+      await this.loadFriends();
+      await this.loadFriendRequests();
+      await this.loadLocations();
+      await this.loadAlerts();
+      this.updateSafetyStatus();
+    } catch (error) {
+      console.error('Periodic update failed:', error);
+    }
   }
 }
 
@@ -0,0 +1,114 @@
+"""Per-user alert inboxes with cursor reads.
+
+Alerts are fanned out when they are written: the author and everyone who has
+the author as a friend get the alert appended to their own inbox. Reading a
+feed is then a binary search for the cursor plus a slice, so its cost depends
+on the page size and not on how many alerts exist overall.
+"""
+import bisect
+import threading
+
+
+class BoundedFeed:
+    """Id-ordered items keeping only the newest `capacity` entries.
+
+    Items are held in two parallel lists (ids and items) so a cursor can be
+    found with `bisect`. Old entries are trimmed in one slice once the lists
+    reach twice the capacity, which keeps appends amortised O(1).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._ids = []
+        self._items = []
+        self._trimmed_id = 0
+
+    def __len__(self):
+        return min(len(self._ids), self.capacity)
+
+    @property
+    def last_id(self):
+        return self._ids[-1] if self._ids else 0
+
+    @property
+    def floor_id(self):
+        """Newest id that has fallen out of the feed (0 if nothing has)"""
+        hidden = len(self._ids) - self.capacity
+        if hidden > 0:
+            return self._ids[hidden - 1]
+        return self._trimmed_id
+
+    def append(self, item_id, item):
+        if self._ids and item_id <= self._ids[-1]:
+            self._insert(item_id, item)
+            return
+        self._ids.append(item_id)
+        self._items.append(item)
+        if len(self._ids) >= 2 * self.capacity:
+            self._trim()
+
+    def extend_sorted(self, pairs):
+        """Merge (id, item) pairs that may predate what is already here"""
+        for item_id, item in pairs:
+            self._insert(item_id, item)
+        self._trim()
+
+    def _insert(self, item_id, item):
+        index = bisect.bisect_left(self._ids, item_id)
+        if index < len(self._ids) and self._ids[index] == item_id:
+            return
+        self._ids.insert(index, item_id)
+        self._items.insert(index, item)
+
+    def _trim(self):
+        excess = len(self._ids) - self.capacity
+        if excess > 0:
+            self._trimmed_id = max(self._trimmed_id, self._ids[excess - 1])
+            del self._ids[:excess]
+            del self._items[:excess]
+
+    def read(self, since_id=None, limit=None):
+        """Items after `since_id` (oldest first), or the newest `limit` items"""
+        start = max(len(self._ids) - self.capacity, 0)
+        if since_id is not None:
+            start = max(start, bisect.bisect_right(self._ids, since_id))
+            end = len(self._ids) if limit is None else start + limit
+        else:
+            end = len(self._ids)
+            if limit is not None:
+                start = max(start, end - limit)
+        return self._items[start:end]
+
+
+class AlertInbox:
+    """Bounded per-user alert feeds"""
+
+    def __init__(self, capacity=500):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._feeds = {}
+
+    def _feed(self, user_id):
+        feed = self._feeds.get(user_id)
+        if feed is None:
+            feed = self._feeds[user_id] = BoundedFeed(self.capacity)
+        return feed
+
+    def deliver(self, alert, user_ids):
+        """Append an alert to the inbox of every user in `user_ids`"""
+        with self._lock:
+            for user_id in user_ids:
+                self._feed(user_id).append(alert["id"], alert)
+
+    def backfill(self, user_id, alerts):
+        """Merge earlier alerts into a feed, e.g. when a new friend is added"""
+        recent = alerts[-self.capacity:]
+        with self._lock:
+            self._feed(user_id).extend_sorted((alert["id"], alert) for alert in recent)
+
+    def read(self, user_id, since_id=None, limit=None):
+        with self._lock:
+            feed = self._feeds.get(user_id)
+            if feed is None:
+                return []
+            return feed.read(since_id, limit)
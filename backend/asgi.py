@@ -0,0 +1,324 @@
+"""ASGI entry point for production serving.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+    python asgi.py
+
+The routes that spend most of their time waiting are served directly on the
+event loop: the server-sent event stream (`GET /events/stream`) and weather
+(`GET /weather/<lat>/<lon>`), whose upstream call is awaited. An idle stream
+then costs a coroutine and a socket, not a thread, so one process can hold
+tens of thousands of them. Every other route runs the Flask app from
+`flask_main` unchanged on a bounded thread pool (`ASGI_WSGI_THREADS`).
+
+The in-memory store, caches and event bus live in this process, so run one
+worker unless `DATABASE_URL` points at SQLite (see the README).
+"""
+import asyncio
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import flask_main
+from response_cache import dumps
+
+WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "32"))
+_DONE = object()
+
+# Headers flask-cors would add to these routes (CORS(app) allows any origin)
+CORS_HEADERS = [(b"access-control-allow-origin", b"*")]
+
+
+class WsgiBridge:
+    """Serves ASGI requests with a WSGI app running on a thread pool.
+
+    A response that states its length (anything not streamed) is collected
+    in one trip to the pool. Streamed responses are forwarded chunk by chunk,
+    with the worker thread only held while the next chunk is produced.
+    """
+
+    def __init__(self, wsgi_app, threads=32):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        body = io.BytesIO()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.write(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        environ = self.environ(scope, body)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                  for name, value in headers]
+            started["sized"] = any(name.lower() == "content-length" for name, _ in headers)
+
+        def run():
+            iterable = self.wsgi_app(environ, start_response)
+            if not started.get("sized"):
+                return None, iterable
+            try:
+                return b"".join(iterable), None
+            finally:
+                close = getattr(iterable, "close", None)
+                if close is not None:
+                    close()
+
+        content, iterable = await loop.run_in_executor(self.executor, run)
+        if iterable is None:
+            await send({"type": "http.response.start", "status": started["status"],
+                        "headers": started["headers"]})
+            await send({"type": "http.response.body", "body": content})
+            return
+
+        iterator = iter(iterable)
+        try:
+            # Werkzeug calls start_response before returning, but WSGI lets
+            # an app defer it until the first chunk
+            chunk = await loop.run_in_executor(self.executor, next, iterator, _DONE)
+            await send({"type": "http.response.start", "status": started["status"],
+                        "headers": started["headers"]})
+            while chunk is not _DONE:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self.executor, next, iterator, _DONE)
+            await send({"type": "http.response.body"})
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                await loop.run_in_executor(self.executor, close)
+
+    @staticmethod
+    def environ(scope, body):
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+            "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+            "QUERY_STRING": scope["query_string"].decode("latin1"),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "SERVER_NAME": scope.get("server", ("localhost", 80))[0],
+            "SERVER_PORT": str(scope.get("server", ("localhost", 80))[1]),
+            "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False
+        }
+        for name, value in scope["headers"]:
+            name = name.decode("latin1").upper().replace("-", "_")
+            if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                name = "HTTP_" + name
+            value = value.decode("latin1")
+            environ[name] = f"{environ[name]},{value}" if name in environ else value
+        return environ
+
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin1")
+    return None
+
+
+def query_param(scope, name):
+    values = parse_qs(scope["query_string"].decode("latin1")).get(name)
+    return values[0] if values else None
+
+
+async def send_json(send, status, payload, headers=()):
+    body = dumps(payload)
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        *CORS_HEADERS, *headers
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def rate_limited(scope, send, endpoint):
+    """Send a 429 and return True when the request is over a rate limit"""
+    session_token = (header(scope, b"authorization") or "").replace("Bearer ", "")
+    # Resolved from X-Forwarded-For like the Flask routes, or behind a proxy
+    # every client would share the proxy's bucket
+    remote_addr = flask_main.client_address(
+        (scope.get("client") or ("", 0))[0],
+        ",".join(value.decode("latin1") for key, value in scope["headers"] if key == b"x-forwarded-for")
+    )
+    retry_after = flask_main.rate_limit_wait(endpoint, remote_addr, session_token)
+    if retry_after is None:
+        return False
+    await send_json(send, 429, {"error": "Too many requests", "retry_after": retry_after},
+                    [(b"retry-after", str(retry_after).encode())])
+    return True
+
+
+async def timed(endpoint, handler, scope, receive, send, *args):
+    """Run a native route under `flask_main.request_metrics`, as Flask's
+    request hooks do for the rest. Timing stops once the response has
+    started, so a long-lived stream counts as one quick request"""
+    metrics = flask_main.request_metrics
+    started = metrics.start(endpoint)
+    finished = False
+
+    async def send_timed(message):
+        nonlocal finished
+        if message["type"] == "http.response.start" and not finished:
+            finished = True
+            metrics.finish(endpoint, scope["method"], message["status"], started)
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_timed, *args)
+    finally:
+        if not finished:
+            metrics.finish(endpoint, scope["method"], 500, started)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream_events(scope, receive, send):
+    """`GET /events/stream` on the event loop; see `flask_main.stream_events`"""
+    if await rate_limited(scope, send, "stream_events"):
+        return
+    session_token = (header(scope, b"authorization") or "").replace("Bearer ", "")
+    current_user = flask_main.user_for_token(session_token)
+    if not current_user:
+        # EventSource cannot send headers, so the token may come as ?token=
+        current_user = flask_main.user_for_token(query_param(scope, "token") or "")
+    if not current_user:
+        await send_json(send, 401, {"error": "Not authenticated"})
+        return
+
+    user_id = current_user["id"]
+    last_event_id = header(scope, b"last-event-id")
+    last_version = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    event_bus = flask_main.event_bus
+    subscription = event_bus.subscribe_async(user_id)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    disconnected.add_done_callback(lambda _: subscription.close())
+
+    async def emit(text):
+        await send({"type": "http.response.body", "body": text.encode(), "more_body": True})
+
+    try:
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+            *CORS_HEADERS
+        ]})
+        await emit("retry: 5000\n\n")
+        seen = 0
+        if last_version is not None:
+            missed, complete, _ = event_bus.changes_since(user_id, last_version)
+            if not complete:
+                await emit(flask_main.format_event({"version": None, "type": "resync", "data": {}}))
+            for event in missed:
+                await emit(flask_main.format_event(event))
+                seen = event["version"]
+        while not subscription.closed:
+            events = await subscription.get_async(flask_main.EVENT_HEARTBEAT_SECONDS)
+            if subscription.closed:
+                break
+            if not events:
+                await emit(": heartbeat\n\n")
+                continue
+            # Skip anything already replayed from history above
+            frames = [flask_main.format_event(event) for event in events
+                      if event["version"] is None or event["version"] > seen]
+            if frames:
+                await emit("".join(frames))
+        await send({"type": "http.response.body"})
+    except OSError:
+        pass  # the client went away mid-write
+    finally:
+        disconnected.cancel()
+        event_bus.unsubscribe(subscription)
+
+
+async def weather(scope, receive, send, lat, lon):
+    """`GET /weather/<lat>/<lon>` with the upstream call awaited"""
+    if await rate_limited(scope, send, "get_weather_data"):
+        return
+    try:
+        lat_float, lon_float = float(lat), float(lon)
+    except ValueError:
+        await send_json(send, 400, {"error": "Invalid coordinates"})
+        return
+    api_key = flask_main.OPENWEATHER_API_KEY
+    if not api_key or api_key == "demo_key":
+        await send_json(send, 200, flask_main.mock_weather(lat_float, lon_float, "Mock Data (No API Key)"))
+        return
+    try:
+        conditions = await flask_main.weather_cache.get_async(
+            lat_float, lon_float, flask_main.fetch_openweather_async
+        )
+        payload = flask_main.weather_payload(lat_float, lon_float, conditions)
+    except Exception as e:
+        payload = flask_main.weather_fallback(lat_float, lon_float, e)
+    await send_json(send, 200, payload)
+
+
+WEATHER_PATH = re.compile(r"^/weather/([-+0-9.eE]+)/([-+0-9.eE]+)$")  # not /weather/cache/stats
+wsgi = WsgiBridge(flask_main.app, WSGI_THREADS)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            flask_main.disaster_feed.stop()
+            await flask_main.upstream.aclose()
+            flask_main.password_hasher.shutdown()
+            wsgi.executor.shutdown(wait=False)
+            if hasattr(flask_main.store, "close"):
+                flask_main.store.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if scope["method"] == "GET":
+        path = scope["path"]
+        if path == "/events/stream":
+            await timed("stream_events", stream_events, scope, receive, send)
+            return
+        match = WEATHER_PATH.match(path)
+        if match:
+            await timed("get_weather_data", weather, scope, receive, send, *match.groups())
+            return
+    await wsgi(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    print("🚀 Starting SafeSphere Backend (ASGI)...")
+    print("📍 API will be available at: http://localhost:5000")
+    print("=" * 50)
+    
+    uvicorn.run("asgi:app", host="0.0.0.0", port=5000, backlog=4096)
@@ -0,0 +1,462 @@
+"""End-to-end API load test against a seeded synthetic population.
+
+Seeds `--users` users clustered around population centres, a friend graph
+with a heavy-tailed degree distribution (most people follow a handful of
+others, a few are followed by hundreds), pending friend requests, saved
+places and past alerts. Then it drives the real routes in two scenarios:
+
+- `poll`: every active user repeats the frontend's `refreshAll()` polling
+  round (friends, friend requests, locations, then alerts newer than the
+  last one seen). List responses are revalidated with `If-None-Match`, as
+  the browser cache does.
+- `burst`: the same polling, while `--burst` of the active users raise an
+  emergency alert at the same moment, fanning out to their followers.
+
+Targets are `client` (the Flask test client in this process), `threaded`
+(a real local Flask server) and `asgi` (uvicorn). Each target is seeded
+from scratch. The report gives throughput and p50/p99/p99.9 latency per
+route. `--output` writes it as JSON, and `--compare` prints the change from
+an earlier JSON file:
+
+    python benchmarks/bench_api.py --users 20000 --output before.json
+    python benchmarks/bench_api.py --users 20000 --compare before.json
+    python benchmarks/bench_api.py --targets asgi --store sqlite --scenarios burst
+
+The population, the active users and every worker's request order all come
+from `--seed`, so runs with the same arguments send the same requests. The
+load generator shares the machine (and, for `client`, the interpreter) with
+the server, so compare runs made on the same host.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import datetime
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+PASSWORD = "bench-password"
+
+
+def seed_population(flask_main, args):
+    """Fill `flask_main.store` and return `[(user_id, session_token)]` for the active users"""
+    from passwords import PasswordHasher
+    from records import now_us
+
+    rng = random.Random(args.seed)
+    store = flask_main.store
+    # Every user shares one hash; hashing each would dominate seeding
+    password_hash = PasswordHasher(workers=0).hash(PASSWORD)
+    centres = [(rng.uniform(-45, 60), rng.uniform(-160, 160)) for _ in range(50)]
+    homes = []
+    user_ids = []
+    for i in range(args.users):
+        lat, lon = rng.choice(centres)
+        home = (round(lat + rng.gauss(0, 0.5), 5), round(lon + rng.gauss(0, 0.5), 5))
+        user = store.add_user({
+            "name": f"User {i}",
+            "email": f"user{i}@bench.example.com",
+            "phone": None,
+            "password_hash": password_hash,
+            "is_safe": True,
+            "status": "safe",
+            "last_safe_update": now_us(),
+            "created_at": now_us(),
+            "latitude": home[0],
+            "longitude": home[1]
+        })
+        homes.append(home)
+        user_ids.append(user["id"])
+
+    # Lognormal out-degree around --friends, with partners picked in
+    # proportion to their own degree, so popular users gather followers
+    degrees = [min(args.max_friends, max(1, round(rng.lognormvariate(math.log(args.friends), 0.9))))
+               for _ in user_ids]
+    cum_weights = list(itertools.accumulate(degrees))
+    created_at = datetime.utcnow().isoformat()
+    for user_id, degree in zip(user_ids, degrees):
+        friends = set(rng.choices(user_ids, cum_weights=cum_weights, k=degree))
+        friends.discard(user_id)
+        for friend_id in sorted(friends):
+            store.add_friend_connection(user_id, friend_id, "accepted", created_at)
+
+    for user_id, home in zip(user_ids, homes):
+        store.add_locations([
+            {"user_id": user_id, "name": f"Place {n}", "type": "other", "created_at": now_us(),
+             "latitude": round(home[0] + rng.gauss(0, 0.05), 5),
+             "longitude": round(home[1] + rng.gauss(0, 0.05), 5)}
+            for n in range(rng.randint(0, 2 * args.locations))
+        ])
+
+    for _ in range(int(args.users * args.alerts)):
+        alert_type, message = flask_main.STATUS_ALERTS[rng.choice(["alert", "danger"])]
+        store.add_alert({"user_id": rng.choice(user_ids), "type": alert_type,
+                         "message": message, "created_at": now_us()})
+
+    active = rng.sample(user_ids, min(args.active, len(user_ids)))
+    for user_id in active:
+        for sender in rng.sample(user_ids, rng.randint(0, 3)):
+            if sender != user_id:
+                store.add_friend_request(sender, user_id, created_at)
+    return [(user_id, flask_main.sessions.create(user_id)) for user_id in active]
+
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers):
+        response = self.client.open(path, method=method, headers=headers)
+        return response.status_code, response.headers.get("ETag"), response.get_data()
+
+
+class HTTPTransport:
+    """One keep-alive connection, reopened when the server closes it"""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = None
+
+    def request(self, method, path, headers):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            self.connection.request(method, path, headers=headers)
+            response = self.connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return 0, None, b""
+        if response.will_close:
+            self.connection.close()
+            self.connection = None
+        return response.status, response.getheader("ETag"), body
+
+
+class VirtualUser:
+    """A signed-in browser tab: its session, cached ETags and last alert seen"""
+
+    def __init__(self, user_id, token):
+        self.user_id = user_id
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.etags = {}
+        self.last_alert_id = None
+
+
+class Recorder:
+    """Latencies and error counts per route, kept only once measuring starts"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.measuring = False
+
+    def call(self, transport, user, method, path, route):
+        headers = dict(user.headers)
+        if path in user.etags:
+            headers["If-None-Match"] = user.etags[path]
+        started = time.perf_counter()
+        status, etag, body = transport.request(method, path, headers)
+        elapsed = time.perf_counter() - started
+        if etag:
+            user.etags[path] = etag
+        if self.measuring:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if not (200 <= status < 400):
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, body
+
+
+def refresh_all(recorder, transport, user):
+    """The frontend's polling round (`refreshAll` in Frontend/script.js)"""
+    recorder.call(transport, user, "GET", "/friends/", "GET /friends/")
+    recorder.call(transport, user, "GET", "/friends/requests", "GET /friends/requests")
+    recorder.call(transport, user, "GET", "/locations/", "GET /locations/")
+    if user.last_alert_id is None:
+        status, body = recorder.call(transport, user, "GET", "/emergency/alerts", "GET /emergency/alerts")
+    else:
+        status, body = recorder.call(transport, user, "GET", f"/emergency/alerts?since_id={user.last_alert_id}",
+                                     "GET /emergency/alerts?since_id=")
+    if status == 200:
+        alerts = json.loads(body)
+        if alerts:
+            user.last_alert_id = alerts[-1]["id"]
+
+
+def run_scenario(scenario, make_transport, sessions, args):
+    """Closed-loop workers polling as the active users; returns the measured samples"""
+    rng = random.Random(args.seed)
+    users = [VirtualUser(user_id, token) for user_id, token in sessions]
+    rng.shuffle(users)
+    alerting = deque()
+    if scenario == "burst":
+        alerting.extend(rng.sample(users, max(1, int(len(users) * args.burst))))
+    release = threading.Event()
+    stop = threading.Event()
+    recorders = [Recorder() for _ in range(args.concurrency)]
+    burst = {"total": len(alerting), "sent": 0, "done_at": None}
+    burst_lock = threading.Lock()
+
+    def worker(index):
+        transport = make_transport()
+        recorder = recorders[index]
+        own = users[index::args.concurrency] or users
+        for user in itertools.cycle(own):
+            if stop.is_set():
+                break
+            recorder.measuring = release.is_set()
+            if alerting and release.is_set():
+                try:
+                    sender = alerting.popleft()
+                except IndexError:
+                    continue
+                recorder.call(transport, sender, "POST", f"/emergency/alert/{sender.user_id}",
+                              "POST /emergency/alert/<id>")
+                with burst_lock:
+                    burst["sent"] += 1
+                    if burst["sent"] == burst["total"]:
+                        burst["done_at"] = time.perf_counter()
+                continue
+            refresh_all(recorder, transport, user)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    release.set()
+    measure_started = time.perf_counter()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - measure_started
+
+    latencies, errors = {}, {}
+    for recorder in recorders:
+        for route, samples in recorder.latencies.items():
+            latencies.setdefault(route, []).extend(samples)
+        for route, count in recorder.errors.items():
+            errors[route] = errors.get(route, 0) + count
+    extra = {}
+    if scenario == "burst":
+        extra["burst_alerts"] = burst["total"]
+        extra["burst_drain_s"] = round(burst["done_at"] - measure_started, 4) if burst["done_at"] else None
+    return latencies, errors, elapsed, extra
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))] if samples else 0.0
+
+
+def summarise(target, scenario, latencies, errors, elapsed):
+    rows = []
+    everything = sorted(itertools.chain.from_iterable(latencies.values()))
+    for route, samples in sorted(latencies.items()) + [("all", everything)]:
+        samples = sorted(samples)
+        rows.append({
+            "target": target,
+            "scenario": scenario,
+            "route": route,
+            "requests": len(samples),
+            "errors": sum(errors.values()) if route == "all" else errors.get(route, 0),
+            "rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(percentile(samples, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+            "p999_ms": round(percentile(samples, 0.999) * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3) if samples else 0.0
+        })
+    return rows
+
+
+def serve(args):
+    """`--serve` mode: seed this process's store, report the sessions, then serve"""
+    import flask_main
+
+    sessions = seed_population(flask_main, args)
+    with open(args.ready_file + ".tmp", "w") as f:
+        json.dump(sessions, f)
+    os.replace(args.ready_file + ".tmp", args.ready_file)
+    if args.serve == "asgi":
+        import uvicorn
+        import asgi
+        uvicorn.run(asgi.app, host="127.0.0.1", port=args.port, log_level="warning", backlog=4096)
+    else:
+        flask_main.app.run(host="127.0.0.1", port=args.port, threaded=True)
+
+
+def start_server(mode, port, args, workdir):
+    ready_file = os.path.join(workdir, "sessions.json")
+    command = [sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port),
+               "--ready-file", ready_file] + population_args(args)
+    server = subprocess.Popen(command, cwd=BACKEND, env=server_env(args, workdir),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + args.seed_timeout
+    while time.monotonic() < deadline and server.poll() is None:
+        if os.path.exists(ready_file):
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+                with open(ready_file) as f:
+                    return server, [tuple(session) for session in json.load(f)]
+            except OSError:
+                pass
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def population_args(args):
+    return ["--users", str(args.users), "--friends", str(args.friends), "--max-friends", str(args.max_friends),
+            "--locations", str(args.locations), "--alerts", str(args.alerts), "--active", str(args.active),
+            "--seed", str(args.seed)]
+
+
+def server_env(args, workdir):
+    """Environment for a freshly seeded app: no rate limits, nothing shared with other runs"""
+    env = {key: value for key, value in os.environ.items()
+           if key not in ("SESSION_DATABASE_URL", "RATE_LIMIT_DATABASE_URL")}
+    env["RATE_LIMITS_ENABLED"] = "false"
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}" if args.store == "sqlite" else ""
+    return env
+
+
+def run_target(target, args, port):
+    workdir = tempfile.mkdtemp(prefix="safesphere-bench-")
+    server = None
+    try:
+        if target == "client":
+            os.environ.clear()
+            os.environ.update(server_env(args, workdir))
+            import flask_main
+            sessions = seed_population(flask_main, args)
+            make_transport = lambda: TestClientTransport(flask_main.app)  # noqa: E731
+        else:
+            server, sessions = start_server(target, port, args, workdir)
+            make_transport = lambda: HTTPTransport(port)  # noqa: E731
+        rows, extras = [], {}
+        for scenario in args.scenarios.split(","):
+            latencies, errors, elapsed, extra = run_scenario(scenario.strip(), make_transport, sessions, args)
+            rows.extend(summarise(target, scenario.strip(), latencies, errors, elapsed))
+            if extra:
+                extras[f"{target}/{scenario.strip()}"] = extra
+        return rows, extras
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_rows(rows, baseline=None):
+    print(f"{'target':<9} {'scenario':<6} {'route':<34} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'p99.9 ms':>9} {'errors':>7}")
+    for row in rows:
+        line = (f"{row['target']:<9} {row['scenario']:<6} {row['route']:<34} {row['rps']:>9.1f} "
+                f"{row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['p999_ms']:>9.2f} {row['errors']:>7}")
+        before = (baseline or {}).get((row["target"], row["scenario"], row["route"]))
+        if before:
+            line += "   vs baseline: " + "  ".join(
+                f"{name} {change(before[key], row[key])}"
+                for name, key in (("req/s", "rps"), ("p50", "p50_ms"), ("p99", "p99_ms"))
+            )
+        print(line)
+
+
+def change(before, after):
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--targets", default="client,threaded", help="client, threaded and/or asgi")
+    parser.add_argument("--scenarios", default="poll,burst")
+    parser.add_argument("--store", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--friends", type=float, default=8, help="median friends per user")
+    parser.add_argument("--max-friends", type=int, default=500)
+    parser.add_argument("--locations", type=int, default=2, help="mean saved places per user")
+    parser.add_argument("--alerts", type=float, default=0.5, help="past alerts per user")
+    parser.add_argument("--active", type=int, default=500, help="signed-in users generating load")
+    parser.add_argument("--burst", type=float, default=0.1, help="share of active users alerting at once")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=5077)
+    parser.add_argument("--seed-timeout", type=float, default=600, help="seconds a server may take to seed")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--ready-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            earlier = json.load(f)
+        baseline = {(row["target"], row["scenario"], row["route"]): row for row in earlier["results"]}
+        differing = {key: value for key, value in earlier["meta"]["args"].items()
+                     if key not in ("targets", "port") and getattr(args, key, value) != value}
+        if differing:
+            print(f"note: {args.compare} was run with {differing}")
+
+    print(f"users {args.users:,}  active {args.active}  concurrency {args.concurrency}  "
+          f"store {args.store}  {args.seconds:g} s per scenario after {args.warmup:g} s warmup")
+    rows, extras = [], {}
+    for offset, target in enumerate(args.targets.split(",")):
+        target_rows, target_extras = run_target(target.strip(), args, args.port + offset)
+        print_rows(target_rows, baseline)
+        rows.extend(target_rows)
+        extras.update(target_extras)
+    for name, extra in extras.items():
+        print(f"{name}: {extra['burst_alerts']} alerts sent in {extra['burst_drain_s']} s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "revision": git_revision(),
+                    "started": datetime.utcnow().isoformat(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                    "args": {key: value for key, value in vars(args).items()
+                             if key not in ("serve", "ready_file", "output", "compare")}
+                },
+                "results": rows,
+                "scenarios": extras
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Location ingestion rate: one POST per point vs batch endpoints.
+
+Posts the same number of points through POST /locations/ (one point per
+request), then through POST /locations/batch as JSON arrays and as NDJSON,
+and reports points per second for each. Uses the Flask test client, so
+network round trips (which batching also saves) are not included:
+
+    python benchmarks/bench_batch_ingest.py --points 20000 --batch-size 500
+    python benchmarks/bench_batch_ingest.py --database sqlite:////tmp/bench.db
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_points(count, seed):
+    rng = random.Random(seed)
+    return [
+        {"name": f"ping {i}", "latitude": round(rng.uniform(-60, 60), 5),
+         "longitude": round(rng.uniform(-170, 170), 5), "type": "trace"}
+        for i in range(count)
+    ]
+
+
+def timed(label, count, run):
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {count / elapsed:10.0f} points/s  ({elapsed:6.2f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--database", default="", help="DATABASE_URL to test, in-memory by default")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database
+    os.environ["MAX_BATCH_ITEMS"] = str(max(args.batch_size, 1))
+    os.environ["RATE_LIMITS_ENABLED"] = "false"  # measure ingestion, not the limiter
+    import flask_main
+
+    client = flask_main.app.test_client()
+    token = client.post("/auth/register", json={
+        "name": "Bench", "email": f"bench-{time.time_ns()}@example.com", "password": "bench"
+    }).get_json()["session_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    points = make_points(args.points, 7)
+    batches = [points[i:i + args.batch_size] for i in range(0, len(points), args.batch_size)]
+
+    def single():
+        for point in points:
+            client.post("/locations/", json=point, headers=headers)
+
+    def json_batches():
+        for batch in batches:
+            client.post("/locations/batch", json=batch, headers=headers)
+
+    def ndjson_batches():
+        for batch in batches:
+            body = "\n".join(json.dumps(point) for point in batch)
+            client.post("/locations/batch", data=body, content_type="application/x-ndjson", headers=headers)
+
+    print(f"points {args.points:,}  batch size {args.batch_size}  "
+          f"store {type(flask_main.store).__name__}")
+    timed("single POST /locations/", args.points, single)
+    timed("batch, JSON array", args.points, json_batches)
+    timed("batch, NDJSON", args.points, ndjson_batches)
+
+
+if __name__ == "__main__":
+    main()
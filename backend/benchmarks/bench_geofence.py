@@ -0,0 +1,74 @@
+"""Throughput of the batch geofence engine.
+
+Loads N users (clustered around a set of population centres, like real
+users) and evaluates them against H hazards, then moves a share of the users
+and evaluates again:
+
+    python benchmarks/bench_geofence.py --users 1000000 --hazards 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geofence import GeofenceEngine  # noqa: E402
+
+
+def synthetic_points(rng, count, centres):
+    """Points scattered a few degrees around random population centres"""
+    picks = rng.integers(0, len(centres), count)
+    lats = np.clip(centres[picks, 0] + rng.normal(0, 2.0, count), -89.9, 89.9)
+    lons = (centres[picks, 1] + rng.normal(0, 2.0, count) + 180.0) % 360.0 - 180.0
+    return lats, lons
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--hazards", type=int, default=1000)
+    parser.add_argument("--memory-mb", type=int, default=64, help="scratch memory cap per evaluation")
+    parser.add_argument("--moved", type=float, default=0.01, help="share of users moved before re-evaluating")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centres = np.column_stack([rng.uniform(-60, 70, 200), rng.uniform(-180, 180, 200)])
+    lats, lons = synthetic_points(rng, args.users, centres)
+    hazard_lats, hazard_lons = synthetic_points(rng, args.hazards, centres)
+    hazards = [
+        {"latitude": lat, "longitude": lon, "radius": radius}
+        for lat, lon, radius in zip(hazard_lats, hazard_lons, rng.uniform(5, 150, args.hazards))
+    ]
+
+    engine = GeofenceEngine(memory_limit=args.memory_mb * 1024 * 1024)
+    started = time.perf_counter()
+    engine.load(np.arange(args.users), lats, lons)
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    entered, _ = engine.evaluate(hazards)
+    first_seconds = time.perf_counter() - started
+
+    moved = rng.choice(args.users, int(args.users * args.moved), replace=False)
+    new_lats, new_lons = synthetic_points(rng, len(moved), centres)
+    for user_id, lat, lon in zip(moved.tolist(), new_lats.tolist(), new_lons.tolist()):
+        engine.set_position(user_id, (lat, lon))
+    started = time.perf_counter()
+    entered_again, left = engine.evaluate(hazards)
+    second_seconds = time.perf_counter() - started
+
+    pairs = args.users * args.hazards
+    print(f"users {args.users:,}  hazards {args.hazards:,}  memory cap {args.memory_mb} MB")
+    print(f"load              {load_seconds:8.2f} s")
+    print(f"first evaluation  {first_seconds:8.2f} s  {pairs / first_seconds / 1e6:10.1f} M user-hazard pairs/s effective  "
+          f"{len(entered):,} exposed")
+    print(f"after {len(moved):,} moves  {second_seconds:6.2f} s  {pairs / second_seconds / 1e6:10.1f} M pairs/s effective  "
+          f"{len(entered_again):,} entered, {len(left):,} left")
+
+
+if __name__ == "__main__":
+    main()
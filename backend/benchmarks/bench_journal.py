@@ -0,0 +1,206 @@
+"""Journal write overhead and restart time of the journaled in-memory store.
+
+Part one times the mutations requests make (registering, status flips,
+alerts) on a plain `MemoryStore` and on a `JournaledStore` with and without
+fsync, from one thread and from many; concurrent writers share fsyncs.
+
+Part two fills a store with N users (plus friendships and alerts), writes a
+snapshot while a writer keeps going, makes further changes that only reach
+the journal, and restarts from the directory:
+
+    python benchmarks/bench_journal.py --users 1000000
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import JournaledStore  # noqa: E402
+from store import MemoryStore  # noqa: E402
+
+PASSWORD_HASH = "scrypt$16384$8$1$" + "ab" * 16 + "$" + "cd" * 32
+FIRST = ["Ana", "Ben", "Chen", "Dara", "Eli", "Fatima", "Gus", "Hana", "Ivan", "Jo", "Kai", "Lena"]
+LAST = ["Garcia", "Smith", "Okafor", "Nguyen", "Patel", "Kowalski", "Haddad", "Silva", "Tanaka"]
+
+
+def user_fields(i, rng):
+    return {
+        "name": f"{rng.choice(FIRST)} {rng.choice(LAST)}",
+        "email": f"user{i}@example.com",
+        "phone": f"+1 555 {i:07d}",
+        "password_hash": PASSWORD_HASH,
+        "is_safe": True,
+        "status": "safe",
+        "last_safe_update": 1_700_000_000_000_000 + i,
+        "created_at": 1_700_000_000_000_000 + i,
+        "latitude": 40.0 + rng.random(),
+        "longitude": -74.0 + rng.random()
+    }
+
+
+def mutate(store, rng, count, latencies, register_from):
+    """A request-like mix: 10% registrations, 70% status flips, 20% alerts"""
+    for n in range(count):
+        started = time.perf_counter()
+        roll = rng.random()
+        if roll < 0.1:
+            store.add_user(user_fields(register_from + n, rng))
+        elif roll < 0.8:
+            user = store.get_user(rng.randint(1, len(store.users)))
+            safe = rng.random() < 0.5
+            store.update_user(user, {"is_safe": safe, "status": "safe" if safe else "danger",
+                                     "last_safe_update": 1_700_000_000_000_000 + n})
+        else:
+            store.add_alert({"user_id": rng.randint(1, len(store.users)), "type": "emergency_alert",
+                             "message": "Emergency alert sent", "created_at": 1_700_000_000_000_000 + n})
+        latencies.append(time.perf_counter() - started)
+
+
+def run_writers(store, threads, operations, seed):
+    latencies = []
+    per_thread = operations // threads
+    workers = [
+        threading.Thread(target=mutate, args=(store, random.Random(seed + t), per_thread, latencies,
+                                              10_000_000 * (t + 1)))
+        for t in range(threads)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, time.perf_counter() - started
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def populate(store, users, rng):
+    for i in range(1, users + 1):
+        store.add_user(user_fields(i, rng))
+    for i in range(1, users + 1):
+        for _ in range(2):
+            friend = rng.randint(1, users)
+            if friend != i:
+                store.add_friend_connection(i, friend, "accepted", "2024-01-01T00:00:00")
+    for _ in range(users // 10):
+        store.add_alert({"user_id": rng.randint(1, users), "type": "emergency_alert",
+                         "message": "Emergency alert sent", "created_at": 1_700_000_000_000_000})
+
+
+def bench_writes(args, workdir):
+    print(f"write overhead, {args.operations:,} mutations on {args.base_users:,} users")
+    modes = [("memory only", None), ("journal, fsync per batch", True), ("journal, fsync every 1 s", False)]
+    for threads in (1, args.threads):
+        for mode, (label, sync) in enumerate(modes):
+            directory = os.path.join(workdir, f"writes-{threads}-{mode}")
+            if sync is None:
+                store = MemoryStore()
+            else:
+                store = JournaledStore(directory, sync=sync, snapshot_interval=0)
+            rng = random.Random(args.seed)
+            for i in range(1, args.base_users + 1):
+                store.add_user(user_fields(i, rng))
+            before = store.journal_stats() if sync is not None else None
+            latencies, elapsed = run_writers(store, threads, args.operations, args.seed)
+            line = (f"  {threads:2d} thread(s)  {label:25s} {len(latencies) / elapsed:9,.0f}/s  "
+                    f"p50 {percentile(latencies, 0.5) * 1e6:7.1f} us  p99 {percentile(latencies, 0.99) * 1e6:8.1f} us")
+            if sync is not None:
+                stats = store.journal_stats()
+                syncs = max(stats["syncs"] - before["syncs"], 1)
+                line += f"  {(stats['entries'] - before['entries']) / syncs:6.1f} entries/fsync"
+                store.close()
+            print(line)
+
+
+def bench_restart(args, workdir):
+    directory = os.path.join(workdir, "restart")
+    rng = random.Random(args.seed)
+    store = JournaledStore(directory, sync=False, snapshot_interval=0)
+    started = time.perf_counter()
+    populate(store, args.users, rng)
+    print(f"\nrestart, {args.users:,} users: populated in {time.perf_counter() - started:.1f} s "
+          f"({store.journal_stats()['bytes'] / 2 ** 20:.0f} MiB of journal)")
+
+    # One writer keeps going during the snapshot; its slowest write is the
+    # longest the snapshot held the store's lock
+    latencies, stop = [], threading.Event()
+
+    def writer():
+        writer_rng = random.Random(args.seed + 1)
+        while not stop.is_set():
+            mutate(store, writer_rng, 50, latencies, 20_000_000 + len(latencies))
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    snapshot = store.snapshot()
+    stop.set()
+    thread.join()
+    print(f"  snapshot: {snapshot['seconds']:.1f} s, {snapshot['bytes'] / 2 ** 20:.0f} MiB; concurrent writes "
+          f"p50 {percentile(latencies, 0.5) * 1e6:.0f} us, max {max(latencies) * 1e3:.1f} ms")
+
+    mutate(store, rng, args.tail, [], 30_000_000)
+    expected = (store.counts(), [user.row() for user in store.users[-100:]])
+    store.close()
+
+    timings = []
+    for _ in range(args.restarts):
+        started = time.perf_counter()
+        restored = JournaledStore(directory, snapshot_interval=0)
+        timings.append(time.perf_counter() - started)
+        recovery = restored.recovery
+        assert (restored.counts(), [user.row() for user in restored.users[-100:]]) == expected
+        restored.close()
+        del restored
+    print(f"  restart: {statistics.median(timings):.1f} s (snapshot {recovery['snapshot_seconds']:.1f} s, "
+          f"replaying {recovery['replayed_entries']:,} journal entries {recovery['replay_seconds']:.2f} s)")
+
+
+def bench_full_replay(args, workdir):
+    """Without snapshots, a restart replays every change since the first"""
+    directory = os.path.join(workdir, "replay")
+    store = JournaledStore(directory, sync=False, snapshot_interval=0)
+    populate(store, args.replay_users, random.Random(args.seed))
+    store.close()
+    started = time.perf_counter()
+    JournaledStore(directory, snapshot_interval=0).close()
+    elapsed = time.perf_counter() - started
+    print(f"  replaying the whole journal instead, {args.replay_users:,} users: {elapsed:.1f} s "
+          f"(~{elapsed * args.users / args.replay_users:.0f} s at {args.users:,})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--base-users", type=int, default=10_000, help="users present for the write benchmark")
+    parser.add_argument("--operations", type=int, default=20_000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--tail", type=int, default=50_000, help="changes made after the snapshot")
+    parser.add_argument("--replay-users", type=int, default=50_000, help="users for the no-snapshot comparison")
+    parser.add_argument("--restarts", type=int, default=3)
+    parser.add_argument("--dir", help="directory for journal files (a temporary one by default)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = args.dir or tempfile.mkdtemp(prefix="bench-journal-")
+    try:
+        bench_writes(args, workdir)
+        bench_restart(args, workdir)
+        bench_full_replay(args, workdir)
+    finally:
+        if not args.dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Login throughput and web responsiveness with scrypt hashing.
+
+Runs the same login storm twice, hashing inline in the web threads
+(`--workers 0`) and in the process pool, while a probe thread polls
+`GET /health`. Reports logins per second, login latency and the probe's
+latency, which shows whether other requests stay responsive:
+
+    python benchmarks/bench_login.py --threads 16 --seconds 5 --workers 4
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def storm(flask_main, users, threads, seconds):
+    client = flask_main.app.test_client()
+    stop = threading.Event()
+    logins, probes, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def login(worker):
+        local = flask_main.app.test_client()
+        i = worker
+        while not stop.is_set():
+            started = time.perf_counter()
+            status = local.post("/auth/login", json={
+                "email": f"user{i % users}@example.com", "password": "correct horse"
+            }).status_code
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    logins.append(elapsed)
+            i += threads
+
+    def probe():
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get("/health")
+            probes.append(time.perf_counter() - started)
+            time.sleep(0.01)
+
+    workers = [threading.Thread(target=login, args=(n,)) for n in range(threads)]
+    workers.append(threading.Thread(target=probe))
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return logins, probes, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="hashing processes")
+    parser.add_argument("--max-pending", type=int, default=64)
+    args = parser.parse_args()
+
+    os.environ["RATE_LIMITS_ENABLED"] = "false"
+    import flask_main
+    from passwords import PasswordHasher
+
+    # Every user shares one hash, which is enough to exercise verification
+    stored = PasswordHasher(workers=0).hash("correct horse")
+    for i in range(args.users):
+        flask_main.store.add_user({"name": f"User {i}", "email": f"user{i}@example.com",
+                                   "password_hash": stored, "is_safe": True, "status": "safe"})
+
+    print(f"users {args.users}  login threads {args.threads}  {args.seconds:g} s per run")
+    for label, workers in [("inline", 0), (f"pool x{args.workers}", args.workers)]:
+        flask_main.password_hasher = PasswordHasher(workers=workers, max_pending=args.max_pending)
+        logins, probes, statuses = storm(flask_main, args.users, args.threads, args.seconds)
+        flask_main.password_hasher.shutdown()
+        print(f"{label:<10} {len(logins) / args.seconds:7.1f} logins/s  "
+              f"login p50 {percentile(logins, 0.5) * 1000:6.1f} ms p99 {percentile(logins, 0.99) * 1000:7.1f} ms  "
+              f"/health p50 {percentile(probes, 0.5) * 1000:6.2f} ms p99 {percentile(probes, 0.99) * 1000:6.2f} ms  "
+              f"statuses {dict(sorted(statuses.items()))}")
+
+
+if __name__ == "__main__":
+    main()
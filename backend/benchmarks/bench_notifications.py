@@ -0,0 +1,95 @@
+"""Notification pipeline against a fake delivery sink.
+
+Submits status changes for U users with F friends each, from several threads
+at once, mixing safe/alert/danger. Some of the sink's first calls fail, to
+exercise retries. Reports how long submitting took (the cost a request
+handler pays), end-to-end delivery latency and how much was coalesced:
+
+    python benchmarks/bench_notifications.py --users 2000 --friends 300 --events 50000
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from notifications import FakeSink, NotificationPipeline  # noqa: E402
+
+
+class SlowSink(FakeSink):
+    """Fake sink that takes a fixed time per batch plus a little per message"""
+
+    def __init__(self, per_batch, per_message, **kwargs):
+        super().__init__(**kwargs)
+        self.per_batch = per_batch
+        self.per_message = per_message
+
+    def send(self, messages):
+        time.sleep(self.per_batch + self.per_message * sum(len(m["recipients"]) for m in messages))
+        super().send(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--friends", type=int, default=300)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--fail-first", type=int, default=3, help="sink calls that fail before succeeding")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    friends = {user_id: rng.sample(range(args.users), min(args.friends, args.users))
+               for user_id in range(args.users)}
+    sink = SlowSink(0.002, 0.000001, fail_first=args.fail_first)
+    pipeline = NotificationPipeline(friends.__getitem__, [sink], workers=args.workers,
+                                    max_queue=args.users, batch_size=args.batch_size,
+                                    retry_backoff=0.01)
+
+    submit_times = []
+    lock = threading.Lock()
+
+    def producer(count, seed):
+        local = random.Random(seed)
+        times = []
+        for _ in range(count):
+            status = local.choices(["safe", "alert", "danger"], weights=[70, 20, 10])[0]
+            user_id = local.randrange(args.users)
+            alert = {"user_id": user_id, "type": status} if status != "safe" else None
+            started = time.perf_counter()
+            pipeline.submit(user_id, status, {"user_id": user_id, "status": status}, alert)
+            times.append(time.perf_counter() - started)
+        with lock:
+            submit_times.extend(times)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=producer, args=(args.events // args.threads, seed))
+               for seed in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    submitted = time.perf_counter() - started
+    pipeline.flush()
+    drained = time.perf_counter() - started
+
+    submit_times.sort()
+    stats = pipeline.stats()
+    print(f"users {args.users:,}  friends each {args.friends}  events {len(submit_times):,}  "
+          f"workers {args.workers}  batch {args.batch_size}")
+    print(f"submit p50 {submit_times[len(submit_times) // 2] * 1e6:8.1f} us  "
+          f"p99 {submit_times[int(len(submit_times) * 0.99)] * 1e6:8.1f} us")
+    print(f"submitted in {submitted:6.2f} s, drained in {drained:6.2f} s")
+    print(f"delivered {stats['delivered']:,}  coalesced {stats['coalesced']:,}  dropped {stats['dropped']:,}  "
+          f"retries {stats['retries']}  failed batches {stats['failed_batches']}")
+    print(f"delivery latency {stats['latency_ms']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Memory and serialization cost of slotted records vs plain dicts.
+
+Builds N users, alerts and locations both as the old dicts (ISO timestamp
+strings) and as `records` types (epoch-microsecond ints), then measures
+memory with tracemalloc and the time to produce public JSON for every user:
+
+    python benchmarks/bench_records.py --rows 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import Alert, Location, User  # noqa: E402
+
+
+def user_fields(i, timestamp):
+    return {
+        "name": f"User {i}",
+        "email": f"user{i}@example.com",
+        "phone": None,
+        "password_hash": "5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8",
+        "is_safe": True,
+        "status": "safe",
+        "last_safe_update": timestamp,
+        "created_at": timestamp,
+        "latitude": 40.0 + (i % 1000) / 1000,
+        "longitude": -74.0 + (i % 997) / 997
+    }
+
+
+def alert_fields(i, timestamp):
+    return {"user_id": i, "type": "emergency_alert", "message": "Emergency alert sent", "created_at": timestamp}
+
+
+def location_fields(i, timestamp):
+    return {"user_id": i, "name": "Home", "latitude": 40.0 + (i % 1000) / 1000,
+            "longitude": -74.0 + (i % 997) / 997, "type": "home", "created_at": timestamp}
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rows = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return rows, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+    n = args.rows
+
+    # Every record gets its own timestamp, as it would in practice
+    def iso(i):
+        return datetime.utcfromtimestamp(1_700_000_000 + i).isoformat()
+
+    def epoch(i):
+        return (1_700_000_000 + i) * 1_000_000
+
+    kinds = [
+        ("users", user_fields, User),
+        ("alerts", alert_fields, Alert),
+        ("locations", location_fields, Location),
+    ]
+    print(f"rows per kind {n:,}")
+    kept = {}
+    for name, fields, record_type in kinds:
+        dicts, dict_bytes = measure(lambda: [{"id": i + 1, **fields(i, iso(i))} for i in range(n)])
+        records, record_bytes = measure(lambda: [record_type(i + 1, **fields(i, epoch(i))) for i in range(n)])
+        print(f"{name:10s} dict {dict_bytes / n:7.1f} B/row   record {record_bytes / n:7.1f} B/row   "
+              f"({1 - record_bytes / dict_bytes:5.1%} smaller)")
+        kept[name] = (dicts, records)
+
+    dicts, records = kept["users"]
+    for label, serialize in [
+        ("dict copy per request", lambda: json.dumps([{k: v for k, v in u.items() if k != "password_hash"} for u in dicts])),
+        ("public view, cold", lambda: json.dumps([u.public() for u in records])),
+        ("public view, cached", lambda: json.dumps([u.public() for u in records])),
+    ]:
+        started = time.perf_counter()
+        serialize()
+        print(f"serialize users: {label:22s} {time.perf_counter() - started:6.2f} s")
+
+    fresh = [User(i + 1, **user_fields(i, epoch(i))) for i in range(n)]
+    _, view_bytes = measure(lambda: [u.public() for u in fresh])
+    print(f"a cached public view adds {view_bytes / n:.1f} B to each user that has been read")
+
+
+if __name__ == "__main__":
+    main()
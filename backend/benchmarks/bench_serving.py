@@ -0,0 +1,188 @@
+"""Idle-connection load test: threaded Flask server vs the ASGI entry point.
+
+For each serving mode, starts the server in a subprocess, opens
+`--connections` idle event streams (`GET /events/stream`) and, while they
+are held open, measures:
+
+- how many streams were accepted,
+- `GET /health` throughput and latency from `--clients` keep-alive clients,
+- the server's resident memory and thread count, and
+- how long one status change takes to reach every open stream.
+
+    python benchmarks/bench_serving.py --connections 2000
+    python benchmarks/bench_serving.py --modes asgi --connections 15000
+
+Client and server each need a file descriptor per connection (`ulimit -n`).
+The ASGI mode needs uvicorn (`pip install -r asgi_requirements.txt`).
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "threaded": [sys.executable, "-c",
+                 "import sys, flask_main; "
+                 "flask_main.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+             "--log-level", "warning", "--backlog", "4096", "--port"],
+}
+
+
+def start_server(mode, port):
+    env = dict(os.environ, RATE_LIMITS_ENABLED="false", DATABASE_URL="")
+    server = subprocess.Popen(SERVERS[mode] + [str(port)], cwd=BACKEND, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def post(port, path, payload=None, token=None):
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", method="POST",
+                                     data=json.dumps(payload or {}).encode(),
+                                     headers={"Content-Type": "application/json"})
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    return json.loads(urllib.request.urlopen(request, timeout=10).read())
+
+
+def process_status(pid):
+    status = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            status[name] = value.strip()
+    return int(status["VmRSS"].split()[0]) / 1024, int(status["Threads"])
+
+
+async def open_stream(port, token, timeout):
+    """An event stream that has sent its headers and first frame, or None"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+        writer.write(f"GET /events/stream?token={token} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+        head = await asyncio.wait_for(reader.readuntil(b"retry: 5000\n\n"), timeout)
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        return None
+    if b" 200 " not in head.split(b"\r\n", 1)[0]:
+        writer.close()
+        return None
+    return reader, writer
+
+
+async def health_client(port, stop_at, latencies):
+    reader = writer = None
+    while time.monotonic() < stop_at:
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        started = time.perf_counter()
+        writer.write(b"GET /health HTTP/1.1\r\nHost: bench\r\n\r\n")
+        head = await reader.readuntil(b"\r\n\r\n")
+        length, close = 0, head.startswith(b"HTTP/1.0")
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            if name.lower() == b"content-length":
+                length = int(value)
+            elif name.lower() == b"connection":
+                close = value.strip().lower() == b"close"
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - started)
+        if close:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def wait_for_event(reader, name):
+    while True:
+        line = await reader.readline()
+        if not line or line.startswith(name):
+            return time.perf_counter()
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))] if samples else 0.0
+
+
+async def run_mode(mode, port, args):
+    server = start_server(mode, port)
+    try:
+        registered = post(port, "/auth/register", {"name": "Bench", "email": "bench@example.com",
+                                                   "password": "bench"})
+        token, user_id = registered["session_token"], registered["user"]["id"]
+
+        started = time.perf_counter()
+        opening = asyncio.Semaphore(args.open_concurrency)
+
+        async def limited_open():
+            async with opening:
+                return await open_stream(port, token, args.timeout)
+
+        streams = [s for s in await asyncio.gather(*(limited_open() for _ in range(args.connections))) if s]
+        open_seconds = time.perf_counter() - started
+        rss_mb, threads = process_status(server.pid)
+
+        latencies = []
+        stop_at = time.monotonic() + args.seconds
+        await asyncio.gather(*(health_client(port, stop_at, latencies) for _ in range(args.clients)))
+
+        waiters = [asyncio.ensure_future(wait_for_event(reader, b"event: status")) for reader, _ in streams]
+        published = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(
+            None, post, port, f"/emergency/alert/{user_id}", None, token)
+        done, _ = await asyncio.wait(waiters, timeout=args.timeout) if waiters else (set(), set())
+        delivered = [task.result() - published for task in done]
+
+        print(f"{mode:<9} streams {len(streams):>6}/{args.connections} ({open_seconds:5.1f} s)  "
+              f"RSS {rss_mb:7.1f} MB  threads {threads:>6}  "
+              f"/health {len(latencies) / args.seconds:7.0f} req/s "
+              f"p50 {percentile(latencies, 0.5) * 1000:6.2f} ms p99 {percentile(latencies, 0.99) * 1000:7.2f} ms  "
+              f"fan-out to {len(delivered)} in {max(delivered, default=0) * 1000:7.1f} ms")
+        for _, writer in streams:
+            writer.close()
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default="threaded,asgi")
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=16, help="concurrent /health clients")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--open-concurrency", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))  # inherited by the servers
+    if args.connections + args.clients + 64 > hard:
+        print(f"warning: {args.connections} connections need more than the {hard} allowed file descriptors")
+
+    print(f"idle streams {args.connections:,}  /health clients {args.clients}  {args.seconds:g} s")
+    for offset, mode in enumerate(args.modes.split(",")):
+        asyncio.run(run_mode(mode.strip(), args.port + offset, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Typeahead user search latency on a large population.
+
+Builds a `UserSearchIndex` over N users with names drawn from a shared pool
+(so common words have long posting lists, as real first names do), then
+times top-k queries of each kind against it and, for comparison, the linear
+scan over every user that search would otherwise need:
+
+    python benchmarks/bench_user_search.py --users 1000000
+"""
+import argparse
+import gc
+import os
+import random
+import resource
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_search import UserSearchIndex, match_kind, query_words, search_terms  # noqa: E402
+
+
+def make_users(n, rng, pool=5000):
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(pool)]
+    users = []
+    for i in range(1, n + 1):
+        first, last = rng.choice(words), rng.choice(words)
+        users.append((i, f"{first.title()} {last.title()}", f"{first}.{last}{i}@example.com",
+                      f"+1 {rng.randint(200, 999)} {rng.randint(100, 999)} {rng.randint(1000, 9999)}"))
+    return users
+
+
+def make_queries(users, rng, count):
+    """Query text per kind, taken from real users so most queries match"""
+    queries = {"prefix": [], "two words": [], "email": [], "phone": [], "substring": [], "no match": []}
+    for _ in range(count):
+        _, name, email, phone = rng.choice(users)
+        first, last = name.lower().split()
+        queries["prefix"].append(first[:rng.randint(1, 4)])
+        queries["two words"].append(f"{first[:3]} {last[:2]}")
+        queries["email"].append(email[:rng.randint(5, 10)])
+        queries["phone"].append(phone[-rng.randint(4, 7):])
+        queries["substring"].append(last[1:5])
+        queries["no match"].append("".join(rng.choices("qxz", k=5)))
+    return queries
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))], samples[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=2000, help="per kind")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--friends", type=int, default=150, help="friends of the searching user")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    users = make_users(args.users, rng)
+    index = UserSearchIndex()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for user in users:
+        index.add(*user)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is in KiB on Linux
+    grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * 1024
+    print(f"users {args.users:,}: built in {elapsed:.1f} s ({elapsed / args.users * 1e6:.1f} us/user), "
+          f"peak RSS grew {grown / 2 ** 20:.0f} MiB ({grown / args.users:.0f} B/user)")
+
+    gc.freeze()
+    friend_ids = rng.sample(range(1, args.users + 1), min(args.friends, args.users))
+    queries = make_queries(users, rng, args.queries)
+    print(f"top {args.limit}, {len(friend_ids)} friends ranked first")
+    for kind, texts in queries.items():
+        timings, hits = [], 0
+        for text in texts:
+            started = time.perf_counter()
+            found = index.search(text, args.limit, friend_ids, exclude=friend_ids[0])
+            timings.append(time.perf_counter() - started)
+            hits += len(found)
+        p50, p99, worst = percentiles(timings)
+        print(f"  {kind:10s} p50 {p50 * 1e6:7.1f} us  p99 {p99 * 1e6:7.1f} us  max {worst * 1e6:8.1f} us  "
+              f"avg results {hits / len(texts):4.1f}")
+
+    docs = [search_terms(name, email, phone) for _, name, email, phone in users]
+    timings = []
+    for text in queries["prefix"][:5]:
+        words = query_words(text)
+        started = time.perf_counter()
+        [user_id for user_id, doc in enumerate(docs, 1) if match_kind(words, doc) is not None][:args.limit]
+        timings.append(time.perf_counter() - started)
+    print(f"  linear scan of every user: {statistics.median(timings) * 1e3:.0f} ms per query")
+
+    updates = users[:min(20_000, len(users))]
+    started = time.perf_counter()
+    for user_id, name, email, phone in updates:
+        index.update(user_id, name + " Jr", email, phone)
+    elapsed = time.perf_counter() - started
+    print(f"renames: {len(updates) / elapsed:,.0f}/s ({elapsed / len(updates) * 1e6:.1f} us each)")
+
+
+if __name__ == "__main__":
+    main()
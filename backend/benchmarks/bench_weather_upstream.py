@@ -0,0 +1,81 @@
+"""Drive /weather through the Flask test client against the stub upstream.
+
+Runs three phases against `stub_weather.py`: a healthy provider, a slow and
+failing one, and recovery. For each phase it reports request latency, how many
+calls actually reached the upstream, and the circuit-breaker state:
+
+    python benchmarks/bench_weather_upstream.py --requests 400 --threads 16
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_weather import start_in_background  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_phase(app, name, total, threads, stub, flask_main):
+    latencies = []
+    lock = threading.Lock()
+    calls_before = stub.calls
+
+    def worker(count):
+        client = app.test_client()
+        for _ in range(count):
+            # Spread requests over many cells so most of them miss the cache
+            lat = round(random.uniform(-60, 60), 3)
+            lon = round(random.uniform(-170, 170), 3)
+            started = time.perf_counter()
+            client.get(f"/weather/{lat}/{lon}")
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=worker, args=(total // threads,)) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"{name:<10} {len(latencies) / elapsed:8.0f} req/s  "
+          f"p50 {percentile(latencies, 50) * 1000:7.1f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:7.1f} ms  "
+          f"upstream calls {stub.calls - calls_before:5d}  "
+          f"circuit {flask_main.upstream.breaker.state}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub latency in the failing phase")
+    args = parser.parse_args()
+
+    stub = start_in_background()
+    os.environ["OPENWEATHER_API_KEY"] = "stub"
+    os.environ["OPENWEATHER_URL"] = f"http://127.0.0.1:{stub.server_port}/data/2.5/weather"
+    os.environ["UPSTREAM_READ_TIMEOUT"] = "0.25"
+    os.environ["UPSTREAM_RESET_TIMEOUT"] = "1"
+    os.environ["RATE_LIMITS_ENABLED"] = "false"
+    import flask_main
+
+    run_phase(flask_main.app, "healthy", args.requests, args.threads, stub, flask_main)
+    stub.latency, stub.error_rate = args.latency, 0.5
+    run_phase(flask_main.app, "failing", args.requests, args.threads, stub, flask_main)
+    stub.latency, stub.error_rate = 0.0, 0.0
+    time.sleep(1.1)
+    run_phase(flask_main.app, "recovered", args.requests, args.threads, stub, flask_main)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Local stand-in for the OpenWeatherMap current-weather API.
+
+Injects latency and errors so the upstream client, circuit breaker and
+weather cache can be exercised without touching the real provider:
+
+    python benchmarks/stub_weather.py --port 5099 --latency 0.2 --error-rate 0.3
+
+then point the backend at it with
+`OPENWEATHER_URL=http://127.0.0.1:5099/data/2.5/weather`.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_RESPONSE = {
+    "main": {"temp": 18.4, "humidity": 71, "pressure": 1009},
+    "wind": {"speed": 3.6, "deg": 240},
+    "weather": [{"description": "light rain", "icon": "10d"}]
+}
+
+
+class _QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients hanging up on a slow response is the point of the stub
+        pass
+
+
+def make_server(port=0, latency=0.0, error_rate=0.0):
+    """Build a threaded stub server; port 0 picks a free port"""
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.server.calls += 1
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            if random.random() < self.server.error_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+            body = json.dumps(SAMPLE_RESPONSE).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _QuietServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.calls = 0
+    server.latency = latency
+    server.error_rate = error_rate
+    return server
+
+
+def start_in_background(**kwargs):
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+    server = make_server(args.port, args.latency, args.error_rate)
+    print(f"Stub weather API on http://127.0.0.1:{server.server_port}/data/2.5/weather")
+    server.serve_forever()
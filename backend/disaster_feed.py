@@ -0,0 +1,286 @@
+"""Background ingestion of disaster feeds into a local, indexed event store.
+
+A `DisasterFeed` polls its sources every `interval` seconds from one
+background thread. Sources return GeoJSON feature collections, such as the
+USGS earthquake summary feeds (`https://earthquake.usgs.gov/...geojson`) or
+a local `file:///...` with the same shape for tests and demos. Features are
+turned into events one at a time. A feature whose id and `updated` time have
+already been seen is skipped without being parsed again. Events are
+deduplicated by id across polls and sources.
+
+`DisasterStore` keeps the events in a `GridIndex`, so "events within r km of
+here" is answered locally without touching the network. An event expires
+`ttl` seconds after a feed last listed it, so a feed outage does not wipe the
+store, and events that drop out of a feed do not linger forever.
+"""
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import unquote, urlparse
+
+from spatial_index import GridIndex
+
+
+def create_feed_source(url, upstream):
+    """A feed source for a `file://` path or an http(s) GeoJSON URL"""
+    if url.startswith("file://"):
+        return FileSource(unquote(urlparse(url).path))
+    return HTTPSource(url, upstream)
+
+
+class FileSource:
+    """A GeoJSON file on disk, re-read only when it changes"""
+
+    def __init__(self, path):
+        self.name = path
+        self.path = path
+        self._mtime = None
+        self._collection = None
+
+    def fetch(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with open(self.path, encoding="utf-8") as f:
+                self._collection = json.load(f)
+            self._mtime = mtime
+        return self._collection
+
+
+class HTTPSource:
+    """A GeoJSON feed fetched through the shared `UpstreamClient`"""
+
+    def __init__(self, url, upstream):
+        self.name = url
+        self.url = url
+        self.upstream = upstream
+
+    def fetch(self):
+        return self.upstream.get_json(self.url)
+
+
+def earthquake_radius_km(magnitude):
+    """Rough radius of noticeable shaking: ~10 km at M3, ~60 km at M5, ~400 km at M7"""
+    return round(10 ** (0.4 * max(magnitude, 0.0) - 0.2), 1)
+
+
+def earthquake_severity(magnitude):
+    if magnitude < 4.0:
+        return "low"
+    if magnitude < 6.0:
+        return "medium"
+    return "high"
+
+
+def parse_feature(feature):
+    """An event dict for a GeoJSON point feature, or None if it has no usable point or radius.
+
+    USGS earthquakes (with `mag`) get a radius and severity from their
+    magnitude. Any other feature can give `type`, `title`, `description`,
+    `severity` and `radius` (km) in its properties.
+    """
+    geometry = feature.get("geometry") or {}
+    coordinates = geometry.get("coordinates") or ()
+    if geometry.get("type") != "Point" or len(coordinates) < 2 or feature.get("id") is None:
+        return None
+    lon, lat = float(coordinates[0]), float(coordinates[1])
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None
+    properties = feature.get("properties") or {}
+    event = {
+        "id": str(feature["id"]),
+        "latitude": lat,
+        "longitude": lon,
+        "title": properties.get("title") or properties.get("place") or "Disaster alert",
+        "description": properties.get("description") or properties.get("place") or "",
+        "url": properties.get("url")
+    }
+    if properties.get("time") is not None:
+        event["timestamp"] = datetime.fromtimestamp(
+            properties["time"] / 1000, timezone.utc
+        ).replace(tzinfo=None).isoformat()
+    else:
+        event["timestamp"] = properties.get("timestamp")
+    magnitude = properties.get("mag")
+    if magnitude is not None:
+        event.update({
+            "type": properties.get("type", "earthquake"),
+            "magnitude": magnitude,
+            "radius": float(properties.get("radius") or earthquake_radius_km(magnitude)),
+            "severity": properties.get("severity") or earthquake_severity(magnitude)
+        })
+    else:
+        event.update({
+            "type": properties.get("type", "hazard"),
+            "radius": float(properties.get("radius") or 10.0),
+            "severity": properties.get("severity", "medium")
+        })
+    if not (math.isfinite(event["radius"]) and event["radius"] > 0):
+        return None
+    return event
+
+
+class DisasterStore:
+    """Events by id, indexed by position, expiring `ttl` seconds after last seen"""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._events = {}  # id -> event
+        self._expires = {}  # id -> time it expires unless seen again
+        self._deadlines = []  # (expires_at, id) heap; stale entries are skipped
+        self._grid = GridIndex(cell_degrees=1.0)
+        self.version = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def upsert(self, event, now):
+        """Add or replace an event; True when its content changed"""
+        expires_at = now + self.ttl
+        with self._lock:
+            self._expires[event["id"]] = expires_at
+            heapq.heappush(self._deadlines, (expires_at, event["id"]))
+            if self._events.get(event["id"]) == event:
+                return False
+            self._events[event["id"]] = event
+            self._grid.upsert(event["id"], event["latitude"], event["longitude"])
+            self.version += 1
+        return True
+
+    def touch(self, event_id, now):
+        """Mark an unchanged event as still listed by its feed; False if it is not held"""
+        with self._lock:
+            if event_id not in self._events:
+                return False
+            self._expires[event_id] = now + self.ttl
+            heapq.heappush(self._deadlines, (now + self.ttl, event_id))
+            return True
+
+    def expire(self, now):
+        """Drop events not seen for `ttl` seconds; returns how many went"""
+        dropped = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                expires_at, event_id = heapq.heappop(self._deadlines)
+                if self._expires.get(event_id) == expires_at:
+                    del self._expires[event_id]
+                    del self._events[event_id]
+                    self._grid.remove(event_id)
+                    dropped.append(event_id)
+            # Touched events leave older heap entries behind
+            if len(self._deadlines) > 2 * len(self._events) + 64:
+                self._deadlines = [(expires_at, event_id) for event_id, expires_at in self._expires.items()]
+                heapq.heapify(self._deadlines)
+            if dropped:
+                self.version += 1
+        return len(dropped)
+
+    def near(self, lat, lon, radius_km):
+        """`(event, distance_km)` for events within `radius_km`, nearest first"""
+        nearby = self._grid.within_radius(lat, lon, radius_km)
+        with self._lock:
+            events = self._events
+            return [(events[event_id], distance) for event_id, distance in nearby if event_id in events]
+
+    def events(self):
+        with self._lock:
+            return list(self._events.values())
+
+
+class DisasterFeed:
+    """Polls sources in the background and keeps a `DisasterStore` current"""
+
+    def __init__(self, store, sources, interval=60.0, on_change=None, logger=None):
+        self.store = store
+        self.sources = sources
+        self.interval = interval
+        self.on_change = on_change
+        self.logger = logger
+        self._seen = {}  # event id -> `updated` value from its feed
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"polls": 0, "errors": 0, "parsed": 0, "skipped": 0, "changed": 0, "expired": 0}
+        self._last_success = {}
+
+    def start(self):
+        if self._thread is None and self.sources:
+            self._thread = threading.Thread(target=self._run, name="disaster-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            self._stop.wait(self.interval)
+
+    def poll(self):
+        """Fetch every source once, then expire old events; True if anything changed"""
+        now = time.time()
+        changed = 0
+        for source in self.sources:
+            try:
+                collection = source.fetch()
+            except Exception as e:
+                self._count("errors")
+                if self.logger:
+                    self.logger.warning("Disaster feed %s failed: %s", source.name, e)
+                continue
+            self._last_success[source.name] = now
+            changed += self._ingest(collection, now)
+        expired = self.store.expire(now)
+        self._count("polls")
+        self._count("changed", changed)
+        self._count("expired", expired)
+        if (changed or expired) and self.on_change:
+            self.on_change(self.store.events())
+        return bool(changed or expired)
+
+    def _ingest(self, collection, now):
+        changed = parsed = skipped = 0
+        for feature in collection.get("features") or ():
+            feature_id = feature.get("id")
+            updated = (feature.get("properties") or {}).get("updated")
+            if (feature_id is not None and updated is not None and self._seen.get(feature_id) == updated
+                    and self.store.touch(str(feature_id), now)):
+                # Unchanged since the last poll: keep it alive without re-parsing
+                skipped += 1
+                continue
+            try:
+                event = parse_feature(feature)
+            except (TypeError, ValueError, OverflowError):
+                event = None
+            if event is None:
+                continue
+            parsed += 1
+            self._seen[feature_id] = updated
+            if self.store.upsert(event, now):
+                changed += 1
+        # Forget ids the store no longer holds so `_seen` stays bounded
+        if len(self._seen) > 2 * len(self.store) + 1024:
+            held = {event["id"] for event in self.store.events()}
+            self._seen = {key: value for key, value in self._seen.items() if str(key) in held}
+        self._count("parsed", parsed)
+        self._count("skipped", skipped)
+        return changed
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["events"] = len(self.store)
+        stats["sources"] = {
+            source.name: {"last_success_age": None if source.name not in self._last_success
+                          else round(time.time() - self._last_success[source.name], 1)}
+            for source in self.sources
+        }
+        return stats
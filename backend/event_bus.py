@@ -0,0 +1,178 @@
+"""In-process publish/subscribe bus for pushing changes to clients.
+
+Every published event gets a global, increasing version number and is
+addressed to a set of user ids. Each user keeps a short replay history so a
+client can ask for "changes since version N" (after a reconnect, or when it
+cannot hold a stream open). Live subscribers get events through a bounded
+queue. A consumer that falls too far behind has its queue dropped and receives
+a single `resync` event, so one slow client can never make the server buffer
+without limit.
+
+`subscribe_async` returns a subscription an asyncio task can wait on, so an
+open stream costs a coroutine rather than a thread.
+"""
+import asyncio
+import threading
+from collections import deque
+
+from alert_inbox import BoundedFeed
+
+
+class Subscription:
+    """A single live consumer (one open stream) for one user"""
+
+    def __init__(self, user_id, max_queue):
+        self.user_id = user_id
+        self.max_queue = max_queue
+        self._queue = deque()
+        self._ready = threading.Condition()
+        self._overflowed = False
+        self.closed = False
+
+    def put(self, event):
+        with self._ready:
+            if self._overflowed:
+                return
+            if len(self._queue) >= self.max_queue:
+                # Too slow to keep up: forget the backlog and tell the client
+                # to refetch instead of buffering indefinitely
+                self._queue.clear()
+                self._overflowed = True
+            else:
+                self._queue.append(event)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Wait up to `timeout` seconds and drain everything queued.
+
+        Returns an empty list on timeout, so the caller can send a heartbeat.
+        """
+        with self._ready:
+            if not self._queue and not self._overflowed and not self.closed:
+                self._ready.wait(timeout)
+            if self._overflowed:
+                self._overflowed = False
+                return [{"version": None, "type": "resync", "data": {}}]
+            events = list(self._queue)
+            self._queue.clear()
+            return events
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify()
+
+
+class AsyncSubscription(Subscription):
+    """A subscription drained from an asyncio event loop.
+
+    Events are still published from ordinary threads; each one wakes the
+    loop through `call_soon_threadsafe`.
+    """
+
+    def __init__(self, user_id, max_queue, loop):
+        super().__init__(user_id, max_queue)
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def put(self, event):
+        super().put(event)
+        self._wake()
+
+    def close(self):
+        super().close()
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass  # the loop has shut down; nobody is waiting
+
+    async def get_async(self, timeout):
+        """`get` without blocking the loop"""
+        self._wakeup.clear()
+        events = self.get(0)
+        if events or self.closed:
+            return events
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        return self.get(0)
+
+
+class EventBus:
+    """Versioned fan-out of change events to per-user subscribers"""
+
+    def __init__(self, history_size=200, max_queue=100):
+        self.history_size = history_size
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._version = 0
+        self._history = {}
+        self._subscribers = {}
+
+    @property
+    def version(self):
+        return self._version
+
+    def publish(self, event_type, data, user_ids):
+        """Send an event to every user in `user_ids` and return its version"""
+        with self._lock:
+            self._version += 1
+            event = {"version": self._version, "type": event_type, "data": data}
+            targets = []
+            for user_id in dict.fromkeys(user_ids):
+                history = self._history.get(user_id)
+                if history is None:
+                    history = self._history[user_id] = BoundedFeed(self.history_size)
+                history.append(event["version"], event)
+                targets.extend(self._subscribers.get(user_id, ()))
+        for subscription in targets:
+            subscription.put(event)
+        return event["version"]
+
+    def subscribe(self, user_id):
+        return self._add(Subscription(user_id, self.max_queue))
+
+    def subscribe_async(self, user_id):
+        """Subscribe from a coroutine; wait with `await subscription.get_async()`"""
+        return self._add(AsyncSubscription(user_id, self.max_queue, asyncio.get_running_loop()))
+
+    def _add(self, subscription):
+        with self._lock:
+            self._subscribers.setdefault(subscription.user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def changes_since(self, user_id, version, limit=None):
+        """Events for a user newer than `version`.
+
+        Returns `(events, complete, cursor)`. `complete` is False when some
+        events after `version` have already dropped out of the replay history
+        and the client has to reload its data from the regular endpoints.
+        `cursor` is the version to pass on the next call.
+        """
+        with self._lock:
+            history = self._history.get(user_id)
+            if history is None:
+                return [], True, self._version
+            events = history.read(version, limit)
+            if limit is not None and len(events) == limit:
+                cursor = events[-1]["version"]
+            else:
+                cursor = self._version
+            return events, version >= history.floor_id, cursor
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
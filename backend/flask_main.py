@@ -1,12 +1,29 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
+from werkzeug.http import parse_list_header
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, timedelta
 import json
 import os
-import requests
 from dotenv import load_dotenv
-import hashlib
-import secrets
+import math
+import threading
+
+from disaster_feed import DisasterFeed, DisasterStore, create_feed_source
+from event_bus import EventBus
+from geo import parse_coordinates
+from geofence import GeofenceEngine
+from metrics import Exposition, RequestMetrics
+from notifications import EventBusChannel, LogChannel, NotificationPipeline
+from passwords import HasherBusy, PasswordHasher
+from profiler import SamplingProfiler
+from rate_limit import create_rate_limiter, parse_rate
+from records import now_us, to_epoch_us, to_iso
+from response_cache import ResponseCache
+from session_store import create_session_store
+from store import ALL_USERS, DEFAULT_EMAIL, EmailTaken, create_store
+from upstream_client import UpstreamClient
+from weather_cache import WeatherCache
 
 # Load environment variables
 load_dotenv()
@@ -14,16 +31,217 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Behind a reverse proxy, take the client address from X-Forwarded-For
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+
 # Get API key from environment
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "demo_key")
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "https://api.openweathermap.org/data/2.5/weather")
+
+# Pooled client for upstream providers, failing fast while they are down
+upstream = UpstreamClient(
+    pool_size=int(os.getenv("UPSTREAM_POOL_SIZE", "10")),
+    connect_timeout=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3.05")),
+    read_timeout=float(os.getenv("UPSTREAM_READ_TIMEOUT", "5")),
+    max_in_flight=int(os.getenv("UPSTREAM_MAX_IN_FLIGHT", "8")),
+    failure_threshold=int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("UPSTREAM_RESET_TIMEOUT", "30"))
+)
+
+# Upstream weather is cached per ~5 km geohash cell
+weather_cache = WeatherCache(
+    ttl=int(os.getenv("WEATHER_CACHE_DURATION", "1800")),
+    stale_ttl=int(os.getenv("WEATHER_CACHE_STALE_SECONDS", "600")),
+    max_entries=int(os.getenv("WEATHER_CACHE_SIZE", "10000")),
+    precision=int(os.getenv("WEATHER_CACHE_PRECISION", "5"))
+)
+
+# Disaster feeds (USGS GeoJSON or file:// paths) are polled in the background
+# into a local indexed store; with none configured, mock events are served
+feed_upstream = UpstreamClient(
+    pool_size=2,
+    max_in_flight=2,
+    read_timeout=float(os.getenv("DISASTER_FEED_TIMEOUT", "20"))
+)
+disaster_store = DisasterStore(ttl=int(os.getenv("DISASTER_CACHE_DURATION", "3600")))
+disaster_feed = DisasterFeed(
+    disaster_store,
+    [create_feed_source(url.strip(), feed_upstream)
+     for url in os.getenv("DISASTER_FEED_URLS", "").split(",") if url.strip()],
+    interval=float(os.getenv("DISASTER_POLL_SECONDS", "60")),
+    on_change=lambda events: update_active_hazards(events),
+    logger=app.logger
+)
+# Largest `radius` (km) the disaster routes accept; each query scans every user inside it
+MAX_QUERY_RADIUS_KM = float(os.getenv("MAX_QUERY_RADIUS_KM", "1000"))
+
+# Position trails are kept this long; batch points older than that are refused
+HISTORY_RETENTION_SECONDS = int(os.getenv("HISTORY_RETENTION_SECONDS", "86400"))
+
+# Data storage: in-memory by default, SQLite when DATABASE_URL points at a file,
+# or in-memory with a journal and snapshots in a directory (journal:///path)
+store = create_store(
+    os.getenv("DATABASE_URL"),
+    journal={
+        "sync": os.getenv("JOURNAL_SYNC", "true").lower() == "true",
+        "sync_interval": float(os.getenv("JOURNAL_SYNC_INTERVAL", "1.0")),
+        "snapshot_interval": float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "300")),
+        "snapshot_min_entries": int(os.getenv("SNAPSHOT_MIN_ENTRIES", "10000")),
+        "logger": app.logger
+    },
+    alert_inbox_size=int(os.getenv("ALERT_INBOX_SIZE", "500")),
+    history={
+        "raw_seconds": int(os.getenv("HISTORY_RAW_SECONDS", "3600")),
+        "max_raw_points": int(os.getenv("HISTORY_MAX_RAW_POINTS", "720")),
+        "bucket_seconds": int(os.getenv("HISTORY_BUCKET_SECONDS", "300")),
+        "retention_seconds": HISTORY_RETENTION_SECONDS
+    }
+)
+
+# Serialized list responses, revalidated with ETags against store versions
+response_cache = ResponseCache(max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "5000")))
+
+# Login sessions with sliding expiry, shared between workers when on SQLite
+sessions = create_session_store(
+    os.getenv("SESSION_DATABASE_URL", os.getenv("DATABASE_URL")),
+    ttl=int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600))),
+    max_per_user=int(os.getenv("SESSION_MAX_PER_USER", "10"))
+)
+
+# Passwords are hashed with scrypt in worker processes; when too many logins
+# are already waiting, new ones are turned away with a 503
+password_hasher = PasswordHasher(
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", str(min(os.cpu_count() or 1, 4)))),
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64")),
+    timeout=float(os.getenv("PASSWORD_HASH_TIMEOUT", "10")),
+    n=int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+)
+
+# Real-time change notifications pushed to connected clients
+event_bus = EventBus(
+    history_size=int(os.getenv("EVENT_HISTORY_SIZE", "200")),
+    max_queue=int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+)
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+# Status changes and alerts are fanned out to friends by background workers
+notifier = NotificationPipeline(
+    store.followers_of,
+    [EventBusChannel(event_bus), LogChannel(app.logger)],
+    workers=int(os.getenv("NOTIFY_WORKERS", "2")),
+    max_queue=int(os.getenv("NOTIFY_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("NOTIFY_BATCH_SIZE", "100")),
+    max_retries=int(os.getenv("NOTIFY_MAX_RETRIES", "3")),
+    logger=app.logger
+)
+
+# Batch exposure of all users to the active hazards, re-run whenever the
+# hazard list changes
+geofence = GeofenceEngine(memory_limit=int(os.getenv("GEOFENCE_MEMORY_MB", "64")) * 1024 * 1024)
+geofence.load(*store.user_positions())
+store.add_position_listener(geofence.set_position)
+GEOFENCE_AUTO_ALERT = os.getenv("GEOFENCE_AUTO_ALERT", "false").lower() == "true"
+active_hazards = {}
+geofence_state = {"signature": None, "thread": None}
+geofence_wakeup = threading.Event()
+geofence_lock = threading.Lock()
+
+# Token-bucket limits per client address ("ip") or signed-in user ("user"),
+# keyed by endpoint name; "*" applies to every request. Checked before the
+# request body is read. Per process unless RATE_LIMIT_DATABASE_URL is set.
+limiter = create_rate_limiter(
+    os.getenv("RATE_LIMIT_DATABASE_URL"),
+    **({} if os.getenv("RATE_LIMIT_DATABASE_URL") else
+       {"max_keys": int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))})
+)
+RATE_LIMITS_ENABLED = os.getenv("RATE_LIMITS_ENABLED", "true").lower() == "true"
+auth_limit = parse_rate(os.getenv("RATE_LIMIT_AUTH", "10/minute"))
+emergency_limit = parse_rate(os.getenv("RATE_LIMIT_EMERGENCY", "30/hour burst 10"))
+RATE_LIMITS = {
+    "*": [("ip", parse_rate(os.getenv("RATE_LIMIT_DEFAULT", "1200/minute burst 200")))],
+    "login": [("ip", auth_limit)],
+    "register": [("ip", auth_limit)],
+    "send_emergency_alert": [("user", emergency_limit)],
+    "mark_danger": [("user", emergency_limit)],
+    "mark_safe": [("user", emergency_limit)],
+    "update_profile_batch": [("user", parse_rate(os.getenv("RATE_LIMIT_PROFILE_BATCH", "120/minute burst 30")))],
+    "search_users": [("user", parse_rate(os.getenv("RATE_LIMIT_SEARCH", "600/minute burst 60")))]
+}
+
+# Typeahead user search: results per query by default and at most
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "10"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "50"))
+
+# Per-endpoint request counts and latency, exported with everything else at
+# /metrics. The sampling profiler is only reachable when PROFILER_ENABLED.
+request_metrics = RequestMetrics()
+profiler = SamplingProfiler(interval=float(os.getenv("PROFILER_INTERVAL", "0.005")))
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+
+# Batch ingestion accepts a JSON array or newline-delimited JSON
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "5000"))
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl", "application/jsonlines")
+INVALID_ITEM = object()  # placeholder for an NDJSON line that did not parse
+
+@app.before_request
+def start_request_timer():
+    """Count the request as in flight; registered first so rejected requests are timed too"""
+    g.metrics_endpoint = request.endpoint or "unmatched"
+    g.metrics_started = request_metrics.start(g.metrics_endpoint)
+
+@app.after_request
+def note_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_timer(exc=None):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        request_metrics.finish(g.metrics_endpoint, request.method, g.pop("metrics_status", 500), started)
+
+@app.before_request
+def enforce_rate_limits():
+    """Answer 429 for a client or user over its limit, before any parsing"""
+    if request.method == "OPTIONS":
+        return None
+    session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    retry_after = rate_limit_wait(request.endpoint, request.remote_addr, session_token)
+    if retry_after is None:
+        return None
+    response = jsonify({"error": "Too many requests", "retry_after": retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+def client_address(remote_addr, forwarded_for):
+    """Helper function to find a client's address behind TRUSTED_PROXY_COUNT
+    proxies the way ProxyFix does, for requests that bypass the Flask app"""
+    if TRUSTED_PROXY_COUNT and forwarded_for:
+        values = parse_list_header(forwarded_for)
+        if len(values) >= TRUSTED_PROXY_COUNT:
+            return values[-TRUSTED_PROXY_COUNT]
+    return remote_addr
 
-# Mock data storage (in-memory for demo)
-users = []
-locations = []
-friends = []
-friend_requests = []
-alerts = []
-sessions = {}  # Store user sessions
+def rate_limit_wait(endpoint, remote_addr, session_token):
+    """Helper function to spend a request's rate-limit tokens; seconds to wait if refused, else None"""
+    if not RATE_LIMITS_ENABLED:
+        return None
+    for name in ("*", endpoint):
+        for scope, (rate, burst) in RATE_LIMITS.get(name, ()):
+            # A "user" limit falls back to the address for anonymous requests
+            client = ("ip", remote_addr)
+            if scope == "user":
+                user_id = sessions.get(session_token) if session_token else None
+                if user_id:
+                    client = ("user", user_id)
+            allowed, retry_after = limiter.hit((name, *client), rate, burst)
+            if not allowed:
+                return math.ceil(retry_after)
+    return None
 
 @app.route('/')
 def root():
@@ -39,34 +257,39 @@ def register():
     user_data = request.get_json()
     
     # Check if user already exists
-    for user in users:
-        if user["email"] == user_data.get("email"):
-            return jsonify({"error": "User already exists"}), 400
+    if store.get_user_by_email(user_data.get("email")):
+        return jsonify({"error": "User already exists"}), 400
     
-    user_id = len(users) + 1
-    password_hash = hashlib.sha256(user_data.get("password", "").encode()).hexdigest()
+    try:
+        password_hash = password_hasher.hash(user_data.get("password", ""))
+    except HasherBusy:
+        return hasher_busy_response()
     
-    new_user = {
-        "id": user_id,
-        "name": user_data.get("name", "Unknown"),
-        "email": user_data.get("email", "unknown@example.com"),
-        "phone": user_data.get("phone"),
-        "password_hash": password_hash,
-        "is_safe": True,
-        "status": "safe",  # safe, alert, danger
-        "last_safe_update": datetime.utcnow().isoformat(),
-        "created_at": datetime.utcnow().isoformat(),
-        "latitude": user_data.get("latitude"),
-        "longitude": user_data.get("longitude")
-    }
-    users.append(new_user)
+    try:
+        new_user = store.add_user({
+            "name": user_data.get("name", "Unknown"),
+            "email": user_data.get("email", DEFAULT_EMAIL),
+            "phone": user_data.get("phone"),
+            "password_hash": password_hash,
+            "is_safe": True,
+            "status": "safe",  # safe, alert, danger
+            "last_safe_update": now_us(),
+            "created_at": now_us(),
+            "latitude": user_data.get("latitude"),
+            "longitude": user_data.get("longitude")
+        })
+    except EmailTaken:
+        # Registered by a concurrent request since the check above
+        return jsonify({"error": "User already exists"}), 400
+    
+    # Start the position trail with the registration position, if any
+    record_position(new_user)
     
     # Create session
-    session_token = secrets.token_urlsafe(32)
-    sessions[session_token] = user_id
+    session_token = sessions.create(new_user["id"])
     
     return jsonify({
-        "user": {k: v for k, v in new_user.items() if k != "password_hash"},
+        "user": new_user.public(),
         "session_token": session_token
     }), 201
 
@@ -74,68 +297,91 @@ def register():
 def login():
     user_data = request.get_json()
     email = user_data.get("email")
-    password = user_data.get("password")
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
-    
-    for user in users:
-        if user["email"] == email and user["password_hash"] == password_hash:
-            # Create session
-            session_token = secrets.token_urlsafe(32)
-            sessions[session_token] = user["id"]
-            
-            return jsonify({
-                "user": {k: v for k, v in user.items() if k != "password_hash"},
-                "session_token": session_token
-            })
+    password = user_data.get("password") or ""
+    
+    user = store.get_user_by_email(email)
+    try:
+        matches, new_hash = password_hasher.check(password, user.get("password_hash") if user else None)
+    except HasherBusy:
+        return hasher_busy_response()
+    if matches:
+        # Upgrade legacy or weaker hashes now that the password is known
+        if new_hash:
+            store.update_user(user, {"password_hash": new_hash})
+        
+        # Create session
+        session_token = sessions.create(user["id"])
+        
+        return jsonify({
+            "user": user.public(),
+            "session_token": session_token
+        })
     
     return jsonify({"error": "Invalid credentials"}), 401
 
 @app.route('/auth/logout', methods=['POST'])
 def logout():
     session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
-    if session_token in sessions:
-        del sessions[session_token]
+    sessions.revoke(session_token)
     return jsonify({"message": "Logged out successfully"})
 
+def hasher_busy_response():
+    """Helper function to turn a request away while password checks are backed up"""
+    response = jsonify({"error": "Server busy, please retry"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
 def get_current_user():
     """Helper function to get current user from session"""
     session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
-    user_id = sessions.get(session_token)
+    return user_for_token(session_token)
+
+def cached_json(scope, build):
+    """Helper function to serve a JSON list cached per data version, with ETag revalidation"""
+    key = (request.path, request.query_string, scope, store.version(scope))
+    etag, body = response_cache.get(key, request.if_none_match.contains, build)
+    if body is None:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+def user_for_token(session_token):
+    """Helper function to get the user a session token belongs to"""
+    user_id = sessions.get(session_token) if session_token else None
     if user_id:
-        for user in users:
-            if user["id"] == user_id:
-                return user
+        return store.get_user(user_id)
     return None
 
 # User endpoints
 @app.route('/users/', methods=['POST'])
 def create_user():
     user_data = request.get_json()
-    user_id = len(users) + 1
-    new_user = {
-        "id": user_id,
+    new_user = store.add_user({
         "name": user_data.get("name", "Unknown"),
-        "email": user_data.get("email", "unknown@example.com"),
+        "email": user_data.get("email", DEFAULT_EMAIL),
         "phone": user_data.get("phone"),
         "is_safe": True,
         "status": "safe",
-        "last_safe_update": datetime.utcnow().isoformat(),
-        "created_at": datetime.utcnow().isoformat(),
+        "last_safe_update": now_us(),
+        "created_at": now_us(),
         "latitude": user_data.get("latitude"),
         "longitude": user_data.get("longitude")
-    }
-    users.append(new_user)
-    return jsonify(new_user), 201
+    }, unique_email=False)
+    return jsonify(new_user.public()), 201
 
 @app.route('/users/', methods=['GET'])
 def get_users():
-    return jsonify(users)
+    return cached_json(ALL_USERS, lambda: [user.to_dict() for user in store.all_users()])
 
 @app.route('/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
-    for user in users:
-        if user["id"] == user_id:
-            return jsonify({k: v for k, v in user.items() if k != "password_hash"})
+    user = store.get_user(user_id)
+    if user:
+        return jsonify(user.public())
     return jsonify({"error": "User not found"}), 404
 
 @app.route('/users/profile', methods=['GET'])
@@ -144,7 +390,25 @@ def get_profile():
     if not current_user:
         return jsonify({"error": "Not authenticated"}), 401
     
-    return jsonify({k: v for k, v in current_user.items() if k != "password_hash"})
+    return jsonify(current_user.public())
+
+@app.route('/users/search', methods=['GET'])
+def search_users():
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    # Prefix matches on name words, email and phone digits; friends first
+    query = request.args.get('q', '')[:100]
+    limit = request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int)
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        return jsonify({"error": "Invalid limit"}), 400
+    
+    friend_ids = set(store.friends_of(current_user["id"]))
+    return jsonify([
+        {"id": user["id"], "name": user["name"], "email": user["email"], "is_friend": user["id"] in friend_ids}
+        for user in store.search_users(query, limit, current_user["id"])
+    ])
 
 @app.route('/users/profile', methods=['PUT'])
 def update_profile():
@@ -155,12 +419,175 @@ def update_profile():
     user_data = request.get_json()
     
     # Update user data
-    current_user["name"] = user_data.get("name", current_user["name"])
-    current_user["phone"] = user_data.get("phone", current_user["phone"])
-    current_user["latitude"] = user_data.get("latitude", current_user["latitude"])
-    current_user["longitude"] = user_data.get("longitude", current_user["longitude"])
+    store.update_user(current_user, {
+        "name": user_data.get("name", current_user["name"]),
+        "phone": user_data.get("phone", current_user["phone"]),
+        "latitude": user_data.get("latitude", current_user["latitude"]),
+        "longitude": user_data.get("longitude", current_user["longitude"])
+    })
+    if "latitude" in user_data or "longitude" in user_data:
+        record_position(current_user)
+    
+    return jsonify(current_user.public())
+
+@app.route('/users/profile/batch', methods=['POST'])
+def update_profile_batch():
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    items, error = read_batch()
+    if error:
+        return error
+    
+    # Validate every update, then apply them in order as a single write: the
+    # last status, name and phone win, the newest position becomes current and
+    # every position joins the trail, so the indexes move once per batch
+    results = []
+    changes = {}
+    status = None
+    trail = []
+    now = now_us()
+    latest = None
+    for index, item in enumerate(items):
+        problem = batch_item_problem(item)
+        position = None
+        timestamp = now
+        if not problem and ("latitude" in item or "longitude" in item):
+            position = parse_coordinates(item.get("latitude"), item.get("longitude"))
+            if not position:
+                problem = "Invalid coordinates"
+        if not problem and "status" in item and item["status"] not in ("safe", "alert", "danger"):
+            problem = "Invalid status"
+        if not problem and "timestamp" in item:
+            timestamp = parse_timestamp(item["timestamp"])
+            if timestamp is None:
+                problem = "Invalid timestamp"
+            elif timestamp < now - HISTORY_RETENTION_SECONDS * 1_000_000:
+                problem = "Timestamp older than the history retention"
+        if problem:
+            results.append({"index": index, "error": problem})
+            continue
+        if position:
+            timestamp = min(timestamp, now)
+            if not trail or timestamp >= latest:
+                latest = timestamp
+                changes["latitude"], changes["longitude"] = position
+            trail.append((timestamp, position[0], position[1]))
+        for field in ("name", "phone"):
+            if field in item:
+                changes[field] = item[field]
+        status = item.get("status", status)
+        results.append({"index": index, "ok": True})
+    
+    if trail:
+        store.record_positions(current_user["id"], trail)
+    if status:
+        set_safety_status(current_user, status, changes)
+    elif changes:
+        store.update_user(current_user, changes)
+    
+    applied = sum(1 for result in results if "ok" in result)
+    return jsonify({
+        "applied": applied,
+        "failed": len(results) - applied,
+        "results": results,
+        "user": current_user.public()
+    })
+
+@app.route('/users/<int:user_id>/history', methods=['GET'])
+def get_position_history(user_id):
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    # Your own trail, or the trail of someone in your friends list
+    if user_id != current_user["id"] and user_id not in store.friends_of(current_user["id"]):
+        return jsonify({"error": "Not authorized"}), 403
     
-    return jsonify({k: v for k, v in current_user.items() if k != "password_hash"})
+    # Either ?start=&end= (ISO times) or the last ?minutes= (default 60)
+    end = parse_timestamp(request.args.get('end')) if 'end' in request.args else now_us()
+    if 'start' in request.args:
+        start = parse_timestamp(request.args.get('start'))
+    else:
+        minutes = request.args.get('minutes', 60, type=float)
+        if minutes is None or not math.isfinite(minutes) or minutes <= 0:
+            return jsonify({"error": "Invalid minutes"}), 400
+        start = max(end - int(minutes * 60 * 1_000_000), 0) if end is not None else None
+    if start is None or end is None:
+        return jsonify({"error": "Invalid time range"}), 400
+    
+    return jsonify({
+        "user_id": user_id,
+        "points": [
+            {"timestamp": to_iso(timestamp), "latitude": lat, "longitude": lon}
+            for timestamp, lat, lon in store.position_history(user_id, start, end)
+        ]
+    })
+
+def record_position(user):
+    """Helper function to add a user's current position to their trail"""
+    position = parse_coordinates(user["latitude"], user["longitude"])
+    if position:
+        store.record_positions(user["id"], [(now_us(), position[0], position[1])])
+
+def parse_timestamp(value):
+    """Helper function to read a client ISO timestamp as epoch microseconds, or None"""
+    if not isinstance(value, str):
+        return None
+    try:
+        return to_epoch_us(value)
+    except (TypeError, ValueError):
+        return None
+
+def read_batch():
+    """Helper function to read a batch body as a list of items.
+    
+    Returns `(items, None)`, or `(None, error_response)` if the body is not
+    a batch or holds more than MAX_BATCH_ITEMS items.
+    """
+    too_large = {"error": f"Batch larger than {MAX_BATCH_ITEMS} items"}
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for line in iter_lines(request.stream):
+            line = line.strip()
+            if not line:
+                continue
+            if len(items) == MAX_BATCH_ITEMS:
+                return None, (jsonify(too_large), 413)
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(INVALID_ITEM)
+        return items, None
+    
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return None, (jsonify({"error": "Expected a JSON array or NDJSON body"}), 400)
+    if len(items) > MAX_BATCH_ITEMS:
+        return None, (jsonify(too_large), 413)
+    return items, None
+
+def iter_lines(stream, chunk_size=65536):
+    """Helper function to split a request stream into lines, reading in large chunks"""
+    pending = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+def batch_item_problem(item):
+    """Helper function to describe why a batch item is unusable, or None"""
+    if item is INVALID_ITEM:
+        return "Invalid JSON"
+    if not isinstance(item, dict):
+        return "Item must be an object"
+    return None
 
 # Friend request endpoints
 @app.route('/friends/request', methods=['POST'])
@@ -173,11 +600,7 @@ def send_friend_request():
     friend_email = request_data.get("friend_email")
     
     # Find friend by email
-    friend = None
-    for user in users:
-        if user["email"] == friend_email:
-            friend = user
-            break
+    friend = store.get_user_by_email(friend_email)
     
     if not friend:
         return jsonify({"error": "User not found"}), 404
@@ -186,21 +609,16 @@ def send_friend_request():
         return jsonify({"error": "Cannot add yourself as friend"}), 400
     
     # Check if request already exists
-    for req in friend_requests:
-        if (req["from_user_id"] == current_user["id"] and 
-            req["to_user_id"] == friend["id"] and 
-            req["status"] == "pending"):
-            return jsonify({"error": "Friend request already sent"}), 400
-    
-    request_id = len(friend_requests) + 1
-    new_request = {
-        "id": request_id,
-        "from_user_id": current_user["id"],
-        "to_user_id": friend["id"],
-        "status": "pending",
-        "created_at": datetime.utcnow().isoformat()
-    }
-    friend_requests.append(new_request)
+    if store.find_friend_request(current_user["id"], friend["id"], "pending"):
+        return jsonify({"error": "Friend request already sent"}), 400
+    
+    new_request = store.add_friend_request(current_user["id"], friend["id"], datetime.utcnow().isoformat())
+    event_bus.publish("friend_request", {
+        "id": new_request["id"],
+        "from_user": current_user.public(),
+        "status": new_request["status"],
+        "created_at": new_request["created_at"]
+    }, [friend["id"]])
     
     return jsonify({"message": "Friend request sent successfully"}), 201
 
@@ -210,19 +628,20 @@ def get_friend_requests():
     if not current_user:
         return jsonify({"error": "Not authenticated"}), 401
     
+    pending = store.pending_requests_for(current_user["id"])
+    # Get sender info for every request in one lookup
+    senders = {user["id"]: user for user in store.get_users([req["from_user_id"] for req in pending])}
+    
     user_requests = []
-    for req in friend_requests:
-        if req["to_user_id"] == current_user["id"] and req["status"] == "pending":
-            # Get sender info
-            for user in users:
-                if user["id"] == req["from_user_id"]:
-                    user_requests.append({
-                        "id": req["id"],
-                        "from_user": {k: v for k, v in user.items() if k != "password_hash"},
-                        "status": req["status"],
-                        "created_at": req["created_at"]
-                    })
-                    break
+    for req in pending:
+        user = senders.get(req["from_user_id"])
+        if user:
+            user_requests.append({
+                "id": req["id"],
+                "from_user": user.public(),
+                "status": req["status"],
+                "created_at": req["created_at"]
+            })
     
     return jsonify(user_requests)
 
@@ -233,32 +652,27 @@ def respond_to_friend_request(request_id, action):
         return jsonify({"error": "Not authenticated"}), 401
     
     # Find the request
-    request_obj = None
-    for req in friend_requests:
-        if req["id"] == request_id and req["to_user_id"] == current_user["id"]:
-            request_obj = req
-            break
+    request_obj = store.get_friend_request(request_id)
     
-    if not request_obj:
+    if not request_obj or request_obj["to_user_id"] != current_user["id"]:
         return jsonify({"error": "Friend request not found"}), 404
     
     if action == "accept":
-        request_obj["status"] = "accepted"
+        store.set_friend_request_status(request_obj, "accepted")
         # Create friend connection
-        connection_id = len(friends) + 1
-        new_connection = {
-            "id": connection_id,
-            "user_id": request_obj["from_user_id"],
-            "friend_id": request_obj["to_user_id"],
-            "status": "accepted",
-            "created_at": datetime.utcnow().isoformat()
-        }
-        friends.append(new_connection)
+        store.add_friend_connection(
+            request_obj["from_user_id"],
+            request_obj["to_user_id"],
+            "accepted",
+            datetime.utcnow().isoformat()
+        )
+        publish_request_update(request_obj)
         
         return jsonify({"message": "Friend request accepted"})
     
     elif action == "reject":
-        request_obj["status"] = "rejected"
+        store.set_friend_request_status(request_obj, "rejected")
+        publish_request_update(request_obj)
         return jsonify({"message": "Friend request rejected"})
     
     else:
@@ -272,18 +686,64 @@ def create_location():
         return jsonify({"error": "Not authenticated"}), 401
     
     location_data = request.get_json()
-    location_id = len(locations) + 1
-    new_location = {
-        "id": location_id,
+    new_location = store.add_location({
         "user_id": current_user["id"],
         "name": location_data.get("name", "Unknown"),
         "latitude": location_data.get("latitude", 0.0),
         "longitude": location_data.get("longitude", 0.0),
         "type": location_data.get("type", "other"),
-        "created_at": datetime.utcnow().isoformat()
-    }
-    locations.append(new_location)
-    return jsonify(new_location), 201
+        "created_at": now_us()
+    })
+    event_bus.publish("location", new_location.public(), [current_user["id"]])
+    return jsonify(new_location.public()), 201
+
+@app.route('/locations/batch', methods=['POST'])
+def create_locations_batch():
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    items, error = read_batch()
+    if error:
+        return error
+    
+    # Validate in one pass, then write every valid point together
+    results = [None] * len(items)
+    accepted = []
+    new_fields = []
+    created_at = now_us()
+    for index, item in enumerate(items):
+        problem = batch_item_problem(item)
+        position = None if problem else parse_coordinates(item.get("latitude"), item.get("longitude"))
+        if not problem and not position:
+            problem = "Invalid coordinates"
+        if problem:
+            results[index] = {"index": index, "error": problem}
+            continue
+        accepted.append(index)
+        new_fields.append({
+            "user_id": current_user["id"],
+            "name": item.get("name", "Unknown"),
+            "latitude": position[0],
+            "longitude": position[1],
+            "type": item.get("type", "other"),
+            "created_at": created_at
+        })
+    
+    new_locations = store.add_locations(new_fields) if new_fields else []
+    for index, location in zip(accepted, new_locations):
+        results[index] = {"index": index, "id": location["id"]}
+    if new_locations:
+        event_bus.publish("locations", {
+            "count": len(new_locations),
+            "last_id": new_locations[-1]["id"]
+        }, [current_user["id"]])
+    
+    return jsonify({
+        "created": len(new_locations),
+        "failed": len(items) - len(new_locations),
+        "results": results
+    })
 
 @app.route('/locations/', methods=['GET'])
 def get_locations():
@@ -291,27 +751,26 @@ def get_locations():
     if not current_user:
         return jsonify({"error": "Not authenticated"}), 401
     
-    user_locations = [loc for loc in locations if loc["user_id"] == current_user["id"]]
-    return jsonify(user_locations)
+    return cached_json(current_user["id"], lambda: [
+        location.public() for location in store.locations_for(current_user["id"])
+    ])
 
 @app.route('/locations/user/<int:user_id>', methods=['GET'])
 def get_user_locations(user_id):
-    user_locations = [loc for loc in locations if loc["user_id"] == user_id]
-    return jsonify(user_locations)
+    return cached_json(user_id, lambda: [
+        location.public() for location in store.locations_for(user_id)
+    ])
 
 # Friend connection endpoints
 @app.route('/friends/', methods=['POST'])
 def add_friend():
     connection_data = request.get_json()
-    connection_id = len(friends) + 1
-    new_connection = {
-        "id": connection_id,
-        "user_id": connection_data.get("user_id"),
-        "friend_id": connection_data.get("friend_id"),
-        "status": "pending",
-        "created_at": datetime.utcnow().isoformat()
-    }
-    friends.append(new_connection)
+    store.add_friend_connection(
+        connection_data.get("user_id"),
+        connection_data.get("friend_id"),
+        "pending",
+        datetime.utcnow().isoformat()
+    )
     return jsonify({"message": "Friend connection created", "status": "pending"}), 201
 
 @app.route('/friends/', methods=['GET'])
@@ -320,27 +779,49 @@ def get_friends():
     if not current_user:
         return jsonify({"error": "Not authenticated"}), 401
     
-    user_friends = []
-    for connection in friends:
-        if connection["user_id"] == current_user["id"] and connection["status"] == "accepted":
-            for user in users:
-                if user["id"] == connection["friend_id"]:
-                    user_friends.append({k: v for k, v in user.items() if k != "password_hash"})
-                    break
-    return jsonify(user_friends)
+    return cached_json(current_user["id"], lambda: [
+        user.public()
+        for user in store.get_users(store.friends_of(current_user["id"]))
+    ])
 
 @app.route('/friends/<int:user_id>', methods=['GET'])
 def get_friends_by_id(user_id):
-    user_friends = []
-    for connection in friends:
-        if connection["user_id"] == user_id and connection["status"] == "accepted":
-            for user in users:
-                if user["id"] == connection["friend_id"]:
-                    user_friends.append({k: v for k, v in user.items() if k != "password_hash"})
-                    break
-    return jsonify(user_friends)
+    return cached_json(user_id, lambda: [
+        user.public()
+        for user in store.get_users(store.friends_of(user_id))
+    ])
 
 # Weather and disaster data endpoints
+def fetch_openweather(lat, lon):
+    """Helper function to load current conditions from OpenWeatherMap"""
+    data = upstream.get_json(OPENWEATHER_URL, params=openweather_params(lat, lon))
+    return parse_openweather(data)
+
+async def fetch_openweather_async(lat, lon):
+    """Helper function to load current conditions from OpenWeatherMap without blocking the event loop"""
+    data = await upstream.get_json_async(OPENWEATHER_URL, params=openweather_params(lat, lon))
+    return parse_openweather(data)
+
+def openweather_params(lat, lon):
+    return {
+        "lat": lat,
+        "lon": lon,
+        "appid": OPENWEATHER_API_KEY,
+        "units": "metric"
+    }
+
+def parse_openweather(data):
+    return {
+        "temperature": data["main"]["temp"],
+        "humidity": data["main"]["humidity"],
+        "pressure": data["main"]["pressure"],
+        "wind_speed": data["wind"]["speed"],
+        "wind_direction": data["wind"]["deg"],
+        "description": data["weather"][0]["description"],
+        "icon": data["weather"][0]["icon"],
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
 @app.route('/weather/<lat>/<lon>', methods=['GET'])
 def get_weather_data(lat, lon):
     try:
@@ -350,104 +831,232 @@ def get_weather_data(lat, lon):
         
         # Try to get real weather data from OpenWeatherMap
         if OPENWEATHER_API_KEY and OPENWEATHER_API_KEY != "demo_key":
-            url = "https://api.openweathermap.org/data/2.5/weather"
-            params = {
-                "lat": lat_float,
-                "lon": lon_float,
-                "appid": OPENWEATHER_API_KEY,
-                "units": "metric"
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            weather_data = {
-                "latitude": lat_float,
-                "longitude": lon_float,
-                "temperature": data["main"]["temp"],
-                "humidity": data["main"]["humidity"],
-                "pressure": data["main"]["pressure"],
-                "wind_speed": data["wind"]["speed"],
-                "wind_direction": data["wind"]["deg"],
-                "description": data["weather"][0]["description"],
-                "icon": data["weather"][0]["icon"],
-                "timestamp": datetime.utcnow().isoformat(),
-                "source": "OpenWeatherMap"
-            }
-            return jsonify(weather_data)
+            conditions = weather_cache.get(lat_float, lon_float, fetch_openweather)
+            return jsonify(weather_payload(lat_float, lon_float, conditions))
         else:
             # Fallback to mock data if no API key
-            weather_data = {
-                "latitude": lat_float,
-                "longitude": lon_float,
-                "temperature": 22.5,
-                "humidity": 65.0,
-                "pressure": 1013.25,
-                "wind_speed": 5.2,
-                "wind_direction": 180.0,
-                "description": "Partly cloudy",
-                "icon": "02d",
-                "timestamp": datetime.utcnow().isoformat(),
-                "source": "Mock Data (No API Key)"
-            }
-            return jsonify(weather_data)
+            return jsonify(mock_weather(lat_float, lon_float, "Mock Data (No API Key)"))
             
     except ValueError:
         return jsonify({"error": "Invalid coordinates"}), 400
     except Exception as e:
-        # Return mock data if API fails
-        weather_data = {
-            "latitude": float(lat),
-            "longitude": float(lon),
-            "temperature": 22.5,
-            "humidity": 65.0,
-            "pressure": 1013.25,
-            "wind_speed": 5.2,
-            "wind_direction": 180.0,
-            "description": "Partly cloudy",
-            "icon": "02d",
-            "timestamp": datetime.utcnow().isoformat(),
-            "source": f"Mock Data (API Error: {str(e)})"
-        }
-        return jsonify(weather_data)
+        return jsonify(weather_fallback(float(lat), float(lon), e))
+
+def weather_payload(lat, lon, conditions):
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        **conditions,
+        "source": "OpenWeatherMap"
+    }
+
+def weather_fallback(lat, lon, error):
+    """Helper function for weather when the provider call failed"""
+    # Serve the last known conditions for this area if there are any
+    conditions = weather_cache.peek(lat, lon)
+    if conditions:
+        return weather_payload(lat, lon, conditions)
+    
+    # Return mock data if API fails
+    return mock_weather(lat, lon, f"Mock Data (API Error: {str(error)})")
+
+def mock_weather(lat, lon, source):
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "temperature": 22.5,
+        "humidity": 65.0,
+        "pressure": 1013.25,
+        "wind_speed": 5.2,
+        "wind_direction": 180.0,
+        "description": "Partly cloudy",
+        "icon": "02d",
+        "timestamp": datetime.utcnow().isoformat(),
+        "source": source
+    }
+
+@app.route('/weather/cache/stats', methods=['GET'])
+def get_weather_cache_stats():
+    return jsonify(weather_cache.stats())
+
+@app.route('/weather/upstream/stats', methods=['GET'])
+def get_weather_upstream_stats():
+    return jsonify(upstream.stats())
+
+@app.route('/auth/hasher/stats', methods=['GET'])
+def get_password_hasher_stats():
+    return jsonify(password_hasher.stats())
+
+@app.route('/ratelimit/stats', methods=['GET'])
+def get_rate_limit_stats():
+    return jsonify(limiter.stats())
+
+@app.route('/notifications/stats', methods=['GET'])
+def get_notification_stats():
+    return jsonify(notifier.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    exposition = Exposition()
+    request_metrics.collect(exposition)
+    for client, upstream_client in (("weather", upstream), ("disaster_feed", feed_upstream)):
+        stats = upstream_client.stats()
+        exposition.stats("upstream", "Upstream client", stats, gauges=("in_flight",), labels={"client": client})
+        exposition.add("upstream_circuit_state", "gauge", "Upstream circuit breaker state", [
+            ({"client": client, "state": state}, int(stats["circuit"] == state))
+            for state in ("closed", "open", "half_open")
+        ])
+    exposition.histogram("upstream_request_duration_seconds", "Upstream call latency", [
+        ({"client": "weather"}, upstream.latency), ({"client": "disaster_feed"}, feed_upstream.latency)
+    ])
+    exposition.stats("weather_cache", "Weather cache", weather_cache.stats(), gauges=("entries", "in_flight"))
+    exposition.stats("response_cache", "Response cache", response_cache.stats(), gauges=("entries",))
+    exposition.stats("rate_limit", "Rate limiter", limiter.stats(), gauges=("keys",))
+    exposition.stats("password_hasher", "Password hasher", password_hasher.stats(), gauges=("pending", "workers"))
+    exposition.stats("notifications", "Notification pipeline", notifier.stats(),
+                     gauges=("queue_depth", "in_flight_batches"))
+    exposition.stats("disaster_feed", "Disaster feed", disaster_feed.stats(), gauges=("events",))
+    exposition.add("store_records", "gauge", "Records held by the data store", [
+        ({"table": table}, count) for table, count in store.counts().items()
+    ])
+    if getattr(store, "journal", None) is not None:
+        journal_stats = store.journal_stats()
+        exposition.stats("store_journal", "Store journal", journal_stats,
+                         gauges=("pending", "segment", "since_snapshot"))
+        exposition.stats("store_recovery", "Store recovery at startup", journal_stats["recovery"],
+                         gauges=("snapshot_seconds", "replay_seconds", "replayed_entries"))
+        if journal_stats["last_snapshot"]:
+            exposition.stats("store_snapshot", "Last store snapshot", journal_stats["last_snapshot"],
+                             gauges=("at", "seconds", "bytes"))
+    exposition.add("sessions", "gauge", "Active login sessions", len(sessions))
+    exposition.add("event_stream_subscribers", "gauge", "Open event stream subscriptions",
+                   event_bus.subscriber_count())
+    exposition.add("active_hazards", "gauge", "Hazards checked by the geofence", len(active_hazards))
+    return Response(exposition.render(), content_type=Exposition.CONTENT_TYPE)
+
+@app.route('/debug/profiler', methods=['GET'])
+def get_profiler_samples():
+    if not PROFILER_ENABLED:
+        return jsonify({"error": "Profiler disabled"}), 404
+    if request.args.get('format') == 'json':
+        return jsonify(profiler.stats())
+    return Response(profiler.collapsed(), mimetype='text/plain')
+
+@app.route('/debug/profiler/start', methods=['POST'])
+def start_profiler():
+    if not PROFILER_ENABLED:
+        return jsonify({"error": "Profiler disabled"}), 404
+    
+    seconds = request.args.get('seconds', 30.0, type=float)
+    interval = request.args.get('interval', type=float)
+    if not 0 < seconds <= PROFILER_MAX_SECONDS or (interval is not None and not 0.001 <= interval <= 1):
+        return jsonify({"error": "Invalid profiler settings"}), 400
+    if not profiler.start(seconds, interval):
+        return jsonify({"error": "Profiler already running"}), 409
+    return jsonify(profiler.stats())
+
+@app.route('/debug/profiler/stop', methods=['POST'])
+def stop_profiler():
+    if not PROFILER_ENABLED:
+        return jsonify({"error": "Profiler disabled"}), 404
+    profiler.stop()
+    return jsonify(profiler.stats())
+
+def query_radius():
+    """Helper function to read the `radius` query parameter (km), or None if it is out of range"""
+    radius = request.args.get('radius', 100.0, type=float)
+    # NaN fails the comparison and infinity is over the cap
+    if not 0 < radius <= MAX_QUERY_RADIUS_KM:
+        return None
+    return radius
 
 @app.route('/disasters/<lat>/<lon>', methods=['GET'])
 def get_disaster_data(lat, lon):
-    try:
-        lat_float = float(lat)
-        lon_float = float(lon)
-        radius = request.args.get('radius', 100.0, type=float)
-        
-        # Mock disaster data
+    position = parse_coordinates(lat, lon)
+    if not position:
+        return jsonify({"error": "Invalid coordinates"}), 400
+    radius = query_radius()
+    if radius is None:
+        return jsonify({"error": "Invalid radius"}), 400
+    
+    if disaster_feed.sources:
+        # Events already ingested from the feeds, nearest first
         disaster_data = [
-            {
-                "id": "mock_earthquake_1",
-                "type": "earthquake",
-                "title": "Minor Earthquake",
-                "description": "Minor seismic activity detected",
-                "latitude": lat_float + 0.01,
-                "longitude": lon_float + 0.01,
-                "magnitude": 3.2,
-                "radius": radius,
-                "timestamp": datetime.utcnow().isoformat(),
-                "severity": "low"
-            },
-            {
-                "id": "mock_flood_1",
-                "type": "flood",
-                "title": "Flood Warning",
-                "description": "Heavy rainfall causing flooding",
-                "latitude": lat_float - 0.01,
-                "longitude": lon_float - 0.01,
-                "radius": radius,
-                "timestamp": datetime.utcnow().isoformat(),
-                "severity": "medium"
-            }
+            {**event, "distance_km": round(distance, 3)}
+            for event, distance in disaster_store.near(position[0], position[1], radius)
         ]
-        return jsonify(disaster_data)
-    except ValueError:
+    else:
+        # Demo events only; they never reach the geofence
+        disaster_data = mock_disasters(position[0], position[1], radius)
+    
+    # Count the users each event reaches
+    for disaster in disaster_data:
+        disaster["affected_users"] = len(
+            store.users_near(disaster["latitude"], disaster["longitude"], disaster["radius"])
+        )
+    return jsonify(disaster_data)
+
+@app.route('/disasters/feed/stats', methods=['GET'])
+def get_disaster_feed_stats():
+    return jsonify(disaster_feed.stats())
+
+def mock_disasters(lat_float, lon_float, radius):
+    """Helper function for demo events around a point when no feed is configured"""
+    return [
+        {
+            "id": "mock_earthquake_1",
+            "type": "earthquake",
+            "title": "Minor Earthquake",
+            "description": "Minor seismic activity detected",
+            "latitude": lat_float + 0.01,
+            "longitude": lon_float + 0.01,
+            "magnitude": 3.2,
+            "radius": radius,
+            "timestamp": datetime.utcnow().isoformat(),
+            "severity": "low"
+        },
+        {
+            "id": "mock_flood_1",
+            "type": "flood",
+            "title": "Flood Warning",
+            "description": "Heavy rainfall causing flooding",
+            "latitude": lat_float - 0.01,
+            "longitude": lon_float - 0.01,
+            "radius": radius,
+            "timestamp": datetime.utcnow().isoformat(),
+            "severity": "medium"
+        }
+    ]
+
+@app.route('/disasters/<lat>/<lon>/affected', methods=['GET'])
+def get_affected_users(lat, lon):
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    position = parse_coordinates(lat, lon)
+    if not position:
         return jsonify({"error": "Invalid coordinates"}), 400
+    radius = query_radius()
+    if radius is None:
+        return jsonify({"error": "Invalid radius"}), 400
+    
+    # Users and saved places within radius km of the hazard, nearest first
+    affected_users = [
+        {**user.public(), "distance_km": round(distance, 3)}
+        for user, distance in store.users_near(position[0], position[1], radius)
+    ]
+    affected_locations = [
+        {**location.public(), "distance_km": round(distance, 3)}
+        for location, distance in store.locations_near(position[0], position[1], radius)
+    ]
+    return jsonify({
+        "latitude": position[0],
+        "longitude": position[1],
+        "radius": radius,
+        "users": affected_users,
+        "locations": affected_locations
+    })
 
 @app.route('/weather/radar/<lat>/<lon>', methods=['GET'])
 def get_weather_radar(lat, lon):
@@ -473,12 +1082,7 @@ def mark_safe(user_id):
     if not current_user or current_user["id"] != user_id:
         return jsonify({"error": "Not authorized"}), 401
     
-    current_user["is_safe"] = True
-    current_user["status"] = "safe"
-    current_user["last_safe_update"] = datetime.utcnow().isoformat()
-    
-    # Notify friends
-    notify_friends(user_id, "safe")
+    set_safety_status(current_user, "safe")
     
     return jsonify({"message": "Safety status updated", "status": "safe"})
 
@@ -488,23 +1092,7 @@ def send_emergency_alert(user_id):
     if not current_user or current_user["id"] != user_id:
         return jsonify({"error": "Not authorized"}), 401
     
-    current_user["is_safe"] = False
-    current_user["status"] = "alert"
-    current_user["last_safe_update"] = datetime.utcnow().isoformat()
-    
-    # Create alert
-    alert_id = len(alerts) + 1
-    new_alert = {
-        "id": alert_id,
-        "user_id": user_id,
-        "type": "emergency_alert",
-        "message": "Emergency alert sent",
-        "created_at": datetime.utcnow().isoformat()
-    }
-    alerts.append(new_alert)
-    
-    # Notify friends
-    notify_friends(user_id, "alert")
+    set_safety_status(current_user, "alert")
     
     return jsonify({"message": "Emergency alert sent to all contacts", "status": "alert"})
 
@@ -514,36 +1102,49 @@ def mark_danger(user_id):
     if not current_user or current_user["id"] != user_id:
         return jsonify({"error": "Not authorized"}), 401
     
-    current_user["is_safe"] = False
-    current_user["status"] = "danger"
-    current_user["last_safe_update"] = datetime.utcnow().isoformat()
+    set_safety_status(current_user, "danger")
+    
+    return jsonify({"message": "Danger status updated", "status": "danger"})
+
+# Alert type and message created when a user moves to each status
+STATUS_ALERTS = {
+    "alert": ("emergency_alert", "Emergency alert sent"),
+    "danger": ("danger_alert", "User marked as in danger")
+}
+
+def set_safety_status(user, status, changes=None):
+    """Helper function to set a user's safety status, raise any alert and notify friends"""
+    store.update_user(user, {
+        **(changes or {}),
+        "is_safe": status == "safe",
+        "status": status,
+        "last_safe_update": now_us()
+    })
     
     # Create alert
-    alert_id = len(alerts) + 1
-    new_alert = {
-        "id": alert_id,
-        "user_id": user_id,
-        "type": "danger_alert",
-        "message": "User marked as in danger",
-        "created_at": datetime.utcnow().isoformat()
-    }
-    alerts.append(new_alert)
+    new_alert = None
+    if status in STATUS_ALERTS:
+        alert_type, message = STATUS_ALERTS[status]
+        new_alert = store.add_alert({
+            "user_id": user["id"],
+            "type": alert_type,
+            "message": message,
+            "created_at": now_us()
+        })
     
     # Notify friends
-    notify_friends(user_id, "danger")
-    
-    return jsonify({"message": "Danger status updated", "status": "danger"})
+    notify_friends(user["id"], status, new_alert)
 
 @app.route('/emergency/status/<int:user_id>', methods=['GET'])
 def get_safety_status(user_id):
-    for user in users:
-        if user["id"] == user_id:
-            return jsonify({
-                "user_id": user_id,
-                "is_safe": user["is_safe"],
-                "status": user["status"],
-                "last_update": user["last_safe_update"]
-            })
+    user = store.get_user(user_id)
+    if user:
+        return jsonify({
+            "user_id": user_id,
+            "is_safe": user["is_safe"],
+            "status": user["status"],
+            "last_update": to_iso(user["last_safe_update"])
+        })
     return jsonify({"error": "User not found"}), 404
 
 @app.route('/emergency/alerts', methods=['GET'])
@@ -552,26 +1153,153 @@ def get_alerts():
     if not current_user:
         return jsonify({"error": "Not authenticated"}), 401
     
+    # Optional cursor: only alerts newer than since_id, at most limit of them
+    since_id = request.args.get('since_id', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"error": "Invalid limit"}), 400
+    
     # Get alerts for current user and their friends
-    user_alerts = []
-    for alert in alerts:
-        if alert["user_id"] == current_user["id"]:
-            user_alerts.append(alert)
-        else:
-            # Check if alert is from a friend
-            for connection in friends:
-                if (connection["user_id"] == current_user["id"] and 
-                    connection["friend_id"] == alert["user_id"] and 
-                    connection["status"] == "accepted"):
-                    user_alerts.append(alert)
-                    break
-    
-    return jsonify(user_alerts)
-
-def notify_friends(user_id, status):
-    """Helper function to notify friends of status changes"""
-    # In a real app, this would send push notifications, emails, etc.
-    print(f"User {user_id} status changed to {status} - notifying friends")
+    return cached_json(current_user["id"], lambda: [
+        alert.public() for alert in store.alert_feed(current_user["id"], since_id, limit)
+    ])
+
+def notify_friends(user_id, status, alert=None):
+    """Helper function to queue a status change for delivery to friends"""
+    user = store.get_user(user_id)
+    notifier.submit(user_id, status, {
+        "user_id": user_id,
+        "is_safe": user["is_safe"],
+        "status": user["status"],
+        "last_update": to_iso(user["last_safe_update"])
+    }, alert.public() if alert else None)
+
+def update_active_hazards(hazards):
+    """Helper function to replace the active hazards and re-check exposure if they changed"""
+    with geofence_lock:
+        active_hazards.clear()
+        for hazard in hazards:
+            active_hazards[hazard["id"]] = hazard
+        signature = sorted(
+            (hazard_id, hazard["latitude"], hazard["longitude"], hazard["radius"])
+            for hazard_id, hazard in active_hazards.items()
+        )
+        if signature == geofence_state["signature"]:
+            return
+        geofence_state["signature"] = signature
+        if geofence_state["thread"] is None:
+            geofence_state["thread"] = threading.Thread(target=run_geofence, daemon=True)
+            geofence_state["thread"].start()
+    geofence_wakeup.set()
+
+def run_geofence():
+    """Background loop evaluating all users whenever the hazard list changes"""
+    while True:
+        geofence_wakeup.wait()
+        geofence_wakeup.clear()
+        with geofence_lock:
+            hazards = list(active_hazards.values())
+        try:
+            entered, left = geofence.evaluate(hazards)
+            apply_exposure_changes(entered, left)
+        except Exception:
+            app.logger.exception("Geofence evaluation failed")
+
+def apply_exposure_changes(entered, left):
+    """Helper function to tell users they moved into or out of a hazard zone"""
+    for user_id in entered:
+        event_bus.publish("hazard_exposure", {"user_id": user_id, "exposed": True}, [user_id])
+        user = store.get_user(user_id)
+        if GEOFENCE_AUTO_ALERT and user and user["status"] == "safe":
+            store.update_user(user, {
+                "is_safe": False,
+                "status": "alert",
+                "last_safe_update": now_us()
+            })
+            notify_friends(user_id, "alert")
+    for user_id in left:
+        event_bus.publish("hazard_exposure", {"user_id": user_id, "exposed": False}, [user_id])
+
+def publish_request_update(request_obj):
+    """Helper function to tell both sides a friend request was answered"""
+    event_bus.publish("friend_request_updated", {
+        "id": request_obj["id"],
+        "from_user_id": request_obj["from_user_id"],
+        "to_user_id": request_obj["to_user_id"],
+        "status": request_obj["status"]
+    }, [request_obj["from_user_id"], request_obj["to_user_id"]])
+
+def format_event(event):
+    """Helper function to encode an event as a server-sent event frame"""
+    frame = ""
+    if event["version"] is not None:
+        frame += f"id: {event['version']}\n"
+    return frame + f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+# Real-time event endpoints
+@app.route('/events/stream', methods=['GET'])
+def stream_events():
+    current_user = get_current_user()
+    if not current_user:
+        # EventSource cannot send headers, so the token may come as ?token=
+        current_user = user_for_token(request.args.get('token', ''))
+    if not current_user:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    user_id = current_user["id"]
+    # Browsers send the last id they saw when they reconnect
+    last_version = request.headers.get('Last-Event-ID', type=int)
+    subscription = event_bus.subscribe(user_id)
+    
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            seen = 0
+            if last_version is not None:
+                missed, complete, _ = event_bus.changes_since(user_id, last_version)
+                if not complete:
+                    yield format_event({"version": None, "type": "resync", "data": {}})
+                for event in missed:
+                    yield format_event(event)
+                    seen = event["version"]
+            while True:
+                events = subscription.get(EVENT_HEARTBEAT_SECONDS)
+                if not events:
+                    yield ": heartbeat\n\n"
+                    continue
+                for event in events:
+                    # Skip anything already replayed from history above
+                    if event["version"] is not None and event["version"] <= seen:
+                        continue
+                    yield format_event(event)
+        finally:
+            event_bus.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.route('/events/changes', methods=['GET'])
+def get_changes():
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Not authenticated"}), 401
+    
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', 100, type=int)
+    if limit < 1:
+        return jsonify({"error": "Invalid limit"}), 400
+    
+    events, complete, version = event_bus.changes_since(current_user["id"], since, limit)
+    return jsonify({
+        "version": version,
+        "events": events,
+        "resync": not complete
+    })
+
+# Started last, since feed updates call into the hazard helpers above
+disaster_feed.start()
 
 if __name__ == '__main__':
     print("🚀 Starting SafeSphere Backend (Flask)...")
@@ -0,0 +1,41 @@
+"""Adjacency-set friend graph.
+
+Friend connections in SafeSphere are one-directional rows: a connection
+`user_id -> friend_id` puts `friend_id` in `user_id`'s friends list and alert
+feed, and nothing else. The graph mirrors that exactly. `friends_of` follows
+the rows forwards and `followers_of` follows them backwards (everyone who
+sees a given user), so both directions cost O(degree).
+"""
+import threading
+
+
+class FriendGraph:
+    """Per-user adjacency sets over accepted friend connections"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Dicts are used as insertion-ordered sets so friends come back in the
+        # order the connections were made
+        self._friends = {}
+        self._followers = {}
+
+    def add(self, user_id, friend_id):
+        """Record an accepted `user_id -> friend_id` connection"""
+        with self._lock:
+            self._friends.setdefault(user_id, {})[friend_id] = None
+            self._followers.setdefault(friend_id, {})[user_id] = None
+
+    def add_many(self, connections):
+        """Record many `(user_id, friend_id)` connections under one lock"""
+        with self._lock:
+            for user_id, friend_id in connections:
+                self._friends.setdefault(user_id, {})[friend_id] = None
+                self._followers.setdefault(friend_id, {})[user_id] = None
+
+    def friends_of(self, user_id):
+        """Ids `user_id` has an accepted connection to"""
+        return list(self._friends.get(user_id, ()))
+
+    def followers_of(self, user_id):
+        """Ids that have an accepted connection to `user_id`"""
+        return list(self._followers.get(user_id, ()))
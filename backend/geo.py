@@ -0,0 +1,84 @@
+"""Geographic helpers shared by the caches and indexes."""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lon, precision=5):
+    """Encode a coordinate as a geohash of `precision` characters.
+
+    Precision 5 is a cell of roughly 4.9 x 4.9 km, precision 6 roughly
+    1.2 x 0.6 km. Nearby points share a prefix, so a geohash makes a cheap
+    cache or bucket key for "about the same place".
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def parse_coordinates(lat, lon):
+    """Return `(lat, lon)` as floats, or None if they are not a valid position"""
+    try:
+        lat = float(lat)
+        lon = float(lon)
+    except (TypeError, ValueError):
+        return None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None
+    return lat, lon
+
+
+def haversine_km_many(lat, lon, lats, lons):
+    """Distances in km from one point to arrays of points, vectorised"""
+    lat = math.radians(lat)
+    lats = np.radians(lats)
+    a = (np.sin((lats - lat) / 2) ** 2
+         + math.cos(lat) * np.cos(lats) * np.sin((np.radians(lons) - math.radians(lon)) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def radius_bbox(lat, lon, radius_km):
+    """Bounding box `(min_lat, min_lon, max_lat, max_lon)` around a circle.
+
+    Longitudes are not wrapped, so `min_lon` can be below -180 or `max_lon`
+    above 180 when the circle crosses the antimeridian.
+    """
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat <= 1e-9 or radius_km / (KM_PER_DEGREE_LAT * cos_lat) >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    dlon = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+    return min_lat, lon - dlon, max_lat, lon + dlon
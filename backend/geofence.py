@@ -0,0 +1,167 @@
+"""Batch geofencing of every user against the active hazard list.
+
+User positions live in contiguous NumPy arrays (radians plus a precomputed
+cosine of latitude), kept in latitude order so a block of rows covers a narrow
+band of the globe. Evaluation walks the users block by block. For each block
+it keeps only the hazards whose latitude band overlaps the block, builds the
+haversine term for that block x hazard sub-matrix, and compares it against
+each hazard's radius. Block size is chosen so the scratch matrices stay under
+`memory_limit` bytes. Only users whose exposure changed since the previous
+evaluation are reported.
+"""
+import math
+import threading
+
+import numpy as np
+
+from geo import EARTH_RADIUS_KM
+
+# float64 scratch matrices per block (two work buffers plus the comparison)
+_BYTES_PER_CELL = 8 * 2 + 1
+
+
+class GeofenceEngine:
+    """Tracks user positions and which users sit inside any hazard radius"""
+
+    def __init__(self, memory_limit=64 * 1024 * 1024):
+        self.memory_limit = memory_limit
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._lat = np.empty(0)
+        self._lon = np.empty(0)
+        self._cos_lat = np.empty(0)
+        self._exposed = np.zeros(0, dtype=bool)
+        self._row_of = {}
+        self._sorted_rows = 0
+        self._pending = {}  # user_id -> (lat, lon) or None, applied on evaluate
+
+    def set_position(self, user_id, position):
+        """Queue a position change; `position` is `(lat, lon)` or None"""
+        with self._lock:
+            self._pending[user_id] = position
+
+    def load(self, user_ids, lats, lons):
+        """Replace all positions at once from parallel sequences (degrees)"""
+        with self._lock:
+            self._pending.clear()
+            self._rebuild(np.asarray(user_ids, dtype=np.int64),
+                          np.radians(np.asarray(lats, dtype=np.float64)),
+                          np.radians(np.asarray(lons, dtype=np.float64)),
+                          np.zeros(len(user_ids), dtype=bool))
+
+    def _rebuild(self, ids, lat, lon, exposed):
+        # Drop rows that no longer matter (moved away, or removed and already
+        # reported), then sort by latitude so each block is spatially narrow
+        keep = ~(np.isnan(lat) & ~exposed)
+        ids, lat, lon, exposed = ids[keep], lat[keep], lon[keep], exposed[keep]
+        order = np.argsort(lat, kind="stable")
+        self._ids = ids[order]
+        self._lat = lat[order]
+        self._lon = lon[order]
+        self._cos_lat = np.cos(self._lat)
+        self._exposed = exposed[order]
+        self._row_of = dict(zip(self._ids.tolist(), range(len(self._ids))))
+        self._sorted_rows = len(self._ids)
+
+    def _apply_pending(self):
+        if not self._pending:
+            return
+        new_ids, new_lat, new_lon, new_exposed = [], [], [], []
+        for user_id, position in self._pending.items():
+            row = self._row_of.get(user_id)
+            was_exposed = False
+            if row is not None:
+                # Vacate the old row; a removed user keeps theirs until its
+                # exposure has been reported as cleared
+                self._lat[row] = self._lon[row] = self._cos_lat[row] = np.nan
+                if position is not None:
+                    was_exposed = bool(self._exposed[row])
+                    self._exposed[row] = False
+                    self._ids[row] = -1
+                    del self._row_of[user_id]
+            if position is not None:
+                new_ids.append(user_id)
+                new_lat.append(math.radians(position[0]))
+                new_lon.append(math.radians(position[1]))
+                new_exposed.append(was_exposed)
+        self._pending.clear()
+        if not new_ids:
+            return
+
+        # New and moved users go to a tail that is kept sorted on its own
+        first_new = len(self._ids)
+        self._ids = np.concatenate([self._ids, np.asarray(new_ids, dtype=np.int64)])
+        self._lat = np.concatenate([self._lat, new_lat])
+        self._lon = np.concatenate([self._lon, new_lon])
+        self._cos_lat = np.concatenate([self._cos_lat, np.cos(new_lat)])
+        self._exposed = np.concatenate([self._exposed, np.asarray(new_exposed, dtype=bool)])
+        self._row_of.update(zip(new_ids, range(first_new, len(self._ids))))
+        if len(self._ids) - self._sorted_rows > len(self._ids) // 10:
+            self._rebuild(self._ids, self._lat, self._lon, self._exposed)
+        else:
+            self._sort_tail()
+
+    def _sort_tail(self):
+        start = self._sorted_rows
+        order = np.argsort(self._lat[start:], kind="stable") + start
+        for column in (self._ids, self._lat, self._lon, self._cos_lat, self._exposed):
+            column[start:] = column[order]
+        self._row_of.update(
+            (user_id, start + offset)
+            for offset, user_id in enumerate(self._ids[start:].tolist()) if user_id >= 0
+        )
+
+    def evaluate(self, hazards):
+        """Re-check every user against `hazards`.
+
+        `hazards` are dicts with `latitude`, `longitude` and `radius` (km).
+        Returns `(entered, left)`: lists of user ids that became exposed and
+        that are no longer exposed since the last call.
+        """
+        with self._lock:
+            self._apply_pending()
+            exposed = self._compute(hazards)
+            changed = exposed != self._exposed
+            entered = self._ids[changed & exposed].tolist()
+            left = self._ids[changed & ~exposed].tolist()
+            self._exposed = exposed
+            return entered, left
+
+    def _compute(self, hazards):
+        count = len(self._ids)
+        exposed = np.zeros(count, dtype=bool)
+        if not hazards or not count:
+            return exposed
+
+        h_lat = np.radians([float(h["latitude"]) for h in hazards])
+        h_lon = np.radians([float(h["longitude"]) for h in hazards])
+        h_cos = np.cos(h_lat)
+        # Angular radius; d <= r exactly when the haversine term is <= sin^2(r / 2R)
+        h_angle = np.minimum(np.array([float(h["radius"]) for h in hazards]) / EARTH_RADIUS_KM, math.pi)
+        h_threshold = np.sin(h_angle / 2) ** 2
+
+        rows = max(1, int(self.memory_limit // (_BYTES_PER_CELL * len(hazards))))
+        for start in range(0, count, rows):
+            stop = min(start + rows, count)
+            block_lat = self._lat[start:stop]
+            band = block_lat[~np.isnan(block_lat)]
+            if not band.size:
+                continue
+            nearby = np.flatnonzero((h_lat + h_angle >= band.min()) & (h_lat - h_angle <= band.max()))
+            if not nearby.size:
+                continue
+
+            # hav(dlat) + cos(lat1) cos(lat2) hav(dlon), built in two buffers
+            term = np.subtract.outer(block_lat, h_lat[nearby])
+            term *= 0.5
+            np.sin(term, out=term)
+            np.square(term, out=term)
+            lon_term = np.subtract.outer(self._lon[start:stop], h_lon[nearby])
+            lon_term *= 0.5
+            np.sin(lon_term, out=lon_term)
+            np.square(lon_term, out=lon_term)
+            lon_term *= self._cos_lat[start:stop, None]
+            lon_term *= h_cos[nearby]
+            term += lon_term
+            exposed[start:stop] = (term <= h_threshold[nearby]).any(axis=1)
+        return exposed
@@ -0,0 +1,444 @@
+"""Crash recovery for the in-memory store: an append-only journal plus snapshots.
+
+Every change `MemoryStore` makes is appended to the journal as a small
+pickled entry holding the changed record's full new state, so replaying an
+entry twice leaves the same result. A single writer thread writes whatever
+has been queued in one `write` and one fsync (group commit). Concurrent
+requests therefore share a sync instead of paying for one each. With
+`sync=False` nothing waits for the disk, and the writer fsyncs every
+`sync_interval` seconds instead.
+
+A snapshot starts by moving the journal on to a new segment file. It then
+copies the store in chunks, taking the store's lock for one chunk at a time,
+so writes are never held up for long and reads not at all. Writes made while
+the snapshot runs land in the new segment, and are replayed on top of it.
+Once the snapshot file is in place, older segments are deleted.
+
+On start-up the latest snapshot is read through `mmap`, one chunk at a time
+straight from the mapped pages, and then the segments after it are replayed.
+A torn entry at the end of the last segment (a crash mid-write) is cut off.
+
+Files in the directory:
+
+    snapshot.bin          frames: header, then (table, rows) chunks, then an end marker
+    journal-000000N.log   frames: one change per frame, from snapshot N onwards
+
+Each frame is a little-endian `(length, crc32)` header followed by a pickle.
+Loading only accepts plain data (tuples, lists, dicts, strings, numbers),
+never arbitrary classes.
+"""
+import gc
+import io
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+from store import MemoryStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, one process is on trust
+    fcntl = None
+
+FRAME = struct.Struct("<II")  # payload length, CRC-32 of the payload
+SNAPSHOT_FILE = "snapshot.bin"
+SNAPSHOT_FORMAT = 1
+PICKLE_PROTOCOL = 5
+
+
+class JournalError(Exception):
+    """The journal cannot be opened or written"""
+
+
+class _DataUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"journal entries hold plain data only, not {module}.{name}")
+
+
+def encode(entry):
+    payload = pickle.dumps(entry, protocol=PICKLE_PROTOCOL)
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_frames(data):
+    """`(entry, end offset)` for each intact frame in a buffer (such as an
+    mmap), stopping at the first truncated or corrupt one"""
+    offset, size = 0, len(data)
+    while offset + FRAME.size <= size:
+        length, crc = FRAME.unpack_from(data, offset)
+        start, end = offset + FRAME.size, offset + FRAME.size + length
+        if end > size:
+            return
+        payload = data[start:end]
+        if zlib.crc32(payload) != crc:
+            return
+        yield _DataUnpickler(io.BytesIO(payload)).load(), end
+        offset = end
+
+
+def segment_path(directory, segment):
+    return os.path.join(directory, f"journal-{segment:08d}.log")
+
+
+def list_segments(directory):
+    """Segment numbers present in a journal directory, oldest first"""
+    segments = []
+    for name in os.listdir(directory):
+        if name.startswith("journal-") and name.endswith(".log"):
+            try:
+                segments.append(int(name[len("journal-"):-len(".log")]))
+            except ValueError:
+                pass
+    return sorted(segments)
+
+
+def fsync_directory(directory):
+    """Make file creations and renames in a directory durable"""
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _sync(f):
+    f.flush()
+    (getattr(os, "fdatasync", None) or os.fsync)(f.fileno())
+
+
+def mapped(path):
+    """The file's bytes through a read-only memory map (None for an empty file);
+    close it when done"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def replay_segment(path, apply, repair=False):
+    """Call `apply(entry)` for each entry in a segment; returns how many.
+
+    With `repair`, a torn or corrupt tail is cut off the file so new entries
+    are not appended after garbage.
+    """
+    data = mapped(path)
+    if data is None:
+        return 0
+    count = valid = 0
+    try:
+        for entry, valid in read_frames(data):
+            apply(entry)
+            count += 1
+        size = len(data)
+    finally:
+        data.close()
+    if repair and valid < size:
+        with open(path, "r+b") as f:
+            f.truncate(valid)
+            _sync(f)
+    return count
+
+
+def lock_directory(directory):
+    """Hold an exclusive lock on a journal directory for as long as the
+    returned file stays open, so two processes never append to it"""
+    lock_file = open(os.path.join(directory, "journal.lock"), "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise JournalError(f"{directory} is in use by another process")
+    return lock_file
+
+
+def write_snapshot(directory, segment, chunks):
+    """Write `(table, rows)` chunks as the snapshot that journal segment
+    `segment` continues from, replacing the old snapshot only once complete"""
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    temp = path + ".tmp"
+    counts = {}
+    with open(temp, "wb") as f:
+        f.write(encode(("header", {"format": SNAPSHOT_FORMAT, "segment": segment, "created_at": time.time()})))
+        for table, rows in chunks:
+            f.write(encode((table, rows)))
+            if isinstance(rows, list):
+                counts[table] = counts.get(table, 0) + len(rows)
+        f.write(encode(("end", counts)))
+        _sync(f)
+    os.replace(temp, path)
+    fsync_directory(directory)
+    return counts
+
+
+def read_snapshot(directory):
+    """`(segment, chunks)` for the snapshot in `directory`, or `(0, None)` if
+    there is none. `chunks` yields `(table, rows)` straight from the memory
+    map and raises `JournalError` if the file turns out incomplete."""
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return 0, None
+    data = mapped(path)
+    frames = read_frames(data) if data is not None else iter(())
+    first = next(frames, None)
+    if first is None or first[0][0] != "header" or first[0][1].get("format") != SNAPSHOT_FORMAT:
+        raise JournalError(f"{path} is not a snapshot this version can read")
+    header = first[0][1]
+
+    def chunks():
+        try:
+            for (table, rows), _ in frames:
+                if table == "end":
+                    return
+                yield table, rows
+            raise JournalError(f"{path} ends early")
+        finally:
+            data.close()
+
+    return header["segment"], chunks()
+
+
+class Journal:
+    """Append-only log of store changes, written and fsynced by one thread.
+
+    `append` queues an entry and returns its sequence number; `wait` blocks
+    until that entry is on disk.
+    """
+
+    def __init__(self, directory, segment, sync=True, sync_interval=1.0):
+        self.directory = directory
+        self.sync = sync
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+        self._synced = threading.Condition(self._lock)
+        self._buffer = []  # encoded frames; None where a new segment starts
+        self._appended = 0
+        self._durable = 0
+        self._segment = segment  # segment that new appends go to
+        self._closing = False
+        self._error = None
+        self._stats = {"entries": 0, "writes": 0, "syncs": 0, "bytes": 0}
+        self._file_segment = segment  # segment the writer is writing to
+        self._file = open(segment_path(directory, segment), "ab")
+        fsync_directory(directory)
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def segment(self):
+        return self._segment
+
+    def append(self, entry):
+        frame = encode(entry)
+        with self._lock:
+            if self._error is not None:
+                raise JournalError("journal writes are failing") from self._error
+            if self._closing:
+                raise JournalError("journal is closed")
+            self._buffer.append(frame)
+            self._appended += 1
+            self._queued.notify()
+            return self._appended
+
+    def wait(self, ticket):
+        """Block until entry `ticket` has been fsynced (no-op unless `sync`)"""
+        if not self.sync:
+            return
+        with self._lock:
+            while self._durable < ticket and self._error is None:
+                self._synced.wait()
+            if self._durable < ticket:
+                raise JournalError("journal writes are failing") from self._error
+
+    def rotate(self):
+        """Send later appends to a new segment; returns its number"""
+        with self._lock:
+            self._buffer.append(None)
+            self._segment += 1
+            self._queued.notify()
+            return self._segment
+
+    def remove_before(self, segment):
+        """Delete segments older than `segment`, once a snapshot covers them"""
+        for old in list_segments(self.directory):
+            if old < segment:
+                os.remove(segment_path(self.directory, old))
+
+    def close(self):
+        """Write out everything appended so far and stop the writer"""
+        with self._lock:
+            self._closing = True
+            self._queued.notify()
+        self._thread.join()
+
+    def _run(self):
+        dirty = False  # written but not yet fsynced
+        last_sync = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._buffer and not self._closing:
+                    self._queued.wait(self.sync_interval if dirty and not self.sync else None)
+                batch, self._buffer = self._buffer, []
+                upto = self._appended
+                closing = self._closing
+            try:
+                written = self._write(batch)
+                dirty = dirty or written > 0
+                if dirty and (self.sync or closing or time.monotonic() - last_sync >= self.sync_interval):
+                    _sync(self._file)
+                    dirty, last_sync = False, time.monotonic()
+                    self._count(syncs=1)
+            except OSError as e:
+                with self._lock:
+                    self._error = e
+                    self._synced.notify_all()
+                return
+            self._count(entries=len(batch) - batch.count(None), writes=int(written > 0), bytes=written)
+            with self._lock:
+                self._durable = upto
+                self._synced.notify_all()
+            if closing:
+                self._file.close()
+                return
+
+    def _write(self, batch):
+        written = 0
+        frames = []
+        for frame in batch:
+            if frame is not None:
+                frames.append(frame)
+                continue
+            # Finish the current segment before starting the next
+            written += self._flush(frames)
+            frames = []
+            _sync(self._file)
+            self._file.close()
+            self._file_segment += 1
+            self._file = open(segment_path(self.directory, self._file_segment), "ab")
+            fsync_directory(self.directory)
+        return written + self._flush(frames)
+
+    def _flush(self, frames):
+        if not frames:
+            return 0
+        data = b"".join(frames)
+        self._file.write(data)
+        self._file.flush()
+        return len(data)
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self._stats[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._buffer)
+            stats["segment"] = self._segment
+        return stats
+
+
+class JournaledStore(MemoryStore):
+    """`MemoryStore` that journals every change to `directory` and recovers
+    from it when started again.
+
+    A background thread writes a snapshot every `snapshot_interval` seconds,
+    skipping it unless `snapshot_min_entries` changes have been journaled
+    since the last one, which bounds how much journal a restart replays.
+    """
+
+    def __init__(self, directory, sync=True, sync_interval=1.0, snapshot_interval=300.0,
+                 snapshot_min_entries=10000, logger=None, **options):
+        super().__init__(**options)
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_min_entries = snapshot_min_entries
+        self.logger = logger
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = lock_directory(directory)
+
+        started = time.perf_counter()
+        # Recovery only adds long-lived objects, and letting the cyclic
+        # collector rescan the growing heap would take a third of the time.
+        # Afterwards they are frozen, or the first collection would still
+        # have to walk all of them.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            segment, chunks = read_snapshot(directory)
+            if chunks is not None:
+                self.restore_snapshot(chunks)
+            loaded = time.perf_counter()
+            segments = [number for number in list_segments(directory) if number >= segment]
+            replayed = 0
+            for number in segments:
+                replayed += replay_segment(segment_path(directory, number), self.apply, repair=number == segments[-1])
+        finally:
+            gc.freeze()
+            if collecting:
+                gc.enable()
+        self.recovery = {
+            "snapshot_seconds": round(loaded - started, 3),
+            "replay_seconds": round(time.perf_counter() - loaded, 3),
+            "replayed_entries": replayed
+        }
+
+        self.journal = Journal(directory, segments[-1] if segments else segment, sync, sync_interval)
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_entries = self.journal.stats()["entries"]
+        self._last_snapshot = None
+        self._stop = threading.Event()
+        self._snapshot_thread = None
+        if snapshot_interval > 0:
+            self._snapshot_thread = threading.Thread(target=self._run_snapshots, name="store-snapshot", daemon=True)
+            self._snapshot_thread.start()
+
+    def snapshot(self):
+        """Write a snapshot now and drop the journal segments it covers"""
+        with self._snapshot_lock:
+            started = time.perf_counter()
+            entries = self.journal.stats()["entries"]
+            segment = self.journal.rotate()
+            counts = write_snapshot(self.directory, segment, self.snapshot_chunks())
+            self.journal.remove_before(segment)
+            self._snapshot_entries = entries
+            self._last_snapshot = {
+                "at": time.time(),
+                "seconds": round(time.perf_counter() - started, 3),
+                "bytes": os.path.getsize(os.path.join(self.directory, SNAPSHOT_FILE)),
+                "rows": counts
+            }
+            return self._last_snapshot
+
+    def _run_snapshots(self):
+        while not self._stop.wait(self.snapshot_interval):
+            if self.journal.stats()["entries"] - self._snapshot_entries < self.snapshot_min_entries:
+                continue
+            try:
+                self.snapshot()
+            except Exception as e:
+                if self.logger:
+                    self.logger.warning("Snapshot of %s failed: %s", self.directory, e)
+
+    def close(self):
+        """Stop taking snapshots and write out the journal"""
+        self._stop.set()
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        self.journal.close()
+        self._lock_file.close()
+
+    def journal_stats(self):
+        stats = self.journal.stats()
+        stats["since_snapshot"] = stats["entries"] - self._snapshot_entries
+        stats["recovery"] = self.recovery
+        stats["last_snapshot"] = self._last_snapshot
+        return stats
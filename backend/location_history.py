@@ -0,0 +1,125 @@
+"""Per-user position history with time-based downsampling.
+
+Each user's track is three parallel typed arrays (time in epoch
+microseconds, latitude, longitude), kept in time order. Points newer than
+`raw_seconds` are kept as they arrived, up to `max_raw_points`. Older points
+are folded into `bucket_seconds` buckets that keep only the last point of
+each bucket. Buckets older than `retention_seconds` are dropped. That bounds
+memory per user at roughly
+
+    (max_raw_points + retention_seconds / bucket_seconds) * 24 bytes
+
+while keeping full detail for the most recent part of the trail. Range
+queries binary-search the time array, so "the last hour" costs only the
+points it returns.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+_US = 1_000_000
+
+
+class Track:
+    """One user's trail: downsampled points first, then raw points"""
+
+    __slots__ = ("times", "lats", "lons", "coarse")
+
+    def __init__(self):
+        self.times = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        self.coarse = 0  # points [0, coarse) are downsampled, the rest raw
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, timestamp, lat, lon, bucket):
+        index = len(self.times)
+        if index and timestamp < self.times[-1]:
+            # Late arrival (e.g. an offline batch); keep the arrays sorted
+            index = bisect_right(self.times, timestamp)
+            if index < self.coarse:
+                # Among the downsampled points, where each bucket keeps only
+                # its last point: merge into the bucket rather than grow it
+                if self.times[index] // bucket == timestamp // bucket:
+                    return
+                if index and self.times[index - 1] // bucket == timestamp // bucket:
+                    self.times[index - 1], self.lats[index - 1], self.lons[index - 1] = timestamp, lat, lon
+                    return
+                self.coarse += 1
+        self.times.insert(index, timestamp)
+        self.lats.insert(index, lat)
+        self.lons.insert(index, lon)
+
+    def fold(self, cutoff, max_raw, bucket, oldest):
+        """Downsample raw points older than `cutoff` (or beyond `max_raw`)
+        and drop everything older than `oldest`"""
+        end = max(bisect_left(self.times, cutoff, self.coarse), len(self.times) - max_raw)
+        if end > self.coarse:
+            # Re-bucket the last kept coarse point too, so a bucket that was
+            # still open absorbs newer points that fall into it
+            start = max(self.coarse - 1, 0)
+            times, lats, lons = array("q"), array("d"), array("d")
+            for i in range(start, end):
+                timestamp = self.times[i]
+                if times and timestamp // bucket == times[-1] // bucket:
+                    times[-1], lats[-1], lons[-1] = timestamp, self.lats[i], self.lons[i]
+                else:
+                    times.append(timestamp)
+                    lats.append(self.lats[i])
+                    lons.append(self.lons[i])
+            self.times[start:end] = times
+            self.lats[start:end] = lats
+            self.lons[start:end] = lons
+            self.coarse = start + len(times)
+
+        expired = bisect_left(self.times, oldest, 0, self.coarse)
+        if expired:
+            del self.times[:expired]
+            del self.lats[:expired]
+            del self.lons[:expired]
+            self.coarse -= expired
+
+    def between(self, start, end):
+        first = bisect_left(self.times, start)
+        last = bisect_right(self.times, end)
+        return list(zip(self.times[first:last], self.lats[first:last], self.lons[first:last]))
+
+
+class LocationHistory:
+    """Tracks for every user, with bounded memory per user"""
+
+    def __init__(self, raw_seconds=3600, max_raw_points=720, bucket_seconds=300,
+                 retention_seconds=24 * 3600):
+        self.raw_us = int(raw_seconds * _US)
+        self.max_raw_points = max_raw_points
+        self.bucket_us = max(int(bucket_seconds * _US), 1)
+        self.retention_us = int(retention_seconds * _US)
+        self._lock = threading.Lock()
+        self._tracks = {}
+
+    def record(self, user_id, points, now):
+        """Add `(timestamp_us, lat, lon)` points to a user's track"""
+        with self._lock:
+            track = self._tracks.get(user_id)
+            if track is None:
+                track = self._tracks[user_id] = Track()
+            oldest = now - self.retention_us
+            for timestamp, lat, lon in points:
+                if timestamp >= oldest:
+                    track.add(timestamp, lat, lon, self.bucket_us)
+            track.fold(now - self.raw_us, self.max_raw_points, self.bucket_us, now - self.retention_us)
+
+    def query(self, user_id, start, end, now):
+        """`(timestamp_us, lat, lon)` points between `start` and `end`, oldest first"""
+        with self._lock:
+            track = self._tracks.get(user_id)
+            if track is None:
+                return []
+            # Reads also age the track, so idle users do not keep raw detail
+            track.fold(now - self.raw_us, self.max_raw_points, self.bucket_us, now - self.retention_us)
+            if not len(track):
+                del self._tracks[user_id]
+                return []
+            return track.between(start, end)
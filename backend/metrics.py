@@ -0,0 +1,173 @@
+"""Request instrumentation and Prometheus text exposition.
+
+Recording is meant to be cheap enough for every request: a `Histogram`
+observation is one bisect over fixed, log-spaced bucket bounds and one
+increment under a lock, with no per-observation allocation. Buckets double
+in width, so the relative error of a percentile read from them stays the
+same from sub-millisecond handlers up to timed-out upstream calls.
+
+Everything else the service already counts (`weather_cache.stats()`,
+`upstream.stats()`, ...) is only read when `/metrics` is scraped, by
+`Exposition.stats`, so the hot paths those counters live on are unchanged.
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+
+
+def log_buckets(low=0.000125, high=60.0, per_doubling=1):
+    """Upper bounds from `low` up to at least `high`, `per_doubling` per factor of two"""
+    factor = 2.0 ** (1.0 / per_doubling)
+    count = math.ceil(math.log(high / low, factor)) + 1
+    return tuple(float(f"{low * factor ** i:.6g}") for i in range(count))
+
+
+LATENCY_BUCKETS = log_buckets()
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their count and sum"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """`(cumulative counts per bound and +Inf, sum)`"""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+
+class RequestMetrics:
+    """Responses by status, latency and requests in flight, per endpoint.
+
+    Endpoints are Flask endpoint names rather than paths, so ids in URLs do
+    not create a new series per user.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self._lock = threading.Lock()
+        self._latency = {}  # endpoint -> Histogram
+        self._responses = {}  # (endpoint, method, status) -> count
+        self._in_flight = {}  # endpoint -> count
+
+    def start(self, endpoint):
+        """Count a request as in flight; returns its start time for `finish`"""
+        with self._lock:
+            self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + 1
+        return time.perf_counter()
+
+    def finish(self, endpoint, method, status, started):
+        elapsed = time.perf_counter() - started
+        key = (endpoint, method, status)
+        with self._lock:
+            self._in_flight[endpoint] -= 1
+            self._responses[key] = self._responses.get(key, 0) + 1
+            histogram = self._latency.get(endpoint)
+            if histogram is None:
+                histogram = self._latency[endpoint] = Histogram(self.bounds)
+        histogram.observe(elapsed)
+
+    def collect(self, exposition):
+        with self._lock:
+            responses = list(self._responses.items())
+            in_flight = list(self._in_flight.items())
+            latency = list(self._latency.items())
+        exposition.add("http_requests_total", "counter", "HTTP responses by endpoint, method and status", [
+            ({"endpoint": endpoint, "method": method, "status": status}, count)
+            for (endpoint, method, status), count in responses
+        ])
+        exposition.add("http_requests_in_flight", "gauge", "HTTP requests being handled", [
+            ({"endpoint": endpoint}, count) for endpoint, count in in_flight
+        ])
+        exposition.histogram("http_request_duration_seconds", "Time to produce a response", [
+            ({"endpoint": endpoint}, histogram) for endpoint, histogram in latency
+        ])
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class Exposition:
+    """Collects metric families and renders them in the Prometheus text format"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, prefix="safesphere_"):
+        self.prefix = prefix
+        self._families = {}  # name -> (kind, help, [(labels, value)])
+
+    def add(self, name, kind, help_text, samples):
+        """Samples for a counter or gauge: a number, or `(labels, number)` pairs"""
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        family = self._families.setdefault(self.prefix + name, (kind, help_text, []))
+        family[2].extend(samples)
+
+    def stats(self, name, title, stats, gauges=(), labels=None):
+        """Numbers from a component's `stats()` dict, as `<name>_<key>`.
+
+        Keys in `gauges` are current levels; every other number is a running
+        count and becomes a `_total` counter. Strings, booleans and nested
+        dicts are left out.
+        """
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key in gauges:
+                self.add(f"{name}_{key}", "gauge", f"{title} {key.replace('_', ' ')}",
+                         [(labels or {}, value)])
+            else:
+                self.add(f"{name}_{key}_total", "counter", f"{title} {key.replace('_', ' ')}",
+                         [(labels or {}, value)])
+
+    def histogram(self, name, help_text, histograms):
+        """`(labels, Histogram)` pairs as one histogram family"""
+        samples = []
+        for labels, histogram in histograms:
+            cumulative, total = histogram.snapshot()
+            for bound, count in zip(histogram.bounds + (math.inf,), cumulative):
+                samples.append(("_bucket", {**labels, "le": _number(bound)}, count))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative[-1]))
+        self._families[self.prefix + name] = ("histogram", help_text, samples)
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, samples) in self._families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample in samples:
+                suffix, labels, value = sample if len(sample) == 3 else ("", *sample)
+                lines.append(f"{name}{suffix}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,281 @@
+"""Asynchronous fan-out of status changes and alerts to friends.
+
+Request handlers only enqueue a notification. Worker threads resolve the
+recipient set once per notification, then hand each delivery channel one
+batch. Channels are things like the live event stream, logging, and
+eventually push, email or SMS. The queue is bounded and has one lane per
+urgency, so `danger` is delivered ahead of `alert`, and `alert` ahead of
+`safe`. While a user's notification is still queued, a newer status change
+merges into it. Friends then see the latest status once instead of every
+flip in between. Alerts are never merged away.
+"""
+import threading
+import time
+from collections import deque
+
+# Lane per status, most urgent first; anything unknown goes with "alert"
+PRIORITIES = {"danger": 0, "alert": 1, "safe": 2}
+_LANES = 3
+
+
+class Notification:
+    """One user's pending status change, plus any alerts raised with it"""
+
+    def __init__(self, user_id, status, payload, alerts, lane, enqueued_at):
+        self.user_id = user_id
+        self.status = status
+        self.payload = payload
+        self.alerts = alerts
+        self.lane = lane
+        self.enqueued_at = enqueued_at
+
+
+class EventBusChannel:
+    """Delivers notifications as `status` and `alert` events on the event bus"""
+
+    name = "events"
+
+    def __init__(self, event_bus):
+        self.event_bus = event_bus
+
+    def send(self, messages):
+        for message in messages:
+            self.event_bus.publish("status", message["payload"], message["recipients"])
+            for alert in message["alerts"]:
+                self.event_bus.publish("alert", alert, message["recipients"])
+
+
+class LogChannel:
+    """Writes one log line per notification"""
+
+    name = "log"
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def send(self, messages):
+        for message in messages:
+            self.logger.info("User %s status changed to %s - notifying %d friends",
+                             message["user_id"], message["status"], len(message["recipients"]) - 1)
+
+
+class FakeSink:
+    """Collects deliveries in memory, for local testing and benchmarks.
+
+    `fail_first` makes that many `send` calls raise, to exercise retries.
+    """
+
+    def __init__(self, name="fake", fail_first=0):
+        self.name = name
+        self.fail_first = fail_first
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                raise RuntimeError("fake delivery failure")
+            self.batches.append(list(messages))
+
+    @property
+    def messages(self):
+        with self._lock:
+            return [message for batch in self.batches for message in batch]
+
+
+class NotificationPipeline:
+    """Bounded, prioritised queue drained by a pool of delivery workers.
+
+    `resolve_recipients(user_id)` returns the ids that should hear about a
+    user's change. Each channel has a `name` and a `send(messages)` method
+    that takes a batch of dicts with `user_id`, `status`, `payload`, `alerts`
+    and `recipients`. A failed batch is retried with exponential backoff.
+    """
+
+    def __init__(self, resolve_recipients, channels, workers=2, max_queue=10000,
+                 batch_size=100, max_retries=3, retry_backoff=0.5, logger=None):
+        self.resolve_recipients = resolve_recipients
+        self.channels = list(channels)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.logger = logger
+        self._ready = threading.Condition()
+        self._lanes = [deque() for _ in range(_LANES)]
+        self._queued = {}  # user_id -> Notification still waiting in a lane
+        self._busy = 0
+        self._in_flight = set()  # users with a batch being delivered
+        self._threads = []
+        self._latencies = deque(maxlen=1000)
+        self._stats = {
+            "enqueued": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "delivered": 0,
+            "retries": 0,
+            "failed_batches": 0
+        }
+
+    def submit(self, user_id, status, payload, alert=None):
+        """Queue a status change (and optional alert) for delivery.
+
+        Returns False if the queue is full and nothing less urgent could be
+        displaced to make room.
+        """
+        lane = PRIORITIES.get(status, PRIORITIES["alert"])
+        self._ensure_workers()
+        with self._ready:
+            self._stats["enqueued"] += 1
+            pending = self._queued.get(user_id)
+            if pending is not None:
+                # Merge into the waiting notification: newest status wins,
+                # alerts accumulate, and urgency only ever goes up
+                self._stats["coalesced"] += 1
+                pending.status = status
+                pending.payload = payload
+                if alert is not None:
+                    pending.alerts.append(alert)
+                if lane < pending.lane:
+                    self._lanes[pending.lane].remove(pending)
+                    pending.lane = lane
+                    self._lanes[lane].append(pending)
+                self._ready.notify()
+                return True
+            if len(self._queued) >= self.max_queue and not self._displace(lane):
+                self._stats["dropped"] += 1
+                return False
+            notification = Notification(user_id, status, payload,
+                                        [alert] if alert is not None else [],
+                                        lane, time.monotonic())
+            self._lanes[lane].append(notification)
+            self._queued[user_id] = notification
+            self._ready.notify()
+            return True
+
+    def _displace(self, lane):
+        # Drop the newest entry of the least urgent lane below `lane`
+        for victim_lane in range(_LANES - 1, lane, -1):
+            if self._lanes[victim_lane]:
+                victim = self._lanes[victim_lane].pop()
+                del self._queued[victim.user_id]
+                self._stats["dropped"] += 1
+                return True
+        return False
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        with self._ready:
+            if not self._threads:
+                for _ in range(self.workers):
+                    thread = threading.Thread(target=self._run, daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def _take_batch(self):
+        with self._ready:
+            while True:
+                batch = []
+                for lane in self._lanes:
+                    # A user whose previous notification is still being
+                    # delivered waits, so friends never see updates reordered
+                    held = []
+                    while lane and len(batch) < self.batch_size:
+                        notification = lane.popleft()
+                        if notification.user_id in self._in_flight:
+                            held.append(notification)
+                            continue
+                        del self._queued[notification.user_id]
+                        batch.append(notification)
+                    lane.extendleft(reversed(held))
+                if batch:
+                    self._busy += 1
+                    self._in_flight.update(notification.user_id for notification in batch)
+                    return batch
+                self._ready.wait()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._deliver(batch)
+            finally:
+                with self._ready:
+                    self._busy -= 1
+                    self._in_flight.difference_update(notification.user_id for notification in batch)
+                    self._ready.notify_all()
+
+    def _deliver(self, batch):
+        messages = []
+        for notification in batch:
+            try:
+                recipients = [notification.user_id] + [
+                    friend_id for friend_id in self.resolve_recipients(notification.user_id)
+                    if friend_id != notification.user_id
+                ]
+            except Exception:
+                if self.logger:
+                    self.logger.exception("Could not resolve recipients for user %s", notification.user_id)
+                continue
+            messages.append({
+                "user_id": notification.user_id,
+                "status": notification.status,
+                "payload": notification.payload,
+                "alerts": notification.alerts,
+                "recipients": recipients
+            })
+        for channel in self.channels:
+            self._send(channel, messages)
+        now = time.monotonic()
+        with self._ready:
+            self._stats["delivered"] += len(messages)
+            self._latencies.extend(now - notification.enqueued_at for notification in batch)
+
+    def _send(self, channel, messages):
+        for attempt in range(self.max_retries + 1):
+            try:
+                channel.send(messages)
+                return
+            except Exception:
+                if attempt == self.max_retries:
+                    break
+                with self._ready:
+                    self._stats["retries"] += 1
+                time.sleep(self.retry_backoff * (2 ** attempt))
+        with self._ready:
+            self._stats["failed_batches"] += 1
+        if self.logger:
+            self.logger.error("Giving up on %d notifications for channel %s", len(messages), channel.name)
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been delivered"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._ready:
+            while self._queued or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._ready.wait(remaining)
+            return True
+
+    def stats(self):
+        with self._ready:
+            latencies = sorted(self._latencies)
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._queued)
+            stats["queue_depth_by_status"] = {
+                status: len(self._lanes[lane]) for status, lane in PRIORITIES.items()
+            }
+            stats["in_flight_batches"] = self._busy
+        if latencies:
+            stats["latency_ms"] = {
+                "p50": round(latencies[len(latencies) // 2] * 1000, 3),
+                "p95": round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+                "max": round(latencies[-1] * 1000, 3)
+            }
+        else:
+            stats["latency_ms"] = None
+        return stats
@@ -0,0 +1,142 @@
+"""Salted scrypt password hashes, computed in a pool of worker processes.
+
+A hash is stored as `scrypt$<n>$<r>$<p>$<salt>$<key>` (base64 salt and key).
+Each one costs tens of milliseconds of CPU and about `128 * n * r` bytes of
+memory, which is the point, so `PasswordHasher` runs that work in separate
+processes: web threads wait for the result without holding the interpreter,
+and at most `workers` hashes run at once. When `max_pending` requests are
+already waiting, new ones are refused with `HasherBusy` rather than queued
+behind them.
+
+Hashes from before this module (unsalted hex SHA-256) still verify, and a
+successful check returns a replacement hash, as it does for scrypt hashes
+made with weaker parameters than the current ones.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+SCRYPT_MAXMEM = 256 * 1024 * 1024
+
+
+class HasherBusy(Exception):
+    """Too many password checks are already waiting for a worker"""
+
+
+def hash_password(password, n=2 ** 14, r=8, p=1):
+    salt = os.urandom(16)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=SCRYPT_MAXMEM)
+    return "$".join(["scrypt", str(n), str(r), str(p),
+                     base64.b64encode(salt).decode(), base64.b64encode(key).decode()])
+
+
+def check_password(password, stored, n=2 ** 14, r=8, p=1):
+    """`(matches, new_hash)`; `new_hash` is set when `stored` should be replaced"""
+    if not stored:
+        return False, None
+    if stored.startswith("scrypt$"):
+        _, old_n, old_r, old_p, salt, key = stored.split("$")
+        old_n, old_r, old_p = int(old_n), int(old_r), int(old_p)
+        key = base64.b64decode(key)
+        candidate = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt),
+                                   n=old_n, r=old_r, p=old_p, dklen=len(key), maxmem=SCRYPT_MAXMEM)
+        if not hmac.compare_digest(candidate, key):
+            return False, None
+        if old_n >= n and old_r >= r and old_p >= p:
+            return True, None
+        return True, hash_password(password, n, r, p)
+    # Legacy unsalted SHA-256 hex digest
+    legacy = hashlib.sha256(password.encode()).hexdigest()
+    if not hmac.compare_digest(legacy, stored):
+        return False, None
+    return True, hash_password(password, n, r, p)
+
+
+def _exit_with_parent(parent_pid):
+    """Pool worker initializer: exit once the process that started the pool
+    is gone. Workers are forked from the web server, so an orphaned one
+    would otherwise live on holding the server's listening socket."""
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+class PasswordHasher:
+    """Hashes and checks passwords in `workers` processes (inline when 0)"""
+
+    def __init__(self, workers=2, max_pending=64, timeout=10.0, n=2 ** 14, r=8, p=1):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.params = {"n": n, "r": r, "p": p}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._pending = 0
+        self._stats = {"hashed": 0, "checked": 0, "rehashed": 0, "shed": 0}
+        # Checked for unknown emails, so those take as long as wrong passwords
+        self._dummy_hash = hash_password("", **self.params)
+
+    def hash(self, password):
+        """A new hash for a password; raises `HasherBusy` when overloaded"""
+        stored = self._run(hash_password, password, **self.params)
+        self._count("hashed")
+        return stored
+
+    def check(self, password, stored):
+        """`(matches, new_hash)` as `check_password`; raises `HasherBusy`"""
+        matches, new_hash = self._run(check_password, password, stored or self._dummy_hash, **self.params)
+        self._count("checked")
+        if new_hash:
+            self._count("rehashed")
+        return matches and stored is not None, new_hash
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "pending": self._pending, "workers": self.workers}
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _run(self, function, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["shed"] += 1
+                raise HasherBusy()
+            self._pending += 1
+        try:
+            if not self.workers:
+                return function(*args, **kwargs)
+            future = self._executor().submit(function, *args, **kwargs)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                raise HasherBusy() from None
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _executor(self):
+        # Started on first use, so a pre-forking server (e.g. Gunicorn with
+        # --preload) gives each worker process its own pool
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_exit_with_parent,
+                                                 initargs=(os.getpid(),))
+                self._pool_pid = os.getpid()
+            return self._pool
@@ -0,0 +1,109 @@
+"""Wall-clock sampling profiler that can be switched on in a running server.
+
+While running, a background thread wakes every `interval` seconds and reads
+every other thread's current stack with `sys._current_frames()`. Nothing is
+hooked into the code being profiled, so requests pay nothing while the
+profiler is off and only the sampler's own GIL time while it is on.
+
+Samples are aggregated per distinct stack and read back in the "collapsed"
+format (`thread;outer;...;inner count` per line) that flamegraph.pl and
+speedscope take as input. Waiting threads are sampled too, so time blocked
+on locks, sockets and SQLite shows up alongside CPU time.
+"""
+import os
+import sys
+import threading
+import time
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples all thread stacks for up to `duration` seconds at a time"""
+
+    def __init__(self, interval=0.005, max_stacks=20000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stacks = {}  # (thread name, code, ...) outermost first -> samples
+        self._samples = 0
+        self._dropped = 0
+        self._started_at = None
+        self._stopped_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=30.0, interval=None):
+        """Clear old samples and start sampling; False if already running"""
+        with self._lock:
+            if self.running:
+                return False
+            if interval:
+                self.interval = interval
+            self._stacks, self._samples, self._dropped = {}, 0, 0
+            self._started_at, self._stopped_at = time.time(), None
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop, duration),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self, stop, duration):
+        own = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while not stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(frame.f_code)
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    key = tuple(reversed(stack))
+                    if key in self._stacks:
+                        self._stacks[key] += 1
+                    elif len(self._stacks) < self.max_stacks:
+                        self._stacks[key] = 1
+                    else:
+                        self._dropped += 1
+                self._samples += 1
+            del frames
+        with self._lock:
+            self._stopped_at = time.time()
+
+    def collapsed(self):
+        """Stacks in the collapsed format, most sampled first"""
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key=lambda item: item[1], reverse=True)
+        return "".join(
+            ";".join([key[0]] + [frame_label(code) for code in key[1:]]) + f" {count}\n"
+            for key, count in stacks
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self.running,
+                "interval": self.interval,
+                "samples": self._samples,
+                "stacks": len(self._stacks),
+                "dropped": self._dropped,
+                "started_at": self._started_at,
+                "stopped_at": self._stopped_at
+            }
@@ -0,0 +1,181 @@
+"""Token-bucket rate limiting keyed by client, user and route.
+
+Each key (e.g. `("login", "ip", "203.0.113.7")`) owns a bucket holding up to
+`burst` tokens that refills at `rate` tokens per second; a request spends one
+token or is refused with the number of seconds until one is available. A
+bucket is a few numbers, and a bucket that has refilled completely is the same
+as no bucket at all, so idle keys are dropped as they fill up and memory
+tracks the number of recently active keys.
+
+`MemoryRateLimiter` counts for one process. `SQLiteRateLimiter` keeps the
+buckets in a SQLite file, so every worker process shares the same limits.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def create_rate_limiter(database_url=None, **options):
+    """Build the rate limiter named by a URL, like `store.create_store`"""
+    if database_url and database_url.startswith("sqlite:///"):
+        return SQLiteRateLimiter(database_url[len("sqlite:///"):], **options)
+    return MemoryRateLimiter(**options)
+
+
+def parse_rate(text):
+    """`(rate per second, burst)` from "10/minute", "10/60" or "10/minute burst 20"
+
+    The burst defaults to the count, so "10/minute" allows ten requests at
+    once and then one every six seconds.
+    """
+    limit, _, burst = text.strip().partition(" burst ")
+    count, _, period = limit.partition("/")
+    period = period.strip()
+    seconds = PERIODS[period] if period in PERIODS else float(period)
+    count = float(count)
+    if count <= 0 or seconds <= 0:
+        raise ValueError(f"invalid rate {text!r}")
+    return count / seconds, float(burst) if burst else count
+
+
+def refill(tokens, updated, now, rate, burst):
+    """Tokens in a bucket at `now`, given its level at `updated`"""
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryRateLimiter:
+    """Buckets for one process, least recently used first.
+
+    Buckets that have filled up again are dropped from the old end on every
+    hit. If `max_keys` is reached anyway (say, a flood from many addresses)
+    the least recently used bucket is dropped early, which only ever makes
+    the limit more lenient for that key.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> [tokens, updated, full_at]
+        self._stats = {"allowed": 0, "rejected": 0}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def hit(self, key, rate, burst, cost=1):
+        """Spend `cost` tokens for a key; `(allowed, retry_after_seconds)`"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = burst
+                bucket = self._buckets[key] = [burst, now, now]
+            else:
+                tokens = refill(bucket[0], bucket[1], now, rate, burst)
+                self._buckets.move_to_end(key)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+                self._stats["allowed"] += 1
+            else:
+                self._stats["rejected"] += 1
+            bucket[0], bucket[1] = tokens, now
+            bucket[2] = now + (burst - tokens) / rate
+            self._evict(now)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if oldest[2] > now and len(buckets) <= self.max_keys:
+                break
+            buckets.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "keys": len(self._buckets)}
+
+
+class SQLiteRateLimiter:
+    """Buckets in a SQLite file shared by every worker process.
+
+    Uses wall-clock time so all processes agree on it. Full buckets are
+    swept through an index on the time they fill up, at most once per
+    `sweep_interval` seconds per process.
+    """
+
+    def __init__(self, path, sweep_interval=10.0, busy_timeout_ms=5000):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._stats = {"allowed": 0, "rejected": 0}
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                full_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS rate_limits_full ON rate_limits (full_at);
+        """)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM rate_limits WHERE full_at > ?", (time.time(),)
+        ).fetchone()[0]
+
+    def hit(self, key, rate, burst, cost=1):
+        now = time.time()
+        key = "\x1f".join(map(str, key)) if isinstance(key, tuple) else str(key)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            tokens = burst if row is None else refill(row[0], row[1], now, rate, burst)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                "INSERT INTO rate_limits (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "tokens = excluded.tokens, updated = excluded.updated, full_at = excluded.full_at",
+                (key, tokens, now, now + (burst - tokens) / rate)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._stats["allowed" if allowed else "rejected"] += 1
+        self._sweep(now)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def _sweep(self, now):
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        self._connection().execute(
+            "DELETE FROM rate_limits WHERE key IN ("
+            "SELECT key FROM rate_limits WHERE full_at <= ? ORDER BY full_at LIMIT 1000)",
+            (now,)
+        )
+
+    def stats(self):
+        return {**self._stats, "keys": len(self)}
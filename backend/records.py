@@ -0,0 +1,138 @@
+"""Compact record types for users, locations and alerts.
+
+Records use `__slots__` instead of a per-instance dict. Timestamps are held
+as integer microseconds since the Unix epoch rather than ISO strings. The
+JSON-facing view (ISO timestamps, private fields left out) is built once and
+cached until the record changes, so responses serialize it directly instead
+of copying the record on every request.
+
+Records also answer `record["field"]` and `record.get("field")`, so code
+that only reads fields works the same on records and plain dicts.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from operator import attrgetter
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def now_us():
+    """Current UTC time as integer microseconds since the epoch"""
+    return time.time_ns() // 1000
+
+
+def to_epoch_us(value):
+    """Epoch microseconds from an int, an ISO string (naive means UTC), or None"""
+    if value is None or isinstance(value, int):
+        return value
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def to_iso(value):
+    """ISO string for epoch microseconds, matching `datetime.utcnow().isoformat()`"""
+    if value is None:
+        return None
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+class Record:
+    """Base for slotted records; subclasses list their fields"""
+
+    __slots__ = ("id", "_view")
+    FIELDS = ()
+    TIMESTAMPS = ()
+    PRIVATE = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._public_fields = tuple(
+            (name, name in cls.TIMESTAMPS) for name in cls.FIELDS if name not in cls.PRIVATE
+        )
+        cls._row_names = ("id",) + tuple(cls.FIELDS)
+        cls._row_getter = attrgetter(*cls._row_names)
+
+    def __init__(self, id, **fields):
+        self.id = id
+        self._view = None
+        timestamps = self.TIMESTAMPS
+        for name in self.FIELDS:
+            value = fields.get(name)
+            setattr(self, name, to_epoch_us(value) if name in timestamps else value)
+
+    def row(self):
+        """The id and stored field values as one tuple, for snapshots"""
+        return self._row_getter(self)
+
+    @classmethod
+    def from_row(cls, row):
+        """Rebuild a record from its `row()`: the id, then stored field values"""
+        record = cls.__new__(cls)
+        record._view = None
+        for name, value in zip(cls._row_names, row):
+            setattr(record, name, value)
+        return record
+
+    def __getitem__(self, name):
+        if name != "id" and name not in self.FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        if name != "id" and name not in self.FIELDS:
+            return default
+        return getattr(self, name)
+
+    def update(self, changes):
+        for name, value in changes.items():
+            if name not in self.FIELDS:
+                raise KeyError(name)
+            setattr(self, name, to_epoch_us(value) if name in self.TIMESTAMPS else value)
+        self._view = None
+
+    def fields(self):
+        """Stored field values (timestamps as epoch microseconds), without the id"""
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def public(self):
+        """The JSON-facing view. Cached, so treat it as read-only"""
+        view = self._view
+        if view is None:
+            view = {"id": self.id}
+            for name, timestamp in self._public_fields:
+                value = getattr(self, name)
+                view[name] = to_iso(value) if timestamp else value
+            self._view = view
+        return view
+
+    def to_dict(self):
+        """Every field including private ones, in the JSON-facing format"""
+        view = dict(self.public())
+        for name in self.PRIVATE:
+            value = getattr(self, name)
+            if value is not None:
+                view[name] = value
+        return view
+
+
+class User(Record):
+    __slots__ = ("name", "email", "phone", "password_hash", "is_safe", "status",
+                 "last_safe_update", "created_at", "latitude", "longitude")
+    FIELDS = __slots__
+    TIMESTAMPS = ("last_safe_update", "created_at")
+    PRIVATE = ("password_hash",)
+
+
+class Location(Record):
+    __slots__ = ("user_id", "name", "latitude", "longitude", "type", "created_at")
+    FIELDS = __slots__
+    TIMESTAMPS = ("created_at",)
+
+
+class Alert(Record):
+    __slots__ = ("user_id", "type", "message", "created_at")
+    FIELDS = __slots__
+    TIMESTAMPS = ("created_at",)
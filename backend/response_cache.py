@@ -0,0 +1,76 @@
+"""Serialized-response cache with ETag revalidation for list endpoints.
+
+The store keeps a version number per user (and one for the whole user list)
+that changes whenever data shown to that user changes. A response is
+identified by its path, query string, scope and that version, so:
+
+- a client that sends the ETag it already has gets a 304 without the body
+  being built, and
+- a client without it gets bytes serialized once and shared until the
+  version moves on.
+
+orjson is used for serialization when it is installed.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+
+def dumps(payload):
+    """Serialize to JSON bytes with sorted keys, like `jsonify`"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib handles those
+    return (json.dumps(payload, sort_keys=True, separators=(",", ":")) + "\n").encode()
+
+
+class ResponseCache:
+    """LRU of serialized bodies keyed by (path, query, scope, version)"""
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> body bytes
+        self._stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+    @staticmethod
+    def etag_for(key):
+        return hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+
+    def get(self, key, if_none_match, build):
+        """`(etag, body)` for a key; body is None when `if_none_match` matches.
+
+        `if_none_match(etag)` says whether the client already has that etag.
+        `build()` returns the payload and is only called on a miss.
+        """
+        etag = self.etag_for(key)
+        if if_none_match(etag):
+            with self._lock:
+                self._stats["not_modified"] += 1
+            return etag, None
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return etag, body
+            self._stats["misses"] += 1
+        body = dumps(build())
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag, body
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries)}
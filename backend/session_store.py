@@ -0,0 +1,202 @@
+"""Session tokens with sliding expiry.
+
+A session maps a random token to a user id. Every successful lookup pushes
+the expiry `ttl` seconds into the future. Each user holds at most
+`max_per_user` sessions, and logging in beyond that drops the oldest one.
+Expired sessions are removed in expiry order as time passes, never by
+scanning every session, so memory tracks the number of live sessions.
+
+`MemorySessionStore` serves a single process. `SQLiteSessionStore` keeps
+sessions in a SQLite file, so several worker processes can share them.
+"""
+import heapq
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def create_session_store(database_url=None, **options):
+    """Build the session store named by a URL, like `store.create_store`"""
+    if database_url and database_url.startswith("sqlite:///"):
+        return SQLiteSessionStore(database_url[len("sqlite:///"):], **options)
+    return MemorySessionStore(**options)
+
+
+def new_token():
+    return secrets.token_urlsafe(32)
+
+
+class MemorySessionStore:
+    """Sessions for one process, expired through a min-heap of deadlines"""
+
+    def __init__(self, ttl=7 * 24 * 3600, max_per_user=10):
+        self.ttl = ttl
+        self.max_per_user = max_per_user
+        self._lock = threading.Lock()
+        self._sessions = {}  # token -> [user_id, expires_at]
+        self._by_user = {}  # user_id -> OrderedDict of tokens, oldest first
+        # (expires_at, token) as first scheduled. Sliding a session does not
+        # push a new entry; an entry that pops early is re-pushed at the
+        # session's current deadline instead.
+        self._deadlines = []
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, user_id):
+        """Start a session for a user and return its token"""
+        token = new_token()
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            expires_at = now + self.ttl
+            self._sessions[token] = [user_id, expires_at]
+            tokens = self._by_user.setdefault(user_id, OrderedDict())
+            tokens[token] = None
+            while len(tokens) > self.max_per_user:
+                oldest, _ = tokens.popitem(last=False)
+                del self._sessions[oldest]
+            heapq.heappush(self._deadlines, (expires_at, token))
+            self._compact()
+        return token
+
+    def get(self, token):
+        """The user id for a live session (extending it), or None"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            session[1] = now + self.ttl
+            return session[0]
+
+    def revoke(self, token):
+        with self._lock:
+            session = self._sessions.pop(token, None)
+            if session is not None:
+                self._forget(session[0], token)
+
+    def _forget(self, user_id, token):
+        tokens = self._by_user.get(user_id)
+        if tokens is not None:
+            tokens.pop(token, None)
+            if not tokens:
+                del self._by_user[user_id]
+
+    def _expire(self, now):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, token = heapq.heappop(self._deadlines)
+            session = self._sessions.get(token)
+            if session is None:
+                continue  # already revoked or evicted
+            if session[1] > now:
+                heapq.heappush(self._deadlines, (session[1], token))
+            else:
+                del self._sessions[token]
+                self._forget(session[0], token)
+
+    def _compact(self):
+        # Revoked and evicted sessions leave their heap entries behind; drop
+        # them once they outnumber the live sessions
+        if len(self._deadlines) > 2 * len(self._sessions) + 64:
+            self._deadlines = [(session[1], token) for token, session in self._sessions.items()]
+            heapq.heapify(self._deadlines)
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file shared by every worker process.
+
+    Expiry uses wall-clock time so all processes agree on it. A lookup only
+    writes the new deadline once at least `touch_interval` seconds of it have
+    elapsed, so reads do not turn every request into a write.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_per_user=10, touch_interval=None,
+                 busy_timeout_ms=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_per_user = max_per_user
+        self.touch_interval = ttl / 100 if touch_interval is None else touch_interval
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                token TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user_id, created_at);
+            CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at);
+        """)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+
+    def create(self, user_id):
+        token = new_token()
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO sessions (token, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (token, user_id, now, now + self.ttl)
+            )
+            conn.execute(
+                "DELETE FROM sessions WHERE token IN ("
+                "SELECT token FROM sessions WHERE user_id = ? "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (user_id, self.max_per_user)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._sweep(now)
+        return token
+
+    def get(self, token):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT user_id, expires_at FROM sessions WHERE token = ?", (token,)
+        ).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        if now + self.ttl - row[1] >= self.touch_interval:
+            conn.execute("UPDATE sessions SET expires_at = ? WHERE token = ?", (now + self.ttl, token))
+        return row[0]
+
+    def revoke(self, token):
+        self._connection().execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def _sweep(self, now):
+        # Expired rows are found through the expiry index, oldest first
+        if now - self._last_sweep < self.touch_interval:
+            return
+        self._last_sweep = now
+        self._connection().execute(
+            "DELETE FROM sessions WHERE token IN ("
+            "SELECT token FROM sessions WHERE expires_at <= ? ORDER BY expires_at LIMIT 1000)",
+            (now,)
+        )
@@ -0,0 +1,114 @@
+"""Grid-bucketed spatial index for "what is within r km of here" queries.
+
+Points are bucketed into fixed-size lat/lon cells. A query only looks at the
+cells overlapping its bounding box, then computes exact great-circle
+distances for those candidates in one vectorised pass. Inserts, moves and
+removals touch a single cell, so the index can be kept current as users
+update their position.
+"""
+import math
+import threading
+
+import numpy as np
+
+from geo import haversine_km_many, radius_bbox
+
+
+class GridIndex:
+    """Maps keys (user or location ids) to positions, bucketed by grid cell"""
+
+    def __init__(self, cell_degrees=0.5):
+        self.cell_degrees = cell_degrees
+        self._lock = threading.Lock()
+        self._cells = {}  # (row, col) -> {key: (lat, lon)}
+        self._cell_of = {}  # key -> (row, col)
+
+    def __len__(self):
+        return len(self._cell_of)
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees))
+
+    def upsert(self, key, lat, lon):
+        """Add a point or move it to a new position"""
+        cell = self._cell(lat, lon)
+        with self._lock:
+            old_cell = self._cell_of.get(key)
+            if old_cell is not None and old_cell != cell:
+                self._drop(key, old_cell)
+            self._cells.setdefault(cell, {})[key] = (lat, lon)
+            self._cell_of[key] = cell
+
+    def upsert_many(self, points):
+        """`upsert` every `(key, lat, lon)` under one lock"""
+        with self._lock:
+            for key, lat, lon in points:
+                cell = self._cell(lat, lon)
+                old_cell = self._cell_of.get(key)
+                if old_cell is not None and old_cell != cell:
+                    self._drop(key, old_cell)
+                self._cells.setdefault(cell, {})[key] = (lat, lon)
+                self._cell_of[key] = cell
+
+    def remove(self, key):
+        with self._lock:
+            cell = self._cell_of.pop(key, None)
+            if cell is not None:
+                self._drop(key, cell)
+
+    def _drop(self, key, cell):
+        bucket = self._cells[cell]
+        del bucket[key]
+        if not bucket:
+            del self._cells[cell]
+
+    def within_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """`(key, lat, lon)` for every point inside the box.
+
+        Longitudes outside [-180, 180] wrap around the antimeridian, which is
+        what `geo.radius_bbox` produces for circles that cross it.
+        """
+        if max_lon - min_lon >= 360.0:
+            lon_ranges = [(-180.0, 180.0)]
+        elif min_lon < -180.0:
+            lon_ranges = [(min_lon + 360.0, 180.0), (-180.0, max_lon)]
+        elif max_lon > 180.0:
+            lon_ranges = [(min_lon, 180.0), (-180.0, max_lon - 360.0)]
+        else:
+            lon_ranges = [(min_lon, max_lon)]
+
+        found = []
+        with self._lock:
+            for low_lon, high_lon in lon_ranges:
+                for bucket in self._buckets(min_lat, low_lon, max_lat, high_lon):
+                    for key, (lat, lon) in bucket.items():
+                        if min_lat <= lat <= max_lat and low_lon <= lon <= high_lon:
+                            found.append((key, lat, lon))
+        return found
+
+    def _buckets(self, min_lat, min_lon, max_lat, max_lon):
+        first_row, first_col = self._cell(min_lat, min_lon)
+        last_row, last_col = self._cell(max_lat, max_lon)
+        cell_count = (last_row - first_row + 1) * (last_col - first_col + 1)
+        if cell_count > len(self._cells):
+            # Large boxes: walking the occupied cells is cheaper than the grid
+            return [bucket for (row, col), bucket in self._cells.items()
+                    if first_row <= row <= last_row and first_col <= col <= last_col]
+        buckets = []
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                bucket = self._cells.get((row, col))
+                if bucket:
+                    buckets.append(bucket)
+        return buckets
+
+    def within_radius(self, lat, lon, radius_km):
+        """`(key, distance_km)` for points within `radius_km`, nearest first"""
+        candidates = self.within_bbox(*radius_bbox(lat, lon, radius_km))
+        if not candidates:
+            return []
+        keys, lats, lons = zip(*candidates)
+        distances = haversine_km_many(lat, lon, np.array(lats), np.array(lons))
+        inside = np.flatnonzero(distances <= radius_km)
+        inside = inside[np.argsort(distances[inside], kind="stable")]
+        return [(keys[i], float(distances[i])) for i in inside]
@@ -0,0 +1,727 @@
+"""SQLite storage backend.
+
+Same interface as `store.MemoryStore`, but the data lives in a SQLite file in
+WAL mode, so it survives restarts and can be shared by several worker
+processes. Each table keeps the columns we filter on (indexed) next to a JSON
+copy of the record, so records come back exactly as they were written.
+
+Every thread gets its own connection, and statements use fixed SQL with
+bound parameters, so sqlite3's statement cache reuses the prepared form.
+Alert and location inserts go through a group-commit writer that puts
+whatever is queued into one transaction.
+"""
+import json
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+
+import numpy as np
+
+from geo import haversine_km_many, parse_coordinates, radius_bbox
+from records import Alert, Location, Record, User, now_us
+from store import ALL_USERS, SEARCH_FIELDS, EmailTaken, email_key
+from user_search import PREFIX, SUBSTRING, match_kind, query_words, search_terms
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    email_key TEXT,
+    lat REAL,
+    lon REAL,
+    data TEXT NOT NULL
+);
+DROP INDEX IF EXISTS users_email;
+CREATE UNIQUE INDEX IF NOT EXISTS users_email_key ON users (email_key);
+CREATE INDEX IF NOT EXISTS users_position ON users (lat, lon);
+
+CREATE TABLE IF NOT EXISTS friend_requests (
+    id INTEGER PRIMARY KEY,
+    from_user_id INTEGER,
+    to_user_id INTEGER,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS friend_requests_recipient ON friend_requests (to_user_id, status);
+CREATE INDEX IF NOT EXISTS friend_requests_pair ON friend_requests (from_user_id, to_user_id, status);
+
+CREATE TABLE IF NOT EXISTS friends (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    friend_id INTEGER,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS friends_user ON friends (user_id, status);
+CREATE INDEX IF NOT EXISTS friends_friend ON friends (friend_id, status);
+
+CREATE TABLE IF NOT EXISTS locations (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    lat REAL,
+    lon REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS locations_user ON locations (user_id);
+CREATE INDEX IF NOT EXISTS locations_position ON locations (lat, lon);
+
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_user ON alerts (user_id, id);
+
+CREATE TABLE IF NOT EXISTS alert_inbox (
+    user_id INTEGER NOT NULL,
+    alert_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, alert_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS position_history (
+    user_id INTEGER NOT NULL,
+    t INTEGER NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    coarse INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS position_history_user_time ON position_history (user_id, t);
+
+CREATE TABLE IF NOT EXISTS versions (
+    scope INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_search_terms (
+    term TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (term, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS user_search_terms_user ON user_search_terms (user_id);
+"""
+
+# Substring search needs FTS5's trigram tokenizer (SQLite 3.34+); without
+# it user search falls back to prefix matches only
+SEARCH_TEXT_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS user_search_text USING fts5(text, tokenize='trigram')"
+)
+
+_BUMP = (
+    "INSERT INTO versions (scope, version) VALUES (?, ?) "
+    "ON CONFLICT (scope) DO UPDATE SET version = excluded.version"
+)
+_BUMP_FOLLOWERS = (
+    "INSERT INTO versions (scope, version) "
+    "SELECT user_id, ? FROM friends WHERE friend_id = ? AND status = 'accepted' "
+    "ON CONFLICT (scope) DO UPDATE SET version = excluded.version"
+)
+
+# SQLite's default limit on bound parameters is 999 in older builds
+_MAX_PARAMS = 900
+
+
+def _record(row_id, data, record_type=None):
+    fields = json.loads(data)
+    if record_type is None:
+        return {"id": row_id, **fields}
+    return record_type(row_id, **fields)
+
+
+def _dump(record):
+    if isinstance(record, Record):
+        return json.dumps(record.fields())
+    return json.dumps({k: v for k, v in record.items() if k != "id"})
+
+
+class _PendingWrite:
+    def __init__(self, operation):
+        self.operation = operation
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _GroupCommitWriter:
+    """Runs queued write operations in shared transactions on one thread.
+
+    A request thread submits a callable and blocks until its batch commits.
+    The writer drains everything queued at that moment into a single
+    transaction, so concurrent inserts share one commit.
+    """
+
+    def __init__(self, store, max_batch=256):
+        self.store = store
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def submit(self, operation):
+        self._ensure_thread()
+        pending = _PendingWrite(operation)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _ensure_thread(self):
+        # Started lazily (and again after a fork) so it runs in the worker
+        # process that actually uses it
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.store._transaction() as conn:
+                    for pending in batch:
+                        pending.result = pending.operation(conn)
+            except Exception:
+                # Retry one by one so a single bad write cannot fail the rest
+                for pending in batch:
+                    try:
+                        with self.store._transaction() as conn:
+                            pending.result = pending.operation(conn)
+                    except Exception as e:
+                        pending.error = e
+            for pending in batch:
+                pending.done.set()
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+class SQLiteStore:
+    """Store backed by a SQLite database file"""
+
+    def __init__(self, path, alert_inbox_size=500, history=None, busy_timeout_ms=5000):
+        self.path = path
+        self.alert_inbox_size = alert_inbox_size
+        # Same retention rules as location_history.LocationHistory
+        history = history or {}
+        self.history_raw_us = int(history.get("raw_seconds", 3600) * 1_000_000)
+        self.history_max_raw_points = history.get("max_raw_points", 720)
+        self.history_bucket_us = max(int(history.get("bucket_seconds", 300) * 1_000_000), 1)
+        self.history_retention_us = int(history.get("retention_seconds", 24 * 3600) * 1_000_000)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._position_listeners = []
+        self._writer = _GroupCommitWriter(self)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        try:
+            conn.execute(SEARCH_TEXT_SCHEMA)
+            self.substring_search = True
+        except sqlite3.OperationalError:
+            self.substring_search = False
+        self._backfill_search()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=128)
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def _query(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchall()
+
+    def _fetch_by_ids(self, table, record_type, ids):
+        """Records from `table` for `ids`, keyed by id, in chunked IN queries"""
+        found = {}
+        ids = list(dict.fromkeys(ids))
+        for start in range(0, len(ids), _MAX_PARAMS):
+            chunk = ids[start:start + _MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            for row_id, data in self._query(
+                f"SELECT id, data FROM {table} WHERE id IN ({placeholders})", chunk
+            ):
+                found[row_id] = _record(row_id, data, record_type)
+        return found
+
+    # Versions
+    def version(self, scope):
+        """Change counter for a user id's views, or ALL_USERS for the user list"""
+        rows = self._query("SELECT version FROM versions WHERE scope = ?", (scope,))
+        return rows[0][0] if rows else 0
+
+    def _bump(self, conn, scopes, followers_of=None):
+        # Random rather than incremented, so workers never need to agree on
+        # the next number; a version only has to differ from the last one
+        version = secrets.randbits(62)
+        conn.executemany(_BUMP, [(scope, version) for scope in scopes])
+        if followers_of is not None:
+            conn.execute(_BUMP_FOLLOWERS, (version, followers_of))
+
+    def counts(self):
+        """Number of records per table"""
+        tables = ("users", "friend_requests", "friends", "locations", "alerts")
+        row = self._query("SELECT " + ", ".join(f"(SELECT COUNT(*) FROM {table})" for table in tables))[0]
+        return dict(zip(tables, row))
+
+    # Users
+    def add_user(self, fields, unique_email=True):
+        """Create a user record, assigning the next id.
+
+        Raises `EmailTaken` if another user has the email address. With
+        `unique_email=False` the user is added anyway, without an email key,
+        so lookups by that address keep finding the first one.
+        """
+        user = User(None, **fields)
+        position = parse_coordinates(user.latitude, user.longitude) or (None, None)
+        key = email_key(user.email)
+        with self._transaction() as conn:
+            if not unique_email and key is not None and conn.execute(
+                "SELECT 1 FROM users WHERE email_key = ?", (key,)
+            ).fetchone():
+                key = None
+            try:
+                cursor = conn.execute(
+                    "INSERT INTO users (email_key, lat, lon, data) VALUES (?, ?, ?, ?)",
+                    (key, position[0], position[1], _dump(user))
+                )
+            except sqlite3.IntegrityError:
+                raise EmailTaken(user.email) from None
+            user.id = cursor.lastrowid
+            self._index_search(conn, user)
+            self._bump(conn, [ALL_USERS, user.id])
+        self._notify_position(user)
+        return user
+
+    def get_user(self, user_id):
+        rows = self._query("SELECT id, data FROM users WHERE id = ?", (user_id,))
+        return _record(*rows[0], User) if rows else None
+
+    def get_users(self, user_ids):
+        """Users for the given ids, in the same order, skipping unknown ids"""
+        found = self._fetch_by_ids("users", User, user_ids)
+        return [found[user_id] for user_id in user_ids if user_id in found]
+
+    def all_users(self):
+        return [_record(*row, User) for row in self._query("SELECT id, data FROM users ORDER BY id")]
+
+    def user_positions(self):
+        """Parallel lists `(ids, lats, lons)` of every user with a position"""
+        rows = self._query("SELECT id, lat, lon FROM users WHERE lat IS NOT NULL ORDER BY id")
+        if not rows:
+            return [], [], []
+        ids, lats, lons = zip(*rows)
+        return list(ids), list(lats), list(lons)
+
+    def get_user_by_email(self, email):
+        key = email_key(email)
+        if key is None:
+            return None
+        rows = self._query(
+            "SELECT id, data FROM users WHERE email_key = ? ORDER BY id LIMIT 1", (key,)
+        )
+        return _record(*rows[0], User) if rows else None
+
+    def update_user(self, user, changes):
+        """Apply field changes to a user record and persist it.
+
+        Only `changes` are written: the row is read again inside the write
+        transaction, so fields another request or worker changed since `user`
+        was loaded are kept. `user` is then brought up to date with the row.
+        """
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT id, data FROM users WHERE id = ?", (user["id"],)).fetchall()
+            current = _record(*rows[0], User) if rows else user
+            current.update(changes)
+            position = parse_coordinates(current.latitude, current.longitude) or (None, None)
+            conn.execute(
+                "UPDATE users SET lat = ?, lon = ?, data = ? WHERE id = ?",
+                (position[0], position[1], _dump(current), current.id)
+            )
+            if "email" in changes:
+                conn.execute(
+                    "UPDATE users SET email_key = ? WHERE id = ?", (email_key(current.email), current.id)
+                )
+            if any(field in changes for field in SEARCH_FIELDS):
+                self._index_search(conn, current, replace=True)
+            # Friends lists show this user's record
+            self._bump(conn, [ALL_USERS, current.id], followers_of=current.id)
+        if current is not user:
+            user.update(current.fields())
+        if "latitude" in changes or "longitude" in changes:
+            self._notify_position(user)
+        return user
+
+    def _index_search(self, conn, user, replace=False):
+        doc = search_terms(user.get("name"), user.get("email"), user.get("phone"))
+        if replace:
+            conn.execute("DELETE FROM user_search_terms WHERE user_id = ?", (user["id"],))
+            if self.substring_search:
+                conn.execute("DELETE FROM user_search_text WHERE rowid = ?", (user["id"],))
+        conn.executemany(
+            "INSERT OR IGNORE INTO user_search_terms (term, user_id) VALUES (?, ?)",
+            [(term, user["id"]) for term in doc[1:]]
+        )
+        if self.substring_search:
+            conn.execute("INSERT INTO user_search_text (rowid, text) VALUES (?, ?)", (user["id"], doc[0]))
+
+    def _backfill_search(self):
+        """Index users written before the search tables existed"""
+        if self._query("SELECT EXISTS (SELECT 1 FROM user_search_terms) "
+                       "OR NOT EXISTS (SELECT 1 FROM users)")[0][0]:
+            return
+        with self._transaction() as conn:
+            for row in conn.execute("SELECT id, data FROM users").fetchall():
+                self._index_search(conn, _record(*row, User), replace=True)
+
+    def search_users(self, query, limit, user_id=None):
+        """Users matching a typeahead query, `user_id`'s friends first and
+        `user_id` left out; same ranking as `user_search.UserSearchIndex`"""
+        words = query_words(query)
+        if not words or limit < 1:
+            return []
+        found = []
+        seen = {user_id}
+
+        def accept(users, kinds):
+            for user in users:
+                if user["id"] in seen:
+                    continue
+                doc = search_terms(user.get("name"), user.get("email"), user.get("phone"))
+                if match_kind(words, doc) in kinds:
+                    seen.add(user["id"])
+                    found.append(user)
+                    if len(found) >= limit:
+                        return True
+            return False
+
+        if user_id is not None:
+            friends = []
+            for friend in self.get_users(self.friends_of(user_id)):
+                doc = search_terms(friend.get("name"), friend.get("email"), friend.get("phone"))
+                kind = match_kind(words, doc)
+                if kind is not None and friend["id"] not in seen:
+                    friends.append((kind, doc[0], friend["id"], friend))
+            friends.sort(key=lambda item: item[:3])
+            for *_, friend in friends[:limit]:
+                seen.add(friend["id"])
+                found.append(friend)
+            if len(found) >= limit:
+                return found
+
+        # Pages of candidates are read until `limit` of them match every word
+        lead = max(words, key=len)
+        page = max(limit, 32)
+        after = ("", 0)
+        while True:
+            rows = self._query(
+                "SELECT term, user_id FROM user_search_terms "
+                "WHERE term >= ? AND term < ? AND (term, user_id) > (?, ?) "
+                "ORDER BY term, user_id LIMIT ?",
+                (lead, lead + "\U0010ffff", *after, page)
+            )
+            ids = [row[1] for row in rows if row[1] not in seen]
+            if accept(self.get_users(list(dict.fromkeys(ids))), (PREFIX,)) or len(rows) < page:
+                break
+            after = rows[-1]
+
+        if len(found) < limit and len(lead) >= 3 and self.substring_search:
+            phrase = '"' + lead.replace('"', '""') + '"'
+            after = 0
+            while True:
+                ids = [row[0] for row in self._query(
+                    "SELECT rowid FROM user_search_text WHERE user_search_text MATCH ? AND rowid > ? "
+                    "ORDER BY rowid LIMIT ?",
+                    (phrase, after, page)
+                )]
+                if accept(self.get_users([i for i in ids if i not in seen]), (PREFIX, SUBSTRING)) or len(ids) < page:
+                    break
+                after = ids[-1]
+        return found
+
+    def add_position_listener(self, listener):
+        """Call `listener(user_id, (lat, lon) or None)` whenever a user moves"""
+        self._position_listeners.append(listener)
+
+    def _notify_position(self, user):
+        position = parse_coordinates(user.get("latitude"), user.get("longitude"))
+        for listener in self._position_listeners:
+            listener(user["id"], position)
+
+    def _in_bbox(self, table, min_lat, min_lon, max_lat, max_lon):
+        # Boxes that cross the antimeridian become two longitude ranges
+        if max_lon - min_lon >= 360.0:
+            lon_ranges = [(-180.0, 180.0)]
+        elif min_lon < -180.0:
+            lon_ranges = [(min_lon + 360.0, 180.0), (-180.0, max_lon)]
+        elif max_lon > 180.0:
+            lon_ranges = [(min_lon, 180.0), (-180.0, max_lon - 360.0)]
+        else:
+            lon_ranges = [(min_lon, max_lon)]
+        rows = []
+        for low_lon, high_lon in lon_ranges:
+            rows.extend(self._query(
+                f"SELECT id, lat, lon, data FROM {table} "
+                "WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?",
+                (min_lat, max_lat, low_lon, high_lon)
+            ))
+        return rows
+
+    def _near(self, table, record_type, lat, lon, radius_km):
+        rows = self._in_bbox(table, *radius_bbox(lat, lon, radius_km))
+        if not rows:
+            return []
+        distances = haversine_km_many(lat, lon, np.array([r[1] for r in rows]), np.array([r[2] for r in rows]))
+        inside = np.flatnonzero(distances <= radius_km)
+        inside = inside[np.argsort(distances[inside], kind="stable")]
+        return [(_record(rows[i][0], rows[i][3], record_type), float(distances[i])) for i in inside]
+
+    def users_near(self, lat, lon, radius_km):
+        """`(user, distance_km)` for users within `radius_km`, nearest first"""
+        return self._near("users", User, lat, lon, radius_km)
+
+    # Friend requests
+    def add_friend_request(self, from_user_id, to_user_id, created_at):
+        fields = {
+            "from_user_id": from_user_id,
+            "to_user_id": to_user_id,
+            "status": "pending",
+            "created_at": created_at
+        }
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO friend_requests (from_user_id, to_user_id, status, data) VALUES (?, ?, ?, ?)",
+                (from_user_id, to_user_id, "pending", json.dumps(fields))
+            )
+        return {"id": cursor.lastrowid, **fields}
+
+    def get_friend_request(self, request_id):
+        rows = self._query("SELECT id, data FROM friend_requests WHERE id = ?", (request_id,))
+        return _record(*rows[0]) if rows else None
+
+    def find_friend_request(self, from_user_id, to_user_id, status):
+        rows = self._query(
+            "SELECT id, data FROM friend_requests "
+            "WHERE from_user_id = ? AND to_user_id = ? AND status = ? ORDER BY id LIMIT 1",
+            (from_user_id, to_user_id, status)
+        )
+        return _record(*rows[0]) if rows else None
+
+    def pending_requests_for(self, user_id):
+        """Pending requests addressed to a user, oldest first"""
+        rows = self._query(
+            "SELECT id, data FROM friend_requests WHERE to_user_id = ? AND status = 'pending' ORDER BY id",
+            (user_id,)
+        )
+        return [_record(*row) for row in rows]
+
+    def set_friend_request_status(self, friend_request, status):
+        friend_request["status"] = status
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE friend_requests SET status = ?, data = ? WHERE id = ?",
+                (status, _dump(friend_request), friend_request["id"])
+            )
+        return friend_request
+
+    # Friend connections
+    def add_friend_connection(self, user_id, friend_id, status, created_at):
+        fields = {
+            "user_id": user_id,
+            "friend_id": friend_id,
+            "status": status,
+            "created_at": created_at
+        }
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO friends (user_id, friend_id, status, data) VALUES (?, ?, ?, ?)",
+                (user_id, friend_id, status, json.dumps(fields))
+            )
+            if status == "accepted":
+                # The new friend's earlier alerts become visible to user_id
+                conn.execute(
+                    "INSERT OR IGNORE INTO alert_inbox (user_id, alert_id) "
+                    "SELECT ?, id FROM alerts WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                    (user_id, friend_id, self.alert_inbox_size)
+                )
+                self._bump(conn, [user_id])
+        return {"id": cursor.lastrowid, **fields}
+
+    def friends_of(self, user_id):
+        rows = self._query(
+            "SELECT friend_id FROM friends WHERE user_id = ? AND status = 'accepted' ORDER BY id",
+            (user_id,)
+        )
+        return list(dict.fromkeys(row[0] for row in rows))
+
+    def followers_of(self, user_id):
+        rows = self._query(
+            "SELECT user_id FROM friends WHERE friend_id = ? AND status = 'accepted' ORDER BY id",
+            (user_id,)
+        )
+        return list(dict.fromkeys(row[0] for row in rows))
+
+    # Locations
+    def add_location(self, fields):
+        return self.add_locations([fields])[0]
+
+    def add_locations(self, fields_list):
+        """Create several locations in one transaction"""
+        locations = [Location(None, **fields) for fields in fields_list]
+
+        def insert(conn):
+            for location in locations:
+                position = parse_coordinates(location.latitude, location.longitude) or (None, None)
+                cursor = conn.execute(
+                    "INSERT INTO locations (user_id, lat, lon, data) VALUES (?, ?, ?, ?)",
+                    (location.user_id, position[0], position[1], _dump(location))
+                )
+                location.id = cursor.lastrowid
+            self._bump(conn, dict.fromkeys(location.user_id for location in locations))
+            return locations
+
+        return self._writer.submit(insert)
+
+    def locations_for(self, user_id):
+        rows = self._query("SELECT id, data FROM locations WHERE user_id = ? ORDER BY id", (user_id,))
+        return [_record(*row, Location) for row in rows]
+
+    def locations_near(self, lat, lon, radius_km):
+        """`(location, distance_km)` for saved places within `radius_km`"""
+        return self._near("locations", Location, lat, lon, radius_km)
+
+    # Position history
+    def record_positions(self, user_id, points):
+        """Append `(timestamp_us, lat, lon)` points to a user's trail"""
+        now = now_us()
+
+        def insert(conn):
+            conn.executemany(
+                "INSERT INTO position_history (user_id, t, lat, lon) VALUES (?, ?, ?, ?)",
+                [(user_id, timestamp, lat, lon) for timestamp, lat, lon in points]
+            )
+            self._fold_history(conn, user_id, now)
+
+        self._writer.submit(insert)
+
+    def _fold_history(self, conn, user_id, now):
+        """Downsample aged raw points to one per bucket and drop expired ones"""
+        cutoff = now - self.history_raw_us
+        over_cap = conn.execute(
+            "SELECT t FROM position_history WHERE user_id = ? AND coarse = 0 "
+            "ORDER BY t DESC LIMIT 1 OFFSET ?",
+            (user_id, self.history_max_raw_points)
+        ).fetchone()
+        if over_cap is not None:
+            cutoff = max(cutoff, over_cap[0] + 1)
+        first_aged = conn.execute(
+            "SELECT MIN(t) FROM position_history WHERE user_id = ? AND coarse = 0 AND t < ?",
+            (user_id, cutoff)
+        ).fetchone()[0]
+        if first_aged is not None:
+            conn.execute(
+                "UPDATE position_history SET coarse = 1 WHERE user_id = ? AND coarse = 0 AND t < ?",
+                (user_id, cutoff)
+            )
+            # Keep only the newest point of each bucket the aged points touched
+            bucket = self.history_bucket_us
+            conn.execute(
+                "DELETE FROM position_history AS p WHERE p.user_id = ? AND p.coarse = 1 AND p.t >= ? "
+                "AND EXISTS (SELECT 1 FROM position_history AS q "
+                "WHERE q.user_id = p.user_id AND q.coarse = 1 AND q.t / ? = p.t / ? "
+                "AND (q.t > p.t OR (q.t = p.t AND q.rowid > p.rowid)))",
+                (user_id, first_aged // bucket * bucket, bucket, bucket)
+            )
+        conn.execute(
+            "DELETE FROM position_history WHERE user_id = ? AND t < ?",
+            (user_id, now - self.history_retention_us)
+        )
+
+    def position_history(self, user_id, start, end):
+        """`(timestamp_us, lat, lon)` for a user between two epoch-microsecond times"""
+        return self._query(
+            "SELECT t, lat, lon FROM position_history WHERE user_id = ? AND t BETWEEN ? AND ? ORDER BY t",
+            (user_id, start, end)
+        )
+
+    # Alerts
+    def add_alert(self, fields):
+        """Store an alert and fan it out to the author's and followers' inboxes"""
+        alert = Alert(None, **fields)
+
+        def insert(conn):
+            cursor = conn.execute(
+                "INSERT INTO alerts (user_id, data) VALUES (?, ?)",
+                (alert.user_id, _dump(alert))
+            )
+            alert.id = cursor.lastrowid
+            conn.execute(
+                "INSERT OR IGNORE INTO alert_inbox (user_id, alert_id) VALUES (?, ?)",
+                (alert.user_id, alert.id)
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO alert_inbox (user_id, alert_id) "
+                "SELECT user_id, ? FROM friends WHERE friend_id = ? AND status = 'accepted'",
+                (alert.id, alert.user_id)
+            )
+            self._bump(conn, [alert.user_id], followers_of=alert.user_id)
+            if alert.id % 64 == 0:
+                self._trim_inboxes(conn, alert.user_id)
+            return alert
+
+        return self._writer.submit(insert)
+
+    def _trim_inboxes(self, conn, author_id):
+        """Drop inbox rows beyond the newest `alert_inbox_size` per recipient"""
+        recipients = [author_id] + [row[0] for row in conn.execute(
+            "SELECT user_id FROM friends WHERE friend_id = ? AND status = 'accepted'", (author_id,)
+        )]
+        for user_id in dict.fromkeys(recipients):
+            conn.execute(
+                "DELETE FROM alert_inbox WHERE user_id = ? AND alert_id <= ("
+                "SELECT alert_id FROM alert_inbox WHERE user_id = ? "
+                "ORDER BY alert_id DESC LIMIT 1 OFFSET ?)",
+                (user_id, user_id, self.alert_inbox_size)
+            )
+
+    def alert_feed(self, user_id, since_id=None, limit=None):
+        """A user's own and friends' alerts from their inbox, oldest first"""
+        page = min(limit or self.alert_inbox_size, self.alert_inbox_size)
+        if since_id is not None:
+            rows = self._query(
+                "SELECT a.id, a.data FROM alert_inbox i JOIN alerts a ON a.id = i.alert_id "
+                "WHERE i.user_id = ? AND i.alert_id > ? ORDER BY i.alert_id LIMIT ?",
+                (user_id, since_id, page)
+            )
+        else:
+            rows = self._query(
+                "SELECT a.id, a.data FROM alert_inbox i JOIN alerts a ON a.id = i.alert_id "
+                "WHERE i.user_id = ? ORDER BY i.alert_id DESC LIMIT ?",
+                (user_id, page)
+            )
+            rows.reverse()
+        return [_record(*row, Alert) for row in rows]
@@ -0,0 +1,498 @@
+"""In-memory data store for SafeSphere.
+
+Records are kept in plain lists (in insertion order, which is also the order
+the API returns them in) and every lookup the endpoints need goes through a
+dict index, so handlers never have to scan a whole table.
+"""
+import itertools
+import threading
+import time
+from operator import itemgetter
+
+from alert_inbox import AlertInbox
+from friend_graph import FriendGraph
+from geo import parse_coordinates
+from location_history import LocationHistory
+from records import Alert, Location, User, now_us
+from spatial_index import GridIndex
+from user_search import UserSearchIndex
+
+
+# Version scope of the full user list; user ids start at 1
+ALL_USERS = 0
+
+# User fields the search index covers
+SEARCH_FIELDS = ("name", "email", "phone")
+
+# Row layout of the dict records in snapshots and the journal
+REQUEST_FIELDS = ("id", "from_user_id", "to_user_id", "status", "created_at")
+FRIEND_FIELDS = ("id", "user_id", "friend_id", "status", "created_at")
+request_row = itemgetter(*REQUEST_FIELDS)
+friend_row = itemgetter(*FRIEND_FIELDS)
+
+
+class EmailTaken(ValueError):
+    """Raised by `add_user` when another user already has the email address"""
+
+
+def create_store(database_url=None, journal=None, **options):
+    """Build the store named by a DATABASE_URL.
+
+    `sqlite:///path/to/file.db` selects the SQLite backend, which several
+    worker processes can share. `journal:///path/to/dir` keeps everything in
+    memory but journals changes to that directory and recovers them on
+    restart, configured by `journal` options. Anything else (including no
+    URL) keeps everything in this process's memory.
+    """
+    if database_url and database_url.startswith("sqlite:///"):
+        from sqlite_store import SQLiteStore
+        return SQLiteStore(database_url[len("sqlite:///"):], **options)
+    if database_url and database_url.startswith("journal:///"):
+        from journal import JournaledStore
+        return JournaledStore(database_url[len("journal:///"):], **(journal or {}), **options)
+    return MemoryStore(**options)
+
+
+# Stored for users created without an email address; never indexed
+DEFAULT_EMAIL = "unknown@example.com"
+
+
+def email_key(email):
+    """Normalise an email address for index lookups, or None if there is no
+    real address to index"""
+    if not isinstance(email, str):
+        return None
+    key = email.strip().lower()
+    if not key or key == DEFAULT_EMAIL:
+        return None
+    return key
+
+
+class MemoryStore:
+    """Holds users, friends, requests, locations and alerts with their indexes"""
+
+    def __init__(self, alert_inbox_size=500, history=None):
+        self.users = []
+        self.locations = []
+        self.friends = []
+        self.friend_requests = []
+        self.alerts = []
+
+        self._lock = threading.RLock()
+        self._users_by_id = {}
+        self._users_by_email = {}
+        self._requests_by_id = {}
+        self._requests_by_key = {}  # (from_user_id, to_user_id, status) -> request
+        self._pending_by_recipient = {}  # to_user_id -> {request_id: request}
+        self._locations_by_user = {}
+        self._alerts_by_user = {}
+        self.graph = FriendGraph()
+        self.inbox = AlertInbox(alert_inbox_size)
+        self._user_grid = GridIndex()
+        self._location_grid = GridIndex()
+        self._search = UserSearchIndex()
+        self.history = LocationHistory(**(history or {}))
+        self._position_listeners = []
+        # Seeded from the clock so versions never repeat across restarts
+        self._version_clock = itertools.count(time.time_ns())
+        self._base_version = next(self._version_clock)
+        self._versions = {}
+        self.journal = None  # set by journal.JournaledStore
+
+    # Versions
+    def version(self, scope):
+        """Change counter for a user id's views, or ALL_USERS for the user list"""
+        return self._versions.get(scope, self._base_version)
+
+    def _bump(self, scopes):
+        version = next(self._version_clock)
+        for scope in scopes:
+            self._versions[scope] = version
+
+    def counts(self):
+        """Number of records per table"""
+        return {
+            "users": len(self.users),
+            "friend_requests": len(self.friend_requests),
+            "friends": len(self.friends),
+            "locations": len(self.locations),
+            "alerts": len(self.alerts)
+        }
+
+    # Users
+    def add_user(self, fields, unique_email=True):
+        """Create a user record, assigning the next id.
+
+        Raises `EmailTaken` if another user has the email address. With
+        `unique_email=False` the user is added anyway, and lookups by that
+        address keep finding the first one.
+        """
+        with self._lock:
+            user = User(len(self.users) + 1, **fields)
+            key = email_key(user.get("email"))
+            # Checked under the lock, so of two concurrent registrations
+            # with one address only the first succeeds
+            if key is not None and key in self._users_by_email:
+                if unique_email:
+                    raise EmailTaken(user.get("email"))
+                key = None
+            self.users.append(user)
+            self._users_by_id[user["id"]] = user
+            if key is not None:
+                self._users_by_email[key] = user
+            self._index_user_position(user)
+            self._search.add(user["id"], user.get("name"), user.get("email"), user.get("phone"))
+            self._bump([ALL_USERS, user["id"]])
+            ticket = self._log("user", user.row())
+        self._wait_for_journal(ticket)
+        return user
+
+    def get_user(self, user_id):
+        return self._users_by_id.get(user_id)
+
+    def get_users(self, user_ids):
+        """Users for the given ids, in the same order, skipping unknown ids"""
+        return [self._users_by_id[user_id] for user_id in user_ids if user_id in self._users_by_id]
+
+    def all_users(self):
+        return list(self.users)
+
+    def user_positions(self):
+        """Parallel lists `(ids, lats, lons)` of every user with a position"""
+        ids, lats, lons = [], [], []
+        for user in self.users:
+            position = parse_coordinates(user.get("latitude"), user.get("longitude"))
+            if position is not None:
+                ids.append(user["id"])
+                lats.append(position[0])
+                lons.append(position[1])
+        return ids, lats, lons
+
+    def get_user_by_email(self, email):
+        key = email_key(email)
+        if key is None:
+            return None
+        return self._users_by_email.get(key)
+
+    def update_user(self, user, changes):
+        """Apply field changes to a user record in place"""
+        with self._lock:
+            user.update(changes)
+            if "latitude" in changes or "longitude" in changes:
+                self._index_user_position(user)
+            if any(field in changes for field in SEARCH_FIELDS):
+                self._search.update(user["id"], user.get("name"), user.get("email"), user.get("phone"))
+            # Friends lists show this user's record
+            self._bump([ALL_USERS, user["id"]] + self.graph.followers_of(user["id"]))
+            ticket = self._log("user", user.row())
+        self._wait_for_journal(ticket)
+        return user
+
+    def search_users(self, query, limit, user_id=None):
+        """Users matching a typeahead query, `user_id`'s friends first and
+        `user_id` left out"""
+        # The index's sorted terms are rearranged in place by updates
+        with self._lock:
+            friend_ids = self.graph.friends_of(user_id) if user_id is not None else ()
+            return self.get_users(self._search.search(query, limit, friend_ids, exclude=user_id))
+
+    def add_position_listener(self, listener):
+        """Call `listener(user_id, (lat, lon) or None)` whenever a user moves"""
+        self._position_listeners.append(listener)
+
+    def users_near(self, lat, lon, radius_km):
+        """`(user, distance_km)` for users within `radius_km`, nearest first"""
+        return [(self._users_by_id[user_id], distance)
+                for user_id, distance in self._user_grid.within_radius(lat, lon, radius_km)]
+
+    def _index_user_position(self, user):
+        position = self._index_position(self._user_grid, user)
+        for listener in self._position_listeners:
+            listener(user["id"], position)
+
+    def _index_position(self, index, record):
+        position = parse_coordinates(record.get("latitude"), record.get("longitude"))
+        if position is None:
+            index.remove(record["id"])
+        else:
+            index.upsert(record["id"], *position)
+        return position
+
+    # Friend requests
+    def add_friend_request(self, from_user_id, to_user_id, created_at):
+        with self._lock:
+            friend_request = {
+                "id": len(self.friend_requests) + 1,
+                "from_user_id": from_user_id,
+                "to_user_id": to_user_id,
+                "status": "pending",
+                "created_at": created_at
+            }
+            self.friend_requests.append(friend_request)
+            self._requests_by_id[friend_request["id"]] = friend_request
+            self._index_request(friend_request)
+            ticket = self._log("friend_request", request_row(friend_request))
+        self._wait_for_journal(ticket)
+        return friend_request
+
+    def get_friend_request(self, request_id):
+        return self._requests_by_id.get(request_id)
+
+    def find_friend_request(self, from_user_id, to_user_id, status):
+        return self._requests_by_key.get((from_user_id, to_user_id, status))
+
+    def pending_requests_for(self, user_id):
+        """Pending requests addressed to a user, oldest first"""
+        return list(self._pending_by_recipient.get(user_id, {}).values())
+
+    def set_friend_request_status(self, friend_request, status):
+        with self._lock:
+            self._unindex_request(friend_request)
+            friend_request["status"] = status
+            self._index_request(friend_request)
+            ticket = self._log("friend_request", request_row(friend_request))
+        self._wait_for_journal(ticket)
+        return friend_request
+
+    def _index_request(self, friend_request):
+        key = (friend_request["from_user_id"], friend_request["to_user_id"], friend_request["status"])
+        self._requests_by_key.setdefault(key, friend_request)
+        if friend_request["status"] == "pending":
+            pending = self._pending_by_recipient.setdefault(friend_request["to_user_id"], {})
+            pending[friend_request["id"]] = friend_request
+
+    def _unindex_request(self, friend_request):
+        key = (friend_request["from_user_id"], friend_request["to_user_id"], friend_request["status"])
+        if self._requests_by_key.get(key) is friend_request:
+            del self._requests_by_key[key]
+        if friend_request["status"] == "pending":
+            pending = self._pending_by_recipient.get(friend_request["to_user_id"], {})
+            pending.pop(friend_request["id"], None)
+
+    # Friend connections
+    def add_friend_connection(self, user_id, friend_id, status, created_at):
+        with self._lock:
+            connection = {
+                "id": len(self.friends) + 1,
+                "user_id": user_id,
+                "friend_id": friend_id,
+                "status": status,
+                "created_at": created_at
+            }
+            self.friends.append(connection)
+            if status == "accepted":
+                self.graph.add(user_id, friend_id)
+                # The new friend's earlier alerts become visible to user_id
+                self.inbox.backfill(user_id, self._alerts_by_user.get(friend_id, []))
+                self._bump([user_id])
+            ticket = self._log("friend", friend_row(connection))
+        self._wait_for_journal(ticket)
+        return connection
+
+    def friends_of(self, user_id):
+        return self.graph.friends_of(user_id)
+
+    def followers_of(self, user_id):
+        return self.graph.followers_of(user_id)
+
+    # Locations
+    def add_location(self, fields):
+        return self.add_locations([fields])[0]
+
+    def add_locations(self, fields_list):
+        """Create several locations under one lock and one version bump"""
+        with self._lock:
+            created = []
+            for fields in fields_list:
+                location = Location(len(self.locations) + 1, **fields)
+                self.locations.append(location)
+                self._locations_by_user.setdefault(location["user_id"], []).append(location)
+                self._index_position(self._location_grid, location)
+                created.append(location)
+                ticket = self._log("location", location.row())
+            self._bump(dict.fromkeys(location["user_id"] for location in created))
+        if created:
+            self._wait_for_journal(ticket)
+        return created
+
+    def locations_for(self, user_id):
+        return list(self._locations_by_user.get(user_id, []))
+
+    def locations_near(self, lat, lon, radius_km):
+        """`(location, distance_km)` for saved places within `radius_km`"""
+        return [(self.locations[location_id - 1], distance)
+                for location_id, distance in self._location_grid.within_radius(lat, lon, radius_km)]
+
+    # Position history
+    def record_positions(self, user_id, points):
+        """Append `(timestamp_us, lat, lon)` points to a user's trail"""
+        self.history.record(user_id, points, now_us())
+
+    def position_history(self, user_id, start, end):
+        """`(timestamp_us, lat, lon)` for a user between two epoch-microsecond times"""
+        return self.history.query(user_id, start, end, now_us())
+
+    # Alerts
+    def add_alert(self, fields):
+        """Store an alert and fan it out to the author's and followers' inboxes"""
+        with self._lock:
+            alert = Alert(len(self.alerts) + 1, **fields)
+            self.alerts.append(alert)
+            self._alerts_by_user.setdefault(alert["user_id"], []).append(alert)
+            recipients = [alert["user_id"]] + self.graph.followers_of(alert["user_id"])
+            recipients = dict.fromkeys(recipients)
+            self.inbox.deliver(alert, recipients)
+            self._bump(recipients)
+            ticket = self._log("alert", alert.row())
+        self._wait_for_journal(ticket)
+        return alert
+
+    def alert_feed(self, user_id, since_id=None, limit=None):
+        """A user's own and friends' alerts from their inbox, oldest first"""
+        return self.inbox.read(user_id, since_id, limit)
+
+    # Journal
+    def _log(self, table, row):
+        """Queue a record's new state for the journal; called under the lock,
+        so entries are in the order the changes were made"""
+        if self.journal is None:
+            return None
+        return self.journal.append((table, row))
+
+    def _wait_for_journal(self, ticket):
+        # Outside the lock, so other writers can queue entries meanwhile and
+        # share the same fsync
+        if ticket is not None:
+            self.journal.wait(ticket)
+
+    def snapshot_chunks(self, chunk_size=4096):
+        """`(table, rows)` for every record, then the search index.
+
+        The lock is only held while one chunk is copied. Records that change
+        after their chunk was copied are in the journal from before the
+        first copy onwards, and `apply` brings them up to date.
+        """
+        tables = [
+            ("users", self.users, User.row),
+            ("friend_requests", self.friend_requests, request_row),
+            ("friends", self.friends, friend_row),
+            ("locations", self.locations, Location.row),
+            ("alerts", self.alerts, Alert.row)
+        ]
+        for table, records, to_row in tables:
+            start = 0
+            while True:
+                with self._lock:
+                    rows = [to_row(record) for record in records[start:start + chunk_size]]
+                if not rows:
+                    break
+                yield table, rows
+                start += len(rows)
+        with self._lock:
+            search = self._search.snapshot(chunk_size)
+        for kind, payload in search:
+            yield "search_" + kind, payload
+
+    def restore_snapshot(self, chunks):
+        """Load `snapshot_chunks` output into an empty store.
+
+        Indexes are filled in a chunk at a time, without version bumps or
+        position listeners. Friends come before alerts, so each alert reaches
+        the inboxes of everyone following its author.
+        """
+        restore = {
+            "users": self._restore_users,
+            "friend_requests": self._restore_friend_requests,
+            "friends": self._restore_friends,
+            "locations": self._restore_locations,
+            "alerts": self._restore_alerts
+        }
+        chunks = iter(chunks)
+        with self._lock:
+            for table, rows in chunks:
+                if table.startswith("search_"):
+                    rest = itertools.chain([(table, rows)], chunks)
+                    self._search = UserSearchIndex.load((kind[len("search_"):], payload) for kind, payload in rest)
+                    break
+                restore[table](rows)
+
+    @staticmethod
+    def _positions(records):
+        """`(id, lat, lon)` of the records that have a valid position"""
+        points = []
+        for record in records:
+            position = parse_coordinates(record.latitude, record.longitude)
+            if position is not None:
+                points.append((record.id, *position))
+        return points
+
+    def _restore_users(self, rows):
+        users = [User.from_row(row) for row in rows]
+        self.users.extend(users)
+        for user in users:
+            self._users_by_id[user.id] = user
+            key = email_key(user.email)
+            if key is not None:
+                self._users_by_email.setdefault(key, user)
+        self._user_grid.upsert_many(self._positions(users))
+
+    def _restore_friend_requests(self, rows):
+        for row in rows:
+            friend_request = dict(zip(REQUEST_FIELDS, row))
+            self.friend_requests.append(friend_request)
+            self._requests_by_id[friend_request["id"]] = friend_request
+            self._index_request(friend_request)
+
+    def _restore_friends(self, rows):
+        connections = [dict(zip(FRIEND_FIELDS, row)) for row in rows]
+        self.friends.extend(connections)
+        self.graph.add_many((connection["user_id"], connection["friend_id"])
+                            for connection in connections if connection["status"] == "accepted")
+
+    def _restore_locations(self, rows):
+        locations = [Location.from_row(row) for row in rows]
+        self.locations.extend(locations)
+        for location in locations:
+            self._locations_by_user.setdefault(location.user_id, []).append(location)
+        self._location_grid.upsert_many(self._positions(locations))
+
+    def _restore_alerts(self, rows):
+        for alert in map(Alert.from_row, rows):
+            self.alerts.append(alert)
+            self._alerts_by_user.setdefault(alert.user_id, []).append(alert)
+            self.inbox.deliver(alert, dict.fromkeys([alert.user_id] + self.graph.followers_of(alert.user_id)))
+
+    def apply(self, entry):
+        """Replay one journal entry. An entry is a record's full state, so
+        one that is already reflected in the store changes nothing."""
+        table, row = entry
+        record_id = row[0]
+        with self._lock:
+            records = {
+                "user": self.users, "friend_request": self.friend_requests, "friend": self.friends,
+                "location": self.locations, "alert": self.alerts
+            }[table]
+            if record_id > len(records) + 1:
+                raise ValueError(f"journal entry for {table} {record_id} follows only {len(records)}")
+            if table == "user":
+                if record_id <= len(records):
+                    user = records[record_id - 1]
+                    if user.row() != row:
+                        self.update_user(user, dict(zip(User.FIELDS, row[1:])))
+                else:
+                    user = self.add_user(dict(zip(User.FIELDS, row[1:])), unique_email=False)
+                # The search index may come from a snapshot older than the user
+                self._search.update(user.id, user.name, user.email, user.phone)
+            elif table == "friend_request":
+                fields = dict(zip(REQUEST_FIELDS, row))
+                if record_id > len(records):
+                    self.add_friend_request(fields["from_user_id"], fields["to_user_id"], fields["created_at"])
+                if records[record_id - 1]["status"] != fields["status"]:
+                    self.set_friend_request_status(records[record_id - 1], fields["status"])
+            elif record_id > len(records):
+                if table == "friend":
+                    self.add_friend_connection(*row[1:])
+                elif table == "location":
+                    self.add_locations([dict(zip(Location.FIELDS, row[1:]))])
+                else:
+                    self.add_alert(dict(zip(Alert.FIELDS, row[1:])))
@@ -0,0 +1,29 @@
+"""Shared fixtures. Modules are imported the way the app and benchmarks
+import them, from the backend directory."""
+import os
+import sys
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, os.path.join(BACKEND, "benchmarks"))
+
+from stub_weather import start_in_background  # noqa: E402
+
+
+@pytest.fixture
+def stub_weather():
+    """Start a stub OpenWeatherMap server; returns `(server, url)`. Its
+    `latency` and `error_rate` can be changed while it runs."""
+    servers = []
+
+    def start(**kwargs):
+        server = start_in_background(**kwargs)
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_port}/data/2.5/weather"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,151 @@
+import itertools
+import json
+import os
+
+import pytest
+
+import disaster_feed
+from disaster_feed import DisasterFeed, DisasterStore, FileSource, create_feed_source
+
+_mtimes = itertools.count(1_700_000_000_000_000_000, 1_000_000)
+
+
+def quake(event_id, lat, lon, mag=5.0, updated=1):
+    return {
+        "type": "Feature",
+        "id": event_id,
+        "geometry": {"type": "Point", "coordinates": [lon, lat, 10.0]},
+        "properties": {"mag": mag, "place": f"near {event_id}", "time": 1_700_000_000_000, "updated": updated}
+    }
+
+
+def write_feed(path, features):
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    # Rewrites within one filesystem clock tick would otherwise look unchanged
+    stamp = next(_mtimes)
+    os.utime(path, ns=(stamp, stamp))
+    return path
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(disaster_feed, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def hazards():
+    """What the app's `on_change` hook would hand the geofence, per call"""
+    return []
+
+
+def make_feed(paths, hazards, ttl=3600):
+    store = DisasterStore(ttl=ttl)
+    feed = DisasterFeed(store, [create_feed_source(f"file://{path}", None) for path in paths],
+                        on_change=lambda events: hazards.append({event["id"]: event for event in events}))
+    return store, feed
+
+
+def test_file_urls_make_file_sources(tmp_path):
+    source = create_feed_source(f"file://{tmp_path}/feed%20one.geojson", None)
+    assert isinstance(source, FileSource)
+    assert source.path == f"{tmp_path}/feed one.geojson"
+
+
+def test_events_are_deduplicated_across_polls_and_sources(tmp_path, clock, hazards):
+    first = write_feed(tmp_path / "a.geojson", [quake("us1", 35.0, 139.0), quake("us2", 36.0, 140.0)])
+    second = write_feed(tmp_path / "b.geojson", [quake("us1", 35.0, 139.0)])
+    store, feed = make_feed([first, second], hazards)
+
+    assert feed.poll()
+    assert len(store) == 2
+    assert sorted(hazards[-1]) == ["us1", "us2"]
+    stats = feed.stats()
+    # The second source's copy of us1 is recognised without being parsed
+    assert (stats["parsed"], stats["skipped"], stats["changed"]) == (2, 1, 2)
+
+    clock.now += 60
+    assert not feed.poll()
+    stats = feed.stats()
+    assert (stats["parsed"], stats["skipped"], stats["changed"]) == (2, 4, 2)
+    assert len(hazards) == 1
+
+
+def test_an_updated_event_replaces_the_old_one(tmp_path, clock, hazards):
+    path = write_feed(tmp_path / "feed.geojson", [quake("us1", 35.0, 139.0, mag=4.0)])
+    store, feed = make_feed([path], hazards)
+    feed.poll()
+    old_radius = hazards[-1]["us1"]["radius"]
+
+    write_feed(path, [quake("us1", 35.5, 139.5, mag=6.5, updated=2)])
+    clock.now += 60
+    assert feed.poll()
+
+    assert len(store) == 1
+    assert [event["id"] for event, _ in store.near(35.5, 139.5, 1.0)] == ["us1"]
+    assert store.near(35.0, 139.0, 1.0) == []
+    replaced = hazards[-1]["us1"]
+    assert (replaced["latitude"], replaced["magnitude"], replaced["severity"]) == (35.5, 6.5, "high")
+    assert replaced["radius"] > old_radius
+
+
+def test_events_dropped_by_the_feed_expire_after_ttl(tmp_path, clock, hazards):
+    path = write_feed(tmp_path / "feed.geojson", [quake("us1", 35.0, 139.0), quake("us2", 36.0, 140.0)])
+    store, feed = make_feed([path], hazards, ttl=600)
+    feed.poll()
+
+    write_feed(path, [quake("us1", 35.0, 139.0)])
+    clock.now += 300
+    assert not feed.poll()
+    assert len(store) == 2
+
+    clock.now += 301
+    assert feed.poll()
+    assert [event["id"] for event in store.events()] == ["us1"]
+    assert list(hazards[-1]) == ["us1"]
+    assert feed.stats()["expired"] == 1
+
+
+def test_a_failing_source_keeps_its_events_until_they_expire(tmp_path, clock, hazards):
+    path = write_feed(tmp_path / "feed.geojson", [quake("us1", 35.0, 139.0)])
+    store, feed = make_feed([path], hazards, ttl=600)
+    feed.poll()
+
+    path.write_text("{not json")
+    os.utime(path, ns=(next(_mtimes),) * 2)
+    clock.now += 60
+    assert not feed.poll()
+    assert feed.stats()["errors"] == 1
+    assert len(store) == 1
+
+    clock.now += 600
+    assert feed.poll()
+    assert len(store) == 0
+    assert hazards[-1] == {}
+
+
+def test_unusable_features_are_skipped(tmp_path, clock, hazards):
+    broken = [
+        {"type": "Feature", "id": "no-geometry", "properties": {}},
+        {"type": "Feature", "id": "off-map", "geometry": {"type": "Point", "coordinates": [200.0, 95.0]}},
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [1.0, 1.0]}},
+        {"type": "Feature", "id": "bad", "geometry": {"type": "Point", "coordinates": ["x", 1.0]}},
+        {**quake("nan-lat", 0.0, 1.0), "geometry": {"type": "Point", "coordinates": [1.0, float("nan")]}},
+        {**quake("negative", 1.0, 1.0), "properties": {"radius": -5.0}},
+        quake("nan-mag", 2.0, 1.0, mag=float("nan")),
+        quake("huge-mag", 3.0, 1.0, mag=1e6)
+    ]
+    path = write_feed(tmp_path / "feed.geojson", broken + [quake("us1", 35.0, 139.0)])
+    store, feed = make_feed([path], hazards)
+
+    assert feed.poll()
+    assert [event["id"] for event in store.events()] == ["us1"]
@@ -0,0 +1,119 @@
+import threading
+
+from notifications import FakeSink, NotificationPipeline
+
+FRIENDS = {1: [2, 3], 2: [1], 3: [1], 4: [], 5: [1, 2]}
+
+
+class GatedSink(FakeSink):
+    """A `FakeSink` whose first `send` blocks until `release()`, holding up
+    the pipeline's worker while more notifications are queued behind it"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.started = threading.Event()
+        self._gate = threading.Event()
+
+    def release(self):
+        self._gate.set()
+
+    def send(self, messages):
+        self.started.set()
+        self._gate.wait(5)
+        super().send(messages)
+
+
+def pipeline(sink, **kwargs):
+    return NotificationPipeline(lambda user_id: FRIENDS[user_id], [sink], workers=1, **kwargs)
+
+
+def hold_worker(notifications, sink):
+    """Queue user 4's notification and wait until the worker is stuck delivering it"""
+    notifications.submit(4, "safe", {"id": 4})
+    assert sink.started.wait(5)
+
+
+def test_urgent_lanes_are_delivered_first():
+    sink = GatedSink()
+    notifications = pipeline(sink)
+    hold_worker(notifications, sink)
+
+    notifications.submit(1, "safe", {"id": 1})
+    notifications.submit(2, "alert", {"id": 2})
+    notifications.submit(3, "danger", {"id": 3})
+    assert notifications.stats()["queue_depth_by_status"] == {"danger": 1, "alert": 1, "safe": 1}
+    sink.release()
+
+    assert notifications.flush(5)
+    assert [[message["user_id"] for message in batch] for batch in sink.batches] == [[4], [3, 2, 1]]
+    assert notifications.stats()["delivered"] == 4
+
+
+def test_rapid_status_flips_coalesce_into_the_latest():
+    sink = GatedSink()
+    notifications = pipeline(sink)
+    hold_worker(notifications, sink)
+
+    notifications.submit(1, "safe", {"status": "safe"})
+    notifications.submit(1, "danger", {"status": "danger"}, alert={"id": 10})
+    notifications.submit(1, "safe", {"status": "safe"}, alert={"id": 11})
+    notifications.submit(2, "safe", {"status": "safe"})
+    # The merged notification keeps the most urgent lane it was in
+    assert notifications.stats()["queue_depth_by_status"] == {"danger": 1, "alert": 0, "safe": 1}
+    sink.release()
+
+    assert notifications.flush(5)
+    message = next(message for message in sink.messages if message["user_id"] == 1)
+    assert message["status"] == "safe"
+    assert message["payload"] == {"status": "safe"}
+    assert message["alerts"] == [{"id": 10}, {"id": 11}]
+    assert message["recipients"] == [1, 2, 3]
+    assert [message["user_id"] for message in sink.batches[1]] == [1, 2]
+    stats = notifications.stats()
+    assert (stats["enqueued"], stats["coalesced"], stats["delivered"]) == (5, 2, 3)
+
+
+def test_a_full_queue_displaces_less_urgent_notifications():
+    sink = GatedSink()
+    notifications = pipeline(sink, max_queue=2)
+    hold_worker(notifications, sink)
+
+    assert notifications.submit(1, "safe", {})
+    assert notifications.submit(2, "safe", {})
+    assert notifications.submit(3, "danger", {})
+    assert notifications.submit(5, "danger", {})
+    assert not notifications.submit(1, "alert", {})
+    sink.release()
+
+    assert notifications.flush(5)
+    assert sorted(message["user_id"] for message in sink.messages) == [3, 4, 5]
+    assert notifications.stats()["dropped"] == 3
+
+
+def test_failed_batches_are_retried_with_backoff():
+    sink = FakeSink(fail_first=2)
+    notifications = pipeline(sink, max_retries=3, retry_backoff=0.01)
+
+    notifications.submit(5, "danger", {"id": 5})
+
+    assert notifications.flush(5)
+    assert [message["recipients"] for message in sink.messages] == [[5, 1, 2]]
+    stats = notifications.stats()
+    assert (stats["retries"], stats["failed_batches"], stats["delivered"]) == (2, 0, 1)
+
+
+def test_a_batch_is_given_up_after_max_retries():
+    sink = FakeSink(fail_first=5)
+    notifications = pipeline(sink, max_retries=1, retry_backoff=0.01)
+
+    notifications.submit(1, "alert", {"id": 1})
+
+    assert notifications.flush(5)
+    assert sink.messages == []
+    stats = notifications.stats()
+    assert (stats["retries"], stats["failed_batches"]) == (1, 1)
+    # The next batch goes through once the sink recovers
+    sink.fail_first = 0
+    notifications.submit(2, "safe", {"id": 2})
+    assert notifications.flush(5)
+    assert [message["user_id"] for message in sink.messages] == [2]
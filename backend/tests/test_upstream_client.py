@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from stub_weather import SAMPLE_RESPONSE
+from upstream_client import CircuitBreaker, CircuitOpenError, UpstreamBusyError, UpstreamClient
+
+
+def fail(client, url, times):
+    for _ in range(times):
+        with pytest.raises(requests.HTTPError):
+            client.get_json(url)
+
+
+def test_breaker_opens_short_circuits_then_probes_and_closes(stub_weather):
+    server, url = stub_weather(error_rate=1.0)
+    client = UpstreamClient(failure_threshold=3, reset_timeout=0.3)
+
+    fail(client, url, 2)
+    assert client.breaker.state == "closed"
+    fail(client, url, 1)
+    assert client.breaker.state == "open"
+
+    # Open: nothing reaches the provider
+    calls = server.calls
+    started = time.monotonic()
+    with pytest.raises(CircuitOpenError):
+        client.get_json(url)
+    assert time.monotonic() - started < 0.1
+    assert server.calls == calls
+    assert client.stats()["short_circuited"] == 1
+
+    # Half-open: a failed probe opens the circuit again straight away
+    time.sleep(0.35)
+    assert client.breaker.state == "half_open"
+    fail(client, url, 1)
+    assert client.breaker.state == "open"
+    assert server.calls == calls + 1
+
+    # A successful probe closes it
+    time.sleep(0.35)
+    server.error_rate = 0.0
+    assert client.get_json(url) == SAMPLE_RESPONSE
+    assert client.breaker.state == "closed"
+    assert client.stats()["circuit"] == "closed"
+
+
+def test_half_open_lets_a_single_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    # A probe that was never made is handed back
+    breaker.cancel()
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_success_resets_the_failure_count(stub_weather):
+    server, url = stub_weather(error_rate=1.0)
+    client = UpstreamClient(failure_threshold=2)
+    fail(client, url, 1)
+    server.error_rate = 0.0
+    client.get_json(url)
+    server.error_rate = 1.0
+    fail(client, url, 1)
+    assert client.breaker.state == "closed"
+
+
+def test_a_slow_provider_times_out_on_the_read_timeout(stub_weather):
+    server, url = stub_weather(latency=1.0)
+    client = UpstreamClient(read_timeout=0.2, failure_threshold=1)
+
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        client.get_json(url)
+    assert time.monotonic() - started < 0.8
+    assert client.breaker.state == "open"
+
+
+def test_calls_beyond_the_in_flight_limit_are_rejected(stub_weather):
+    server, url = stub_weather(latency=0.5)
+    client = UpstreamClient(max_in_flight=1, acquire_timeout=0.05)
+    first = threading.Thread(target=client.get_json, args=(url,))
+    first.start()
+    time.sleep(0.1)
+
+    with pytest.raises(UpstreamBusyError):
+        client.get_json(url)
+    first.join()
+    stats = client.stats()
+    assert (stats["requests"], stats["rejected_busy"], stats["in_flight"]) == (1, 1, 0)
+    assert server.calls == 1
+    # Being busy says nothing about the provider's health
+    assert client.breaker.state == "closed"
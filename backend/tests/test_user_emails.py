@@ -0,0 +1,39 @@
+import pytest
+
+from sqlite_store import SQLiteStore
+from store import DEFAULT_EMAIL, EmailTaken, MemoryStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStore()
+    return SQLiteStore(str(tmp_path / "users.db"))
+
+
+def test_a_registered_email_is_taken_whatever_its_case(store):
+    store.add_user({"name": "Ann", "email": "ann@example.com"})
+    with pytest.raises(EmailTaken):
+        store.add_user({"name": "Other Ann", "email": " ANN@example.com"})
+    assert [user["name"] for user in store.all_users()] == ["Ann"]
+
+
+def test_missing_and_default_emails_are_not_indexed(store):
+    store.add_user({"name": "No email", "email": None})
+    store.add_user({"name": "No email either", "email": None})
+    store.add_user({"name": "Default", "email": DEFAULT_EMAIL})
+    store.add_user({"name": "Default again", "email": DEFAULT_EMAIL})
+
+    assert len(store.all_users()) == 4
+    assert store.get_user_by_email(DEFAULT_EMAIL) is None
+
+
+def test_duplicates_can_be_allowed_and_lookups_find_the_first(store):
+    first = store.add_user({"name": "Ann", "email": "ann@example.com"})
+    second = store.add_user({"name": "Ann again", "email": "ann@example.com"}, unique_email=False)
+    store.update_user(second, {"name": "Renamed"})
+
+    assert store.get_user_by_email("ann@example.com")["id"] == first["id"]
+    assert store.get_user(second["id"])["name"] == "Renamed"
+    with pytest.raises(EmailTaken):
+        store.add_user({"name": "Ann three", "email": "ann@example.com"})
@@ -0,0 +1,40 @@
+import threading
+
+from store import MemoryStore
+from user_search import normalise
+
+
+def test_searches_during_renames_only_return_matching_users():
+    store = MemoryStore()
+    # Small chunks, so renames keep splitting and emptying them
+    store._search._terms.chunk_size = 4
+    users = [store.add_user({"name": f"{'ab'[i % 2]}{i:04d} user", "email": None}) for i in range(400)]
+    stop = threading.Event()
+    problems = []
+
+    def rename(offset):
+        turn = 0
+        while not stop.is_set():
+            turn += 1
+            for user in users[offset::4]:
+                store.update_user(user, {"name": f"{'ab'[turn % 2]}{user['id']:04d} user"})
+
+    def search():
+        while not stop.is_set():
+            try:
+                for user in store.search_users("a0", 50):
+                    if not normalise(user["name"]).startswith("a0"):
+                        problems.append(user["name"])
+            except Exception as e:
+                problems.append(e)
+
+    threads = [threading.Thread(target=rename, args=(i,)) for i in range(4)]
+    threads += [threading.Thread(target=search) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    threading.Event().wait(1.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert problems == []
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import requests
+
+from stub_weather import SAMPLE_RESPONSE
+from upstream_client import UpstreamClient
+from weather_cache import WeatherCache
+
+
+def fetch_from(url):
+    client = UpstreamClient()
+    return lambda lat, lon: client.get_json(url, params={"lat": lat, "lon": lon})
+
+
+def get_concurrently(cache, points, loader):
+    """`cache.get` from one thread per point, all released together"""
+    barrier = threading.Barrier(len(points))
+    results, errors = [], []
+
+    def run(lat, lon):
+        barrier.wait()
+        try:
+            results.append(cache.get(lat, lon, loader))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=point) for point in points]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_misses_for_one_cell_share_an_upstream_call(stub_weather):
+    server, url = stub_weather(latency=0.3)
+    cache = WeatherCache(ttl=60)
+    # A few metres apart, so all in one geohash cell
+    points = [(40.7128 + i * 0.0001, -74.0060) for i in range(10)]
+
+    results, errors = get_concurrently(cache, points, fetch_from(url))
+
+    assert errors == []
+    assert results == [SAMPLE_RESPONSE] * 10
+    assert server.calls == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["in_flight"]) == (1, 9, 0)
+
+    assert cache.get(40.7129, -74.0061, fetch_from(url)) == SAMPLE_RESPONSE
+    assert cache.stats()["hits"] == 1
+    assert server.calls == 1
+
+
+def test_each_cell_loads_separately(stub_weather):
+    server, url = stub_weather()
+    cache = WeatherCache(ttl=60)
+    loader = fetch_from(url)
+
+    cache.get(40.71, -74.00, loader)
+    cache.get(51.50, -0.12, loader)
+
+    assert server.calls == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_a_failed_load_reaches_every_waiter_and_is_not_cached(stub_weather):
+    server, url = stub_weather(latency=0.3, error_rate=1.0)
+    cache = WeatherCache(ttl=60)
+
+    results, errors = get_concurrently(cache, [(40.7128, -74.0060)] * 5, fetch_from(url))
+
+    assert results == []
+    assert len(errors) == 5 and all(isinstance(e, requests.HTTPError) for e in errors)
+    assert server.calls == 1
+    assert cache.stats()["errors"] == 1
+    assert cache.peek(40.7128, -74.0060) is None
+
+
+def test_stale_entries_are_served_while_one_refresh_runs(stub_weather):
+    server, url = stub_weather()
+    cache = WeatherCache(ttl=0.05, stale_ttl=60)
+    loader = fetch_from(url)
+    cache.get(40.7128, -74.0060, loader)
+    time.sleep(0.1)
+    server.latency = 0.3
+
+    started = time.monotonic()
+    assert cache.get(40.7128, -74.0060, loader) == SAMPLE_RESPONSE
+    assert cache.get(40.7128, -74.0060, loader) == SAMPLE_RESPONSE
+    assert time.monotonic() - started < 0.2
+
+    stats = cache.stats()
+    assert (stats["stale_hits"], stats["refreshes"]) == (2, 1)
+    deadline = time.monotonic() + 5
+    while cache.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert server.calls == 2
+    assert cache.get(40.7128, -74.0060, loader) == SAMPLE_RESPONSE
+    assert cache.stats()["hits"] == 1
+
+
+def test_least_recently_used_cells_are_evicted():
+    cache = WeatherCache(ttl=60, max_entries=2)
+    loads = []
+
+    def loader(lat, lon):
+        loads.append((lat, lon))
+        return {"lat": lat}
+
+    cache.get(10.0, 10.0, loader)
+    cache.get(20.0, 20.0, loader)
+    cache.get(10.0, 10.0, loader)  # now the most recently used
+    cache.get(30.0, 30.0, loader)
+
+    assert cache.stats()["entries"] == 2
+    assert cache.peek(20.0, 20.0) is None
+    assert cache.peek(10.0, 10.0) == {"lat": 10.0}
+    assert cache.peek(30.0, 30.0) == {"lat": 30.0}
+    assert len(loads) == 3
@@ -0,0 +1,226 @@
+"""Shared HTTP client for upstream providers (OpenWeatherMap).
+
+One `requests.Session` keeps connections alive across calls, so requests do
+not each pay for a new TCP/TLS handshake. Connect and read timeouts are set
+separately, a semaphore caps how many calls are in flight at once, and a
+circuit breaker fails fast while the provider is down. Callers then serve
+cached or mock data right away instead of tying up a worker until a timeout.
+
+`get_json_async` is the same call for asyncio code (the ASGI entry point),
+made with httpx so the request is awaited rather than holding a thread. It
+shares the breaker and statistics with the blocking client.
+"""
+import asyncio
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import Histogram
+
+try:
+    import httpx
+except ImportError:  # only needed for get_json_async
+    httpx = None
+
+
+class UpstreamError(Exception):
+    """Base class for upstream failures raised by the client"""
+
+
+class CircuitOpenError(UpstreamError):
+    """The provider has been failing and calls are short-circuited"""
+
+
+class UpstreamBusyError(UpstreamError):
+    """Too many upstream calls are already in flight"""
+
+
+class UpstreamResponseError(UpstreamError):
+    """The provider answered with something that is not JSON"""
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open probe -> closed"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self):
+        """Whether a call may go ahead right now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            # Let a single probe through to test whether the provider is back
+            self._probing = True
+            return True
+
+    def cancel(self):
+        """Give back a probe granted by `allow` that was never made"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class UpstreamClient:
+    """Pooled, concurrency-limited JSON GET client guarded by a breaker"""
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=5.0,
+                 max_in_flight=8, acquire_timeout=0.5,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.timeout = (connect_timeout, read_timeout)
+        self.acquire_timeout = acquire_timeout
+        self.pool_size = pool_size
+        self.max_in_flight = max_in_flight
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._async_client = None
+        self._async_slots = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "failures": 0,
+            "short_circuited": 0,
+            "rejected_busy": 0,
+            "in_flight": 0
+        }
+        self.latency = Histogram()  # seconds per call that reached the network
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self._stats[name] += delta
+
+    def get_json(self, url, params=None):
+        """GET a URL and decode its JSON body.
+
+        Raises `CircuitOpenError` or `UpstreamBusyError` without touching the
+        network, and `requests.RequestException`/`UpstreamResponseError` when
+        the call itself fails.
+        """
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise CircuitOpenError("upstream circuit is open")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self.breaker.cancel()
+            self._count("rejected_busy")
+            raise UpstreamBusyError("too many upstream requests in flight")
+
+        self._count("requests")
+        self._count("in_flight")
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except requests.RequestException:
+            self._count("failures")
+            self.breaker.record_failure()
+            raise
+        except ValueError as e:
+            self._count("failures")
+            self.breaker.record_failure()
+            raise UpstreamResponseError("upstream returned invalid JSON") from e
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+            self._count("in_flight", -1)
+            self._slots.release()
+        self.breaker.record_success()
+        return data
+
+    async def get_json_async(self, url, params=None):
+        """`get_json` for coroutines. Without httpx installed, the blocking
+        call runs on the loop's default executor instead"""
+        if httpx is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.get_json, url, params)
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise CircuitOpenError("upstream circuit is open")
+        client, slots = self._async_session()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.breaker.cancel()
+            self._count("rejected_busy")
+            raise UpstreamBusyError("too many upstream requests in flight") from None
+
+        self._count("requests")
+        self._count("in_flight")
+        started = time.perf_counter()
+        try:
+            response = await client.get(url, params=params)
+            response.raise_for_status()
+            data = response.json()
+        except httpx.HTTPError:
+            self._count("failures")
+            self.breaker.record_failure()
+            raise
+        except ValueError as e:
+            self._count("failures")
+            self.breaker.record_failure()
+            raise UpstreamResponseError("upstream returned invalid JSON") from e
+        except asyncio.CancelledError:
+            self.breaker.cancel()  # the caller left; this says nothing about upstream
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+            self._count("in_flight", -1)
+            slots.release()
+        self.breaker.record_success()
+        return data
+
+    def _async_session(self):
+        # Created on first use, inside the event loop that will use them
+        if self._async_client is None:
+            connect_timeout, read_timeout = self.timeout
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size)
+            )
+            self._async_slots = asyncio.Semaphore(self.max_in_flight)
+        return self._async_client, self._async_slots
+
+    async def aclose(self):
+        """Close the asyncio connection pool, if one was opened"""
+        client, self._async_client = self._async_client, None
+        if client is not None:
+            await client.aclose()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["circuit"] = self.breaker.state
+        return stats
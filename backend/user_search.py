@@ -0,0 +1,350 @@
+"""Typeahead search over user names, emails and phone numbers.
+
+Each user is reduced to a few search terms: the words of their name, their
+email address and the digits of their phone number, lowercased and with
+accents removed. Two indexes are kept over them:
+
+- `SortedTerms`, every `(term, user_id)` in order, so the terms starting
+  with what was typed are found with one bisect and read off in
+  alphabetical order, and
+- trigram postings, so text inside a term ("smith" in "goldsmith", "4567"
+  in a phone number) only needs checking against the users listed under
+  the query's rarest trigram.
+
+A user matches when every word typed starts one of their terms (a prefix
+match) or, failing that, appears anywhere in their text (a substring
+match; words of three characters or more). Friends come first, then prefix
+matches, then substring matches. Each stage stops as soon as `limit` users
+are found, so a query costs about the same with a thousand users or a
+million.
+"""
+import re
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+WORD = re.compile(r"\w+")
+PHONE_QUERY = re.compile(r"\+?[\d\s().-]*\d[\d\s().-]*")
+PREFIX, SUBSTRING = 0, 1
+# Candidates past this many are narrowed down by intersecting posting lists
+INTERSECT_ABOVE = 1000
+_EMPTY = array("I")
+
+
+def normalise(text):
+    """Lowercase text with accents removed, so "José" is found by "jose" """
+    text = str(text).lower()
+    if text.isascii():
+        return text
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def search_terms(name, email, phone):
+    """`(text, *terms)`: the text searched for substrings, then the prefix-searchable terms.
+
+    The text leaves out the email domain, which most users share with
+    thousands of others; a whole address still matches as a prefix.
+    """
+    name = normalise(name or "").strip()
+    email = normalise(email or "").strip()
+    digits = "".join(c for c in str(phone or "") if c.isdigit())
+    # Name words repeat across users, so each is stored once
+    words = [sys.intern(word) for word in WORD.findall(name)]
+    terms = dict.fromkeys(term for term in words + [email, digits] if term)
+    # Query words never contain whitespace, so no match can span two fields
+    return ("\n".join((name, email.partition("@")[0], digits)), *terms)
+
+
+def query_words(query):
+    """What was typed, split into words; a phone number becomes its digits"""
+    query = normalise(query).strip()
+    if PHONE_QUERY.fullmatch(query):
+        return ["".join(c for c in query if c.isdigit())]
+    return query.split()
+
+
+def match_kind(words, doc):
+    """PREFIX when every word starts one of a `search_terms` doc's terms;
+    SUBSTRING when the rest (3+ characters each) at least appear in its
+    text; otherwise None"""
+    text = doc[0]
+    kind = PREFIX
+    for word in words:
+        if any(doc[i].startswith(word) for i in range(1, len(doc))):
+            continue
+        if len(word) < 3 or word not in text:
+            return None
+        kind = SUBSTRING
+    return kind
+
+
+def could_match(words, text):
+    """Cheap test ruling out most users before `match_kind`: a word that
+    starts a term is also in the text, unless it runs into the email domain"""
+    return all(word in text or "@" in word for word in words)
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2) if "\n" not in text[i:i + 3]}
+
+
+def substring_candidates(postings):
+    """User ids from the shortest of `postings`, in order. After the first
+    INTERSECT_ABOVE, the rest are first narrowed to ids also in the next
+    shortest lists, which sets do in C far faster than checking each id."""
+    postings = sorted(postings, key=len)
+    first = postings[0]
+    yield from islice(first, INTERSECT_ABOVE)
+    if len(first) > INTERSECT_ABOVE:
+        rest = set(first[INTERSECT_ABOVE:])
+        for other in postings[1:3]:
+            rest.intersection_update(other)
+        yield from sorted(rest)
+
+
+class SortedTerms:
+    """`(term, user_id)` pairs in term order, kept in chunks so an insert or
+    delete only shifts a few hundred entries rather than the whole index.
+    Each chunk is a list of terms beside an array of ids, which is far
+    smaller than a tuple per pair."""
+
+    def __init__(self, chunk_size=512):
+        self.chunk_size = chunk_size
+        self._terms = []  # per chunk, a sorted list of terms
+        self._ids = []  # per chunk, the user id of each term
+        self._maxes = []  # last term of each chunk
+        self._owned = []  # per chunk, False while a copy shares it
+
+    def __len__(self):
+        return sum(len(terms) for terms in self._terms)
+
+    def add(self, term, user_id):
+        if not self._terms:
+            self._terms.append([term])
+            self._ids.append(array("I", [user_id]))
+            self._maxes.append(term)
+            self._owned.append(True)
+            return
+        index = min(bisect_left(self._maxes, term), len(self._maxes) - 1)
+        terms, ids = self._own(index)
+        position = bisect_right(terms, term)
+        terms.insert(position, term)
+        ids.insert(position, user_id)
+        self._maxes[index] = terms[-1]
+        if len(terms) > 2 * self.chunk_size:
+            half = len(terms) // 2
+            self._terms[index:index + 1] = [terms[:half], terms[half:]]
+            self._ids[index:index + 1] = [ids[:half], ids[half:]]
+            self._maxes[index:index + 1] = [terms[half - 1], terms[-1]]
+            self._owned[index:index + 1] = [True, True]
+
+    def remove(self, term, user_id):
+        index = bisect_left(self._maxes, term)
+        while index < len(self._maxes):
+            terms, ids = self._terms[index], self._ids[index]
+            position = bisect_left(terms, term)
+            while position < len(terms) and terms[position] == term:
+                if ids[position] == user_id:
+                    terms, ids = self._own(index)
+                    del terms[position]
+                    del ids[position]
+                    if terms:
+                        self._maxes[index] = terms[-1]
+                    else:
+                        del self._terms[index], self._ids[index], self._maxes[index], self._owned[index]
+                    return
+                position += 1
+            if position < len(terms):
+                return
+            index += 1  # equal terms can run on into the next chunk
+
+    def _own(self, index):
+        """Chunk `index`, copied first if a copy still shares it"""
+        if not self._owned[index]:
+            self._terms[index] = list(self._terms[index])
+            self._ids[index] = self._ids[index][:]
+            self._owned[index] = True
+        return self._terms[index], self._ids[index]
+
+    def copy(self):
+        """A copy sharing every chunk with this one. Whichever side changes a
+        chunk first copies it, so copying only costs a pointer per chunk."""
+        other = SortedTerms(self.chunk_size)
+        other._terms = list(self._terms)
+        other._ids = list(self._ids)
+        other._maxes = list(self._maxes)
+        self._owned = [False] * len(self._terms)
+        other._owned = list(self._owned)
+        return other
+
+    def chunks(self):
+        """`(terms, ids)` per chunk, in order"""
+        return zip(self._terms, self._ids)
+
+    def append_chunk(self, terms, ids):
+        """Add a chunk whose terms all sort after everything already here"""
+        if terms:
+            self._terms.append(terms)
+            self._ids.append(ids)
+            self._maxes.append(terms[-1])
+            self._owned.append(True)
+
+    def starting_at(self, term):
+        """`(term, user_id)` from the first term >= `term` onwards, in order"""
+        index = bisect_left(self._maxes, term)
+        position = bisect_left(self._terms[index], term) if index < len(self._maxes) else 0
+        while index < len(self._terms):
+            terms, ids = self._terms[index], self._ids[index]
+            while position < len(terms):
+                yield terms[position], ids[position]
+                position += 1
+            index += 1
+            position = 0
+
+
+class UserSearchIndex:
+    """Prefix and substring search over users, updated as they change.
+
+    Not thread-safe: callers serialise every call, searches included (the
+    store does so under its lock). Trigram postings are append-only, and an
+    entry left behind by an update is dropped by the check against the
+    user's current text. The postings are rebuilt once such entries
+    outnumber live ones.
+    """
+
+    def __init__(self):
+        self._docs = {}  # user_id -> (text, *terms)
+        self._terms = SortedTerms()
+        self._postings = {}  # trigram -> array of user ids
+        self._live = 0
+        self._stale = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, user_id, name, email, phone):
+        self.update(user_id, name, email, phone)
+
+    def update(self, user_id, name, email, phone):
+        doc = search_terms(name, email, phone)
+        old = self._docs.get(user_id)
+        if old == doc:
+            return
+        if old is not None:
+            for term in old[1:]:
+                self._terms.remove(term, user_id)
+            self._stale += len(trigrams(old[0]))
+        self._docs[user_id] = doc
+        for term in doc[1:]:
+            self._terms.add(term, user_id)
+        for gram in trigrams(doc[0]):
+            self._postings.setdefault(gram, array("I")).append(user_id)
+            self._live += 1
+        if self._stale > self._live:
+            self._rebuild_postings()
+
+    def _rebuild_postings(self):
+        postings = {}
+        for user_id, doc in self._docs.items():
+            for gram in trigrams(doc[0]):
+                postings.setdefault(gram, array("I")).append(user_id)
+        self._postings = postings
+        self._live = sum(len(ids) for ids in postings.values())
+        self._stale = 0
+
+    def snapshot(self, chunk_size=4096):
+        """Copy the index and return an iterator of picklable `(kind, payload)`
+        chunks for `load`. Only the copy needs the caller's lock: posting
+        arrays only ever grow, so they are read later up to their length now."""
+        docs = dict(self._docs)
+        terms = self._terms.copy()
+        postings = [(gram, ids, len(ids)) for gram, ids in self._postings.items()]
+        return self._snapshot_chunks(docs, terms, postings, chunk_size)
+
+    @staticmethod
+    def _snapshot_chunks(docs, terms, postings, chunk_size):
+        items = list(docs.items())
+        for start in range(0, len(items), chunk_size):
+            yield "docs", items[start:start + chunk_size]
+        # A term is saved as its position in the user's doc, so that once
+        # loaded it is the same string object as the one in the doc
+        for chunk_terms, chunk_ids in terms.chunks():
+            positions = array("I", [docs[user_id].index(term) for term, user_id in zip(chunk_terms, chunk_ids)])
+            yield "terms", (chunk_ids.tobytes(), positions.tobytes())
+        for start in range(0, len(postings), chunk_size):
+            yield "postings", [(gram, ids[:length].tobytes()) for gram, ids, length in postings[start:start + chunk_size]]
+
+    @classmethod
+    def load(cls, chunks):
+        """An index rebuilt from `snapshot` chunks"""
+        index = cls()
+        docs = index._docs
+        for kind, payload in chunks:
+            if kind == "docs":
+                for user_id, doc in payload:
+                    # Name words are shared between users again, as `search_terms` does
+                    docs[user_id] = (doc[0],) + tuple(
+                        term if "@" in term or term.isdigit() else sys.intern(term) for term in doc[1:]
+                    )
+            elif kind == "terms":
+                ids, positions = array("I"), array("I")
+                ids.frombytes(payload[0])
+                positions.frombytes(payload[1])
+                index._terms.append_chunk([docs[user_id][i] for user_id, i in zip(ids, positions)], ids)
+            elif kind == "postings":
+                for gram, data in payload:
+                    ids = array("I")
+                    ids.frombytes(data)
+                    index._postings[gram] = ids
+                    index._live += len(ids)
+        return index
+
+    def search(self, query, limit=10, friend_ids=(), exclude=None):
+        """Up to `limit` user ids matching `query`, ranked as described above"""
+        words = query_words(query)
+        if not words or limit < 1:
+            return []
+        docs = self._docs
+        found = []
+        seen = {exclude}
+
+        ranked_friends = []
+        for friend_id in friend_ids:
+            doc = docs.get(friend_id)
+            kind = match_kind(words, doc) if doc and could_match(words, doc[0]) else None
+            if kind is not None and friend_id not in seen:
+                seen.add(friend_id)
+                ranked_friends.append((kind, doc[0], friend_id))
+        found.extend(friend_id for _, _, friend_id in sorted(ranked_friends)[:limit])
+
+        # Scanning on the longest word visits the fewest terms
+        lead = max(words, key=len)
+        if len(found) < limit:
+            for term, user_id in self._terms.starting_at(lead):
+                if not term.startswith(lead):
+                    break
+                if user_id in seen:
+                    continue
+                if len(words) > 1 and not (could_match(words, docs[user_id][0])
+                                           and match_kind(words, docs[user_id]) == PREFIX):
+                    continue
+                seen.add(user_id)
+                found.append(user_id)
+                if len(found) >= limit:
+                    return found
+
+        if len(lead) >= 3 and len(found) < limit:
+            grams = set().union(*(trigrams(word) for word in words if len(word) >= 3))
+            for user_id in substring_candidates([self._postings.get(gram, _EMPTY) for gram in grams]):
+                if user_id in seen:
+                    continue
+                doc = docs.get(user_id)
+                if doc is None or not could_match(words, doc[0]) or match_kind(words, doc) is None:
+                    continue
+                seen.add(user_id)
+                found.append(user_id)
+                if len(found) >= limit:
+                    break
+        return found
@@ -0,0 +1,189 @@
+"""Cache for upstream weather conditions.
+
+Entries are keyed by geohash cell rather than exact coordinates, so every
+request within a few kilometres shares one upstream call. Each entry is fresh
+for `ttl` seconds. For a further `stale_ttl` seconds it is still served while
+a single background refresh runs. Concurrent misses for the same cell wait on
+the one in-flight load instead of each calling the provider.
+
+`get_async` does the same for asyncio callers, with loads that are awaited
+rather than run on threads. It shares the cached entries with `get`, but
+coalesces only with other asyncio callers.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from geo import geohash_encode
+
+
+class _Flight:
+    """An upstream load in progress that other requests can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WeatherCache:
+    """TTL + LRU cache with stale-while-revalidate and request coalescing"""
+
+    def __init__(self, ttl=1800, stale_ttl=600, max_entries=10000, precision=5):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # cell -> (expires_at, payload)
+        self._flights = {}
+        self._async_flights = {}  # cell -> asyncio.Future
+        self._tasks = set()  # background refreshes, referenced until done
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "refreshes": 0,
+            "errors": 0
+        }
+
+    def key_for(self, lat, lon):
+        return geohash_encode(lat, lon, self.precision)
+
+    def get(self, lat, lon, loader):
+        """Return the cached payload for a point, loading it if needed.
+
+        `loader(lat, lon)` is called with the coordinates of the request that
+        triggered the load. Errors from a load propagate to every request that
+        was waiting on it.
+        """
+        key = self.key_for(lat, lon)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return payload
+                if now < expires_at + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["stale_hits"] += 1
+                    if key not in self._flights:
+                        self._flights[key] = _Flight()
+                        self._stats["refreshes"] += 1
+                        threading.Thread(
+                            target=self._load, args=(key, lat, lon, loader), daemon=True
+                        ).start()
+                    return payload
+
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self._stats["misses"] += 1
+                leader = True
+
+        if leader:
+            self._load(key, lat, lon, loader)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    async def get_async(self, lat, lon, loader):
+        """`get` for coroutines; `loader(lat, lon)` is awaited"""
+        key = self.key_for(lat, lon)
+        now = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return payload
+                if now < expires_at + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["stale_hits"] += 1
+                    if key not in self._async_flights:
+                        self._stats["refreshes"] += 1
+                        self._start_async_load(loop, key, lat, lon, loader)
+                    return payload
+
+            future = self._async_flights.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+            else:
+                self._stats["misses"] += 1
+                future = self._start_async_load(loop, key, lat, lon, loader)
+
+        # The load runs as its own task, so a caller that goes away does not
+        # cancel it for everyone else waiting on it
+        return await asyncio.shield(future)
+
+    def _start_async_load(self, loop, key, lat, lon, loader):
+        future = self._async_flights[key] = loop.create_future()
+        # Mark errors as seen even when nobody awaits (background refreshes)
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        task = loop.create_task(self._load_async(key, lat, lon, loader))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return future
+
+    async def _load_async(self, key, lat, lon, loader):
+        future = self._async_flights[key]
+        try:
+            result, error = await loader(lat, lon), None
+        except Exception as e:
+            result, error = None, e
+        with self._lock:
+            if error is None:
+                self._entries[key] = (time.monotonic() + self.ttl, result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._stats["errors"] += 1
+            del self._async_flights[key]
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def peek(self, lat, lon):
+        """Any payload held for a point's cell, even past its stale window"""
+        with self._lock:
+            entry = self._entries.get(self.key_for(lat, lon))
+            return entry[1] if entry is not None else None
+
+    def _load(self, key, lat, lon, loader):
+        flight = self._flights[key]
+        try:
+            flight.result = loader(lat, lon)
+        except Exception as e:
+            flight.error = e
+        with self._lock:
+            if flight.error is None:
+                self._entries[key] = (time.monotonic() + self.ttl, flight.result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._stats["errors"] += 1
+            del self._flights[key]
+        flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["in_flight"] = len(self._flights) + len(self._async_flights)
+            return stats